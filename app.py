@@ -1,15 +1,43 @@
 
 import os
+import json
+import mimetypes
 import secrets
-from flask import Flask, render_template, request, redirect, url_for, session, flash, send_from_directory, jsonify
+import uuid
+import itertools
+from flask import Flask, Response, stream_with_context, render_template, request, redirect, url_for, session, flash, send_from_directory, send_file, jsonify, abort, g
 from werkzeug.utils import secure_filename
 from utils import (
     process_audio_only, process_text_only, process_audio_and_text,
     upload_file_to_kintone, upload_to_kintone, save_audio_file,
-    STAFF_OPTIONS, SALES_ACTIVITY_OPTIONS, NEXT_SALES_ACTIVITY_OPTIONS, init_gemini, search_clients, calculate_smart_next_date
+    STAFF_OPTIONS, SALES_ACTIVITY_OPTIONS, NEXT_SALES_ACTIVITY_OPTIONS, init_gemini, search_clients, calculate_smart_next_date, fetch_client_histories,
+    fresh_extraction
+)
+from usage import usage_scope, summarize_usage
+import client_index
+import client_matcher
+import report_mirror
+import similar_reports
+import staging
+import transcripts
+import health
+import resilience
+import profiling
+import webhooks
+import export_reports
+import live
+import attachments
+import cache
+import history_summary
+import form_schema  # noqa: F401  (registers the schema warm-up and watcher)
+import batch
+from response_cache import (
+    render_cache, search_cache, strong_etag, template_version, history_etag, search_key, etag_matches,
+    SEARCH_MAX_AGE,
 )
 
-app = Flask(__name__)
+# Static files go through serve_static (Flask's built-in /static route would shadow it)
+app = Flask(__name__, static_folder=None)
 app.secret_key = os.environ.get("FLASK_SECRET_KEY", secrets.token_hex(32))
 
 # --- Configuration ---
@@ -17,19 +45,201 @@ app.secret_key = os.environ.get("FLASK_SECRET_KEY", secrets.token_hex(32))
 APP_PASSWORD = os.environ.get("APP_PASSWORD", "")
 UPLOAD_FOLDER = 'saved_audio'
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+MAX_HISTORY_CLIENTS = 200  # per /api/client_histories request
+
+STATIC_FOLDER = 'static'
+# Written by build_assets.py: logical name -> content-hashed path under static/dist
+ASSET_MANIFEST_PATH = os.path.join(STATIC_FOLDER, 'dist', 'asset-manifest.json')
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+PRECOMPRESSED = [('br', '.br'), ('gzip', '.gz')]
+
+def load_asset_manifest():
+    try:
+        with open(ASSET_MANIFEST_PATH, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        # Not built yet: fall back to the unhashed source files
+        return {}
+
+ASSET_MANIFEST = load_asset_manifest()
+
+@app.template_global()
+def asset_url(name):
+    return f"/static/{ASSET_MANIFEST.get(name, name)}"
+
+# Changes whenever a template or a fingerprinted asset changes (i.e. on deploy)
+TEMPLATE_VERSION = template_version(extra=ASSET_MANIFEST)
+
+# --- Helpers (shared with the async entry point in asgi.py) ---
+
+def complete_extraction(data, mode, client_id, client_name):
+    # Inject client info if available
+    if client_id:
+        data['取引先ID'] = client_id
+        data['取引先名'] = client_name # For display
+        
+    # Ensure Next Proposal Date is filled (Default: 3 days later, skip weekends)
+    # Only for Sales Report mode
+    if mode != 'qa' and not data.get('次回提案予定日'):
+        data['次回提案予定日'] = calculate_smart_next_date(data.get('対応日'))
+    return data
+
+def confirm_context(data, file_path, staff_name, mode, memo=""):
+    client_candidates = []
+    if mode != 'qa' and not data.get('取引先ID'):
+        # No client picked: pre-fill the one named in the memo / extracted text if it
+        # is a clear match, otherwise only offer the candidates
+        client_candidates = client_matcher.suggest_clients(memo, *data.values())
+        if client_matcher.confident(client_candidates):
+            data['取引先ID'] = client_candidates[0]['record_id']
+            data['取引先名'] = client_candidates[0]['name']
+    return dict(data=data, file_path=file_path or "", memo=memo, staff_name=staff_name, sales_options=SALES_ACTIVITY_OPTIONS, next_sales_options=NEXT_SALES_ACTIVITY_OPTIONS, staff_options=STAFF_OPTIONS, mode=mode, client_candidates=client_candidates)
+
+def conditional_response(etag, build_body, mimetype='text/html', cache_control='private, no-cache', should_cache=None):
+    # 304 if the client already has this exact body, otherwise serve it from the render cache
+    headers = {'ETag': f'"{etag}"', 'Cache-Control': cache_control}
+    if etag_matches(request.headers.get('If-None-Match'), etag):
+        return Response(status=304, headers=headers)
+    body = render_cache.get(etag)
+    if body is None:
+        body = build_body()
+        if should_cache is not None and not should_cache():
+            # e.g. a failed AI summary: send it once, but don't pin it to this ETag
+            return Response(body, mimetype=mimetype, headers={'Cache-Control': 'no-store'})
+        render_cache.set(etag, body)
+    return Response(body, mimetype=mimetype, headers=headers)
+
+def has_pending_flashes():
+    # Pages showing flash messages are per-visit and must not be cached
+    return bool(session.get('_flashes'))
+
+def cached_client_search(keyword):
+    # The local client index answers without Kintone once it has been built
+    index = client_index.load()
+    if index is not None:
+        return index.search(keyword)
+    key = search_key(keyword)
+    results = search_cache.get(key)
+    if results is None:
+        results = search_clients(keyword)
+        if results:
+            search_cache.set(key, results)
+    return results
+
+def split_save_form(form_data):
+    # Reconstruct data dict for kintone
+    file_path = form_data.pop('file_path', '')
+    form_data.pop('memo', None)
+    staff_name = form_data.pop('staff_name', '')
+    data = form_data
+    # Add staff info if needed by utils (it is, see utils.py:264)
+    data['対応者'] = staff_name
+    return data, file_path
+
+def split_batch_fields(form_data):
+    # A save from the batch review queue: (batch_id, draft_index, file_key), not Kintone fields
+    return form_data.pop('batch_id', ''), form_data.pop('draft_index', ''), form_data.pop('file_key', '')
+
+def after_save_target(batch_id, draft_index, success):
+    # Batch drafts go back to their review queue (marked saved on success)
+    if batch_id and draft_index.isdigit():
+        if success:
+            batch.mark_draft(batch_id, int(draft_index), 'saved')
+        return f'/batch/{batch_id}'
+    return '/'
+
+def saved_audio_path(file_path):
+    # Only recordings we stored ourselves may be re-read from a posted path
+    if not file_path:
+        return ''
+    real = os.path.realpath(file_path)
+    if os.path.dirname(real) != os.path.realpath(UPLOAD_FOLDER) or not os.path.isfile(real):
+        return ''
+    return file_path
+
+def extraction_reference(client_id, text_input, mode):
+    # The client's most similar past reports keep wording consistent across reps
+    if mode == 'qa':
+        return ''
+    try:
+        return similar_reports.prompt_reference(client_id, text_input)
+    except Exception as e:
+        print(f"Similar Reports Error: {e}")
+        return ''
+
+def extract_audio(saved_path, text_input, mode, reference='', uploaded_file=None):
+    if transcripts.AUDIO_PIPELINE == 'transcript':
+        # Transcribe once, extract from text; later mode switches reuse the transcript
+        return transcripts.process_audio(saved_path, text_input, mode, reference=reference, uploaded_file=uploaded_file)
+    if text_input:
+        return process_audio_and_text(saved_path, text_input, mode, reference=reference, uploaded_file=uploaded_file)
+    return process_audio_only(saved_path, mode, reference=reference, uploaded_file=uploaded_file)
+
+def claim_staged(staged_id, has_audio):
+    # A file posted with the form wins over an earlier staged one
+    if has_audio or not staged_id:
+        return None
+    return staging.claim(staged_id)
 
 # --- Routes ---
 
 @app.route('/static/<path:filename>')
 def serve_static(filename):
-    return send_from_directory('static', filename)
+    if not filename.startswith('dist/'):
+        # Unhashed URLs (manifest.json, dev fallback) must revalidate; answered with 304 via ETag
+        response = send_from_directory(STATIC_FOLDER, filename)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    # Fingerprinted: the URL changes whenever the content does, so cache forever.
+    # Send the precompressed sibling the client accepts, if the build produced one.
+    accepted = request.headers.get('Accept-Encoding', '')
+    response = None
+    for encoding, suffix in PRECOMPRESSED:
+        if encoding in accepted and os.path.isfile(os.path.join(STATIC_FOLDER, filename + suffix)):
+            mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+            response = send_from_directory(STATIC_FOLDER, filename + suffix, mimetype=mimetype)
+            response.headers['Content-Encoding'] = encoding
+            break
+    if response is None:
+        response = send_from_directory(STATIC_FOLDER, filename)
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+@app.before_request
+def start_profiling():
+    # Nothing to do unless PROFILE_THRESHOLD_MS is set or the debug header carries PROFILE_TOKEN
+    if request.endpoint == 'serve_static':
+        return
+    trigger = profiling.wanted(request.headers.get(profiling.DEBUG_HEADER, ''))
+    if trigger:
+        g.profile = profiling.start(trigger)
+
+@app.after_request
+def stop_profiling(response):
+    profile = g.pop('profile', None)
+    if profile is not None:
+        name = profiling.stop(profile, method=request.method, path=request.path,
+                              endpoint=request.endpoint or '', status=response.status_code)
+        if name and profile.trigger == 'header':
+            response.headers['X-Profile-Id'] = name
+    return response
+
+@app.teardown_request
+def discard_profile(exc):
+    # after_request didn't run (e.g. the response failed to build): stop sampling this thread
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profiling.stop(profile, method=request.method, path=request.path,
+                       endpoint=request.endpoint or '', status=500, error=repr(exc))
 
 @app.before_request
 def check_auth():
     # Allow static resources to be served without login (for icon loading on iOS)
     if request.endpoint == 'serve_static':
         return
-    if request.endpoint == 'login':
+    if request.endpoint in ('login', 'healthz', 'readyz', 'kintone_webhook'):
         return
     if APP_PASSWORD and not session.get('authenticated'):
         return redirect(url_for('login'))
@@ -46,37 +256,264 @@ def login():
             flash('パスワードが違います', 'error')
     return render_template('login.html')
 
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    # Liveness: the process answers; says nothing about Kintone / Gemini
+    return jsonify({'status': 'ok'})
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    # Readiness: 503 until this worker has warmed its connections
+    body = health.readiness()
+    if APP_PASSWORD and not session.get('authenticated'):
+        # Probes are anonymous: latency and status only, no error details
+        for dep in body['dependencies'].values():
+            dep.pop('last_error', None)
+    return jsonify(body), 200 if body['ready'] else 503
+
 @app.route('/api/search_clients', methods=['GET'])
 def search_clients_route():
     keyword = request.args.get('q', '')
     if not keyword:
         return jsonify([])
-    results = search_clients(keyword)
-    return jsonify(results)
+    body = json.dumps(cached_client_search(keyword), ensure_ascii=False)
+    return conditional_response(strong_etag('search', body), lambda: body, mimetype='application/json',
+                                cache_control=f'private, max-age={SEARCH_MAX_AGE}')
+
+@app.route('/api/client_index', methods=['GET'])
+def client_index_route():
+    # Whole client directory for local typeahead; versioned, gzip-precompressed
+    index = client_index.get_index()
+    if index is None:
+        return jsonify({'error': 'client index unavailable'}), 503
+    gzip_ok = 'gzip' in request.headers.get('Accept-Encoding', '')
+    etag = f"ci-{index.epoch}-{index.version}{'-gz' if gzip_ok else ''}"
+    headers = {'ETag': f'"{etag}"', 'Cache-Control': 'private, no-cache', 'Vary': 'Accept-Encoding'}
+    if etag_matches(request.headers.get('If-None-Match'), etag):
+        return Response(status=304, headers=headers)
+    if gzip_ok:
+        headers['Content-Encoding'] = 'gzip'
+    return Response(index.payload_bytes(compressed=gzip_ok), mimetype='application/json', headers=headers)
+
+@app.route('/api/client_index/delta', methods=['GET'])
+def client_index_delta_route():
+    index = client_index.get_index()
+    if index is None:
+        return jsonify({'error': 'client index unavailable'}), 503
+    epoch = request.args.get('epoch', '')
+    since = request.args.get('since', -1, type=int)
+    return jsonify(index.delta(epoch, since))
+
+@app.route('/api/client_histories', methods=['GET'])
+def client_histories_route():
+    # Several clients' recent reports in a few batched Kintone queries (e.g. today's visits)
+    client_ids = request.args.getlist('client_id')[:MAX_HISTORY_CLIENTS]
+    if not client_ids:
+        return jsonify({'error': 'client_id is required'}), 400
+    limit = min(max(request.args.get('limit', 5, type=int), 1), 100)
+    try:
+        since = export_reports.parse_date(request.args.get('since', ''))
+    except ValueError:
+        return jsonify({'error': 'since must be YYYY-MM-DD'}), 400
+    histories = fetch_client_histories(client_ids, limit=limit, since=since)
+    return jsonify({'histories': histories, 'missing': [cid for cid in dict.fromkeys(client_ids) if cid not in histories]})
+
+@app.route('/api/usage', methods=['GET'])
+def usage_route():
+    # Token / cost aggregation over the Gemini usage log
+    hours = request.args.get('hours', 24, type=float)
+    limit = request.args.get('limit', 5, type=int)
+    return jsonify(summarize_usage(hours=hours, limit=limit))
+
+@app.route('/api/cache', methods=['GET'])
+def cache_stats_route():
+    # Backend size and per-namespace hit rates (this worker)
+    return jsonify(cache.stats())
+
+@app.route('/api/cache/invalidate', methods=['POST'])
+def cache_invalidate_route():
+    namespace = (request.get_json(silent=True) or {}).get('namespace') or request.form.get('namespace', '')
+    if not namespace:
+        return jsonify({'error': 'namespace is required'}), 400
+    return jsonify({'namespace': namespace, 'removed': cache.invalidate(namespace)})
+
+@app.route('/api/export/reports', methods=['GET'])
+def export_reports_route():
+    # ?format=csv|parquet&from=YYYY-MM-DD&to=YYYY-MM-DD&staff=...&activity=... (staff / activity repeatable)
+    fmt = request.args.get('format', 'csv')
+    if fmt not in export_reports.FORMATS:
+        return jsonify({'error': f'unknown format: {fmt}'}), 400
+    if fmt == 'parquet' and not export_reports.parquet_available():
+        return jsonify({'error': 'Parquet export requires pyarrow'}), 501
+    if not export_reports.configured():
+        return jsonify({'error': 'Kintoneの設定が不足しています。'}), 503
+    date_from, date_to = request.args.get('from', ''), request.args.get('to', '')
+    try:
+        query = export_reports.build_query(date_from, date_to, request.args.getlist('staff'), request.args.getlist('activity'))
+    except ValueError:
+        return jsonify({'error': 'from / to must be YYYY-MM-DD'}), 400
+
+    chunks = export_reports.export(fmt, query)
+    try:
+        # Opens the cursor: Kintone errors become a proper error response, not a truncated file
+        first = next(chunks)
+    except Exception as e:
+        print(f"Export Error: {e}")
+        return jsonify({'error': str(e)}), 502
+    mimetype, _ = export_reports.FORMATS[fmt]
+    headers = {
+        'Content-Disposition': f'attachment; filename="{export_reports.filename(fmt, date_from, date_to)}"',
+        'Cache-Control': 'no-store',
+        'X-Accel-Buffering': 'no',
+    }
+    return Response(stream_with_context(itertools.chain([first], chunks)), mimetype=mimetype, headers=headers)
+
+@app.route('/webhooks/kintone', methods=['POST'])
+def kintone_webhook():
+    # Registered in both Kintone apps as .../webhooks/kintone?token=<WEBHOOK_TOKEN> (no login session)
+    body = request.get_data()
+    if not webhooks.verify(body, request.args.get('token', ''), request.headers.get(webhooks.SIGNATURE_HEADER, '')):
+        return jsonify({'error': 'forbidden'}), 403
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        return jsonify({'error': 'invalid JSON'}), 400
+    return jsonify(webhooks.handle(payload))
+
+@app.route('/admin/profiles', methods=['GET'])
+def profiles():
+    name = request.args.get('name', '')
+    selected = profiling.load_profile(name) if name else None
+    return render_template('profiles.html',
+                           profiles=profiling.list_profiles(),
+                           selected=selected,
+                           top=profiling.top_functions(selected['stacks']) if selected else None,
+                           threshold_ms=profiling.PROFILE_THRESHOLD_MS,
+                           header_enabled=bool(profiling.PROFILE_TOKEN),
+                           header_name=profiling.DEBUG_HEADER)
+
+@app.route('/admin/profiles/<name>.folded', methods=['GET'])
+def profile_download(name):
+    # Folded stacks: flamegraph.pl / speedscope input
+    path = profiling.folded_path(name)
+    if path is None:
+        abort(404)
+    return send_file(path, mimetype='text/plain', as_attachment=True, download_name=f'{name}.folded')
+
+@app.route('/api/resilience', methods=['GET'])
+def resilience_route():
+    # Breaker states, per-operation latency percentiles and hedge win rates (this worker)
+    return jsonify(resilience.snapshot())
+
+# --- Report mirror (local SQLite copy of the report app) ---
+
+def mirror_not_ready():
+    # The initial load runs in the background; the aggregates aren't rebuilt from Kintone per request
+    return jsonify({'error': 'report mirror not ready', 'mirror': report_mirror.status()}), 503
+
+@app.route('/api/reports/subjects', methods=['GET'])
+def report_subjects_route():
+    since = request.args.get('since', '')
+    if not report_mirror.ensure_fresh():
+        return mirror_not_ready()
+    return jsonify(report_mirror.subject_counts(since=since))
+
+@app.route('/api/reports/last_contact', methods=['GET'])
+def report_last_contact_route():
+    limit = request.args.get('limit', 100, type=int)
+    client_id = request.args.get('client_id', '')
+    if not report_mirror.ensure_fresh():
+        return mirror_not_ready()
+    return jsonify(report_mirror.last_contact(client_id=client_id, limit=limit))
+
+@app.route('/api/reports/followups', methods=['GET'])
+def report_followups_route():
+    days = request.args.get('days', 14, type=int)
+    staff = request.args.get('staff', '')
+    if not report_mirror.ensure_fresh():
+        return mirror_not_ready()
+    return jsonify(report_mirror.followups(staff=staff, days=days))
+
+@app.route('/api/similar_reports', methods=['GET'])
+def similar_reports_route():
+    # BM25 over the mirrored report texts; the client's latest reports if q is empty
+    if not report_mirror.ensure_fresh():
+        return jsonify([])  # no corpus until the initial load has finished
+    client_id = request.args.get('client_id', '')
+    query = request.args.get('q', '')
+    if not client_id and not query.strip():
+        return jsonify({'error': 'q or client_id is required'}), 400
+    limit = min(request.args.get('limit', 5, type=int), 50)
+    exclude_id = request.args.get('exclude_id', type=int)
+    return jsonify(similar_reports.similar_reports(query, client_id=client_id, limit=limit, exclude_id=exclude_id))
+
+@app.route('/followups', methods=['GET'])
+def followups():
+    ready = report_mirror.ensure_fresh()
+    staff = request.args.get('staff', '')
+    days = request.args.get('days', 14, type=int)
+    return render_template('followups.html',
+                           items=report_mirror.followups(staff=staff, days=days) if ready else [],
+                           names=client_index.client_names(),
+                           staff=staff,
+                           days=days,
+                           staff_options=STAFF_OPTIONS,
+                           mirror=report_mirror.status())
 
 @app.route('/', methods=['GET'])
 def index():
-    icon_url = "/static/icon.png?v=13" 
-    ios_icon_url = "/static/apple-touch-icon.png?v=13" 
-    manifest_url = "/static/manifest.json?v=13"
-    
-    return render_template('index.html', staff_options=STAFF_OPTIONS)
+    if has_pending_flashes():
+        return render_template('index.html', staff_options=STAFF_OPTIONS)
+    # The page only depends on the templates and the option lists
+    etag = strong_etag('index', TEMPLATE_VERSION, STAFF_OPTIONS)
+    return conditional_response(etag, lambda: render_template('index.html', staff_options=STAFF_OPTIONS))
 
 @app.route('/history/<client_id>')
 def history(client_id):
-    from utils import fetch_client_history, summarize_history
+    from utils import fetch_client_history
+    from history_summary import get_rolling_summary
     
     # Get client name if possible (passed via query param for display, or fetch?)
     # Kintone fetch usually returns records, we can grab name from first record if available
     client_name = request.args.get('name', 'クライアント')
     
     records = fetch_client_history(client_id, limit=5)
-    summary = summarize_history(records)
-    
-    return render_template('history.html', 
-                           client_name=client_name, 
-                           records=records, 
-                           summary=summary)
+    with usage_scope(client_id=client_id):
+        # Whole history, but only records newer than the stored watermark go to Gemini.
+        # Served from the shared summary cache between checks for new records.
+        summary = get_rolling_summary(client_id)
+
+    def render_history():
+        return render_template('history.html', 
+                               client_name=client_name, 
+                               records=records, 
+                               summary=summary)
+
+    if has_pending_flashes() or not records:
+        return render_history()
+    # Unchanged records and summary -> same ETag -> no render
+    return conditional_response(history_etag(client_id, client_name, records, summary, TEMPLATE_VERSION), render_history,
+                                should_cache=lambda: history_summary.is_complete(summary))
+
+@app.route('/history/attachments/<file_key>')
+def history_attachment(file_key):
+    # Attachments of past reports, from the local cache; Range requests let the player seek
+    if not attachments.valid_file_key(file_key):
+        abort(404)
+    for _ in range(2):
+        try:
+            path, meta = attachments.fetch(file_key)
+            response = send_file(path, mimetype=meta['content_type'], conditional=True, etag=file_key,
+                                 download_name=secure_filename(request.args.get('name', '')) or None)
+        except FileNotFoundError:
+            continue  # evicted between lookup and open: download again
+        except Exception as e:
+            print(f"Attachment Fetch Error: {e}")
+            abort(502)
+        # A file key always refers to the same content
+        response.headers['Cache-Control'] = 'private, max-age=86400'
+        return response
+    abort(502)
 
 @app.route('/process', methods=['POST'])
 def process():
@@ -90,75 +527,260 @@ def process():
     client_id = request.form.get('client_id', '')
     client_name = request.form.get('client_name', '')
     mode = request.form.get('mode', 'sales') # sales or qa
+    staged_id = request.form.get('staged_id', '')
+    live_id = request.form.get('live_id', '')
+    has_audio = bool(audio_file and audio_file.filename != '')
+    staged = claim_staged(staged_id, has_audio)
+    # Recorded in the browser: segments are already transcribed, only the tail is left
+    live_path = live.finish(live_id) if live_id and not has_audio else ''
 
-    if not audio_file and not text_input:
+    if staged_id and not has_audio and staged is None:
+        flash('選択した音声ファイルの有効期限が切れました。もう一度選択してください', 'error')
+        return redirect(url_for('index'))
+    if live_id and not has_audio and not live_path:
+        flash('録音の有効期限が切れたか、録音が完了していません。もう一度録音してください', 'error')
+        return redirect(url_for('index'))
+    if not audio_file and not staged and not live_path and not text_input:
         flash('音声ファイルまたはテキストを入力してください', 'error')
         return redirect(url_for('index'))
 
     saved_path = None
     try:
         data = {}
-        if audio_file and audio_file.filename != '':
-            # Save file
-            saved_path = save_audio_file(audio_file)
-            
-            if text_input:
-                data = process_audio_and_text(saved_path, text_input, mode)
-            else:
-                data = process_audio_only(saved_path, mode)
-        elif text_input:
-            data = process_text_only(text_input, mode)
+        reference = extraction_reference(client_id, text_input, mode)
+        with usage_scope(staff=staff_name, mode=mode, report_id=uuid.uuid4().hex):
+            if has_audio:
+                # Save file
+                saved_path = save_audio_file(audio_file)
+                data = extract_audio(saved_path, text_input, mode, reference)
+            elif staged:
+                # Saved and uploaded to Gemini while the form was being filled in
+                saved_path = staged['path']
+                data = extract_audio(saved_path, text_input, mode, reference, staging.uploaded_part(staged['id']))
+            elif live_path:
+                # Transcribed while recording: extract from the stored transcript
+                # whatever AUDIO_PIPELINE says, instead of sending the audio again
+                saved_path = live_path
+                data = transcripts.process_audio(saved_path, text_input, mode, reference=reference)
+            elif text_input:
+                data = process_text_only(text_input, mode, reference=reference)
 
         if not data:
             flash('AIによる抽出に失敗しました', 'error')
             return redirect(url_for('index'))
          
-        # Inject client info if available
-        if client_id:
-            data['取引先ID'] = client_id
-            data['取引先名'] = client_name # For display
-            
-        # Ensure Next Proposal Date is filled (Default: 3 days later, skip weekends)
-        # Ensure Next Proposal Date is filled (Default: 3 days later, skip weekends)
-        # Only for Sales Report mode
-        if mode != 'qa' and not data.get('次回提案予定日'):
-            data['次回提案予定日'] = calculate_smart_next_date(data.get('対応日'))
+        data = complete_extraction(data, mode, client_id, client_name)
             
         # Success -> Confirm Page
-        return render_template('confirm.html', data=data, file_path=saved_path or "", staff_name=staff_name, sales_options=SALES_ACTIVITY_OPTIONS, next_sales_options=NEXT_SALES_ACTIVITY_OPTIONS, staff_options=STAFF_OPTIONS, mode=mode)
+        return render_template('confirm.html', **confirm_context(data, saved_path, staff_name, mode, text_input))
 
     except Exception as e:
         flash(f"エラーが発生しました: {str(e)}", 'error')
         return redirect(url_for('index'))
 
+@app.route('/reprocess', methods=['POST'])
+def reprocess():
+    # Re-extract from the confirm page (e.g. sales <-> qa) without listening to the audio again
+    if not init_gemini():
+        flash('Gemini APIの設定エラーが発生しました', 'error')
+        return redirect(url_for('index'))
+
+    file_path = saved_audio_path(request.form.get('file_path', ''))
+    memo = request.form.get('memo', '').strip()
+    staff_name = request.form.get('staff_name')
+    client_id = request.form.get('取引先ID', '')
+    client_name = request.form.get('取引先名', '')
+    mode = request.form.get('mode', 'sales')
+
+    if not file_path and not memo:
+        flash('再抽出できる音声ファイルまたはメモがありません', 'error')
+        return redirect(url_for('index'))
+
+    try:
+        reference = extraction_reference(client_id, memo, mode)
+        # Asked for because the last result was wrong: don't hand it back from the cache
+        with usage_scope(staff=staff_name, mode=mode, report_id=uuid.uuid4().hex), fresh_extraction():
+            if file_path:
+                data = transcripts.process_audio(file_path, memo, mode, reference=reference)
+            else:
+                data = process_text_only(memo, mode, reference=reference)
+        if not data:
+            flash('AIによる抽出に失敗しました', 'error')
+            return redirect(url_for('index'))
+        data = complete_extraction(data, mode, client_id, client_name)
+        return render_template('confirm.html', **confirm_context(data, file_path, staff_name, mode, memo))
+    except Exception as e:
+        flash(f"エラーが発生しました: {str(e)}", 'error')
+        return redirect(url_for('index'))
+
+@app.route('/api/regenerate_field', methods=['POST'])
+def regenerate_field_route():
+    payload = request.get_json(silent=True) or {}
+    field = payload.get('field', '')
+    if not field:
+        return jsonify({'error': 'field is required'}), 400
+    mode = payload.get('mode', 'sales')
+    try:
+        with usage_scope(mode=mode, field=field):
+            value = transcripts.regenerate_field(
+                field,
+                audio_file_path=saved_audio_path(payload.get('file_path', '')),
+                memo=payload.get('memo', ''),
+                mode=mode,
+                data=payload.get('data') or {},
+            )
+    except Exception as e:
+        print(f"Regenerate Field Error: {e}")
+        value = None
+    if value is None:
+        return jsonify({'error': '再生成に失敗しました'}), 502
+    return jsonify({'field': field, 'value': value})
+
+@app.route('/api/stage_audio', methods=['POST'])
+def stage_audio_route():
+    # Called from the file input's change handler, before the form is submitted
+    if not init_gemini():
+        return jsonify({'error': 'Gemini APIの設定エラーが発生しました'}), 503
+    audio_file = request.files.get('audio_file')
+    if not audio_file or audio_file.filename == '':
+        return jsonify({'error': 'audio_file is required'}), 400
+    meta = staging.stage(audio_file)
+    return jsonify({'staged_id': meta['id'], 'status': meta['status'], 'error': meta['error']})
+
+@app.route('/api/stage_audio/<staged_id>', methods=['GET'])
+def staged_audio_status(staged_id):
+    meta = staging.load(staged_id)
+    if meta is None:
+        return jsonify({'error': 'not found'}), 404
+    return jsonify({'staged_id': meta['id'], 'status': meta['status'], 'error': meta['error']})
+
+@app.route('/api/live', methods=['POST'])
+def live_start():
+    # In-app recording: chunks follow as raw 16 kHz mono PCM
+    if not init_gemini():
+        return jsonify({'error': 'Gemini APIの設定エラーが発生しました'}), 503
+    return jsonify(live.status(live.start()))
+
+@app.route('/api/live/<live_id>/chunk', methods=['POST'])
+def live_chunk(live_id):
+    seq = request.args.get('seq', type=int)
+    if seq is None or seq < 0:
+        return jsonify({'error': 'seq is required'}), 400
+    if (request.content_length or 0) > live.MAX_CHUNK_BYTES:
+        return jsonify({'error': 'chunk too large'}), 413
+    try:
+        meta = live.add_chunk(live_id, seq, request.get_data(cache=False))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if meta is None:
+        return jsonify({'error': 'not found'}), 404
+    return jsonify(live.status(meta))
+
+@app.route('/api/live/<live_id>/stop', methods=['POST'])
+def live_stop(live_id):
+    chunks = request.args.get('chunks', type=int)
+    if chunks is None or chunks < 0:
+        return jsonify({'error': 'chunks is required'}), 400
+    meta = live.stop(live_id, chunks)
+    if meta is None:
+        return jsonify({'error': 'not found'}), 404
+    return jsonify(live.status(meta))
+
+@app.route('/api/live/<live_id>', methods=['GET'])
+def live_status(live_id):
+    meta = live.load(live_id)
+    if meta is None:
+        return jsonify({'error': 'not found'}), 404
+    return jsonify(live.status(meta))
+
 @app.route('/save', methods=['POST'])
 def save():
     # Gather data from form
     form_data = request.form.to_dict()
-    file_path = form_data.pop('file_path', '')
-    staff_name = form_data.pop('staff_name', '')
-    
-    # Reconstruct data dict for kintone
-    data = form_data
-    # Add staff info if needed by utils (it is, see utils.py:264)
-    data['対応者'] = staff_name
+    batch_id, draft_index, file_key = split_batch_fields(form_data)
+    data, file_path = split_save_form(form_data)
 
-    file_keys = []
-    if file_path and os.path.exists(file_path):
+    # Batch drafts may carry a file key uploaded during extraction
+    file_keys = [file_key] if file_key else []
+    if not file_keys and file_path and os.path.exists(file_path):
         fk = upload_file_to_kintone(file_path, os.path.basename(file_path))
         if fk:
             file_keys.append(fk)
     
     success, error_msg = upload_to_kintone(data, file_keys)
+    if not success and file_key and file_path and os.path.exists(file_path):
+        # Pre-uploaded key expired (Kintone keeps unused keys for 3 days): upload again
+        fk = upload_file_to_kintone(file_path, os.path.basename(file_path))
+        success, error_msg = upload_to_kintone(data, [fk] if fk else [])
     
     if success:
         flash('Kintoneに正常に登録されました！', 'success')
+        if error_msg:
+            flash(error_msg, 'warning')  # saved, but some option fields blank
+        similar_reports.add_saved(data)
+        history_summary.invalidate(data.get('取引先ID', ''))
+        report_mirror.sync_in_background()
     else:
         # User-friendly error message if possible, but raw details are better for debugging now
         flash(f'Kintoneへの登録に失敗しました: {error_msg}', 'error')
-        
-    return redirect(url_for('index'))
+
+    return redirect(after_save_target(batch_id, draft_index, success))
+
+# --- Batch mode ---
+
+@app.route('/batch', methods=['GET'])
+def batch_form():
+    return render_template('batch.html', staff_options=STAFF_OPTIONS, max_files=batch.BATCH_MAX_FILES)
+
+@app.route('/batch/process', methods=['POST'])
+def batch_process():
+    if not init_gemini():
+        flash('Gemini APIの設定エラーが発生しました', 'error')
+        return redirect(url_for('batch_form'))
+
+    files = [f for f in request.files.getlist('audio_files') if f and f.filename]
+    if not files:
+        flash('音声ファイルを選択してください', 'error')
+        return redirect(url_for('batch_form'))
+    if len(files) > batch.BATCH_MAX_FILES:
+        flash(f'一度に処理できるのは{batch.BATCH_MAX_FILES}件までです', 'error')
+        return redirect(url_for('batch_form'))
+
+    staff_name = request.form.get('staff_name')
+    mode = request.form.get('mode', 'sales')
+    pre_upload = request.form.get('pre_upload') == '1'
+    # Per-file client tags are posted in file order: client_id_0, client_name_0, ...
+    items = []
+    for i, f in enumerate(files):
+        items.append({
+            'path': save_audio_file(f),
+            'original_name': f.filename,
+            'client_id': request.form.get(f'client_id_{i}', ''),
+            'client_name': request.form.get(f'client_name_{i}', ''),
+            'text': request.form.get(f'text_input_{i}', '').strip(),
+        })
+
+    batch_id = batch.run_batch(items, staff_name, mode, pre_upload, complete_extraction)
+    return redirect(url_for('batch_queue', batch_id=batch_id))
+
+@app.route('/batch/<batch_id>', methods=['GET'])
+def batch_queue(batch_id):
+    current = batch.load_batch(batch_id)
+    if not current:
+        flash('バッチが見つかりません', 'error')
+        return redirect(url_for('batch_form'))
+    return render_template('batch_queue.html', batch=current)
+
+@app.route('/batch/<batch_id>/<int:draft_index>', methods=['GET'])
+def batch_review(batch_id, draft_index):
+    current, draft = batch.get_draft(batch_id, draft_index)
+    if not draft or draft['status'] == 'failed':
+        flash('下書きが見つかりません', 'error')
+        return redirect(url_for('batch_queue', batch_id=batch_id) if current else url_for('batch_form'))
+    context = confirm_context(draft['data'], draft['file_path'], current['staff_name'], current['mode'])
+    return render_template('confirm.html', batch_id=batch_id, draft_index=draft_index, file_key=draft['file_key'], **context)
 
 if __name__ == '__main__':
-    # For local dev
+    # For local dev (gunicorn starts this from post_worker_init)
+    health.start_warmup()
     app.run(debug=True, port=8501, host='0.0.0.0')
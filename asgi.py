@@ -0,0 +1,280 @@
+"""
+ASGI entry point (async serving mode).
+
+The Kintone / Gemini bound routes run as coroutines on async_utils, so one
+worker process can hold many in-flight requests while they wait on the network.
+Every other route is served by the Flask app in app.py, mounted underneath.
+
+    gunicorn asgi:app -k uvicorn.workers.UvicornWorker --timeout 1200 --bind 0.0.0.0:$PORT
+"""
+import os
+import time
+import uuid
+import asyncio
+import contextvars
+from contextlib import asynccontextmanager
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import HTMLResponse, JSONResponse, RedirectResponse, Response
+from starlette.routing import Mount, Route
+
+import json
+import async_utils
+import client_index
+import report_mirror
+import similar_reports
+import transcripts
+import health
+import history_summary
+from history_summary import get_rolling_summary
+from app import app as flask_app, APP_PASSWORD, TEMPLATE_VERSION, complete_extraction, confirm_context, split_save_form, split_batch_fields, after_save_target, extraction_reference, claim_staged
+import staging
+import live
+import utils
+from utils import init_gemini, save_audio_file
+from usage import usage_scope
+from response_cache import render_cache, search_cache, strong_etag, history_etag, search_key, etag_matches, SEARCH_MAX_AGE
+
+# --- Flask session bridge ---
+# Login state and flash messages live in Flask's signed session cookie, so both
+# halves of the app read and write the same cookie.
+
+def _serializer():
+    return flask_app.session_interface.get_signing_serializer(flask_app)
+
+def load_session(request) -> dict:
+    cookie = request.cookies.get(flask_app.config["SESSION_COOKIE_NAME"])
+    if not cookie:
+        return {}
+    try:
+        max_age = int(flask_app.permanent_session_lifetime.total_seconds())
+        return dict(_serializer().loads(cookie, max_age=max_age))
+    except Exception:
+        return {}
+
+def save_session(response, sess: dict):
+    response.set_cookie(flask_app.config["SESSION_COOKIE_NAME"], _serializer().dumps(sess), httponly=True, path="/")
+    return response
+
+def flash(sess: dict, message: str, category: str = "message"):
+    sess.setdefault("_flashes", []).append((category, message))
+
+def redirect_with_flash(sess: dict, url: str) -> RedirectResponse:
+    return save_session(RedirectResponse(url, status_code=302), sess)
+
+def render(sess: dict, template: str, **context) -> HTMLResponse:
+    def get_flashed_messages(with_categories=False):
+        flashes = sess.pop("_flashes", [])
+        return flashes if with_categories else [message for _, message in flashes]
+
+    with flask_app.app_context():
+        html = flask_app.jinja_env.get_template(template).render(get_flashed_messages=get_flashed_messages, **context)
+    return save_session(HTMLResponse(html), sess)
+
+async def conditional_response(request, etag, build_body, media_type='text/html', cache_control='private, no-cache'):
+    # Same contract as app.conditional_response; build_body is async and returns (body, cacheable)
+    headers = {'ETag': f'"{etag}"', 'Cache-Control': cache_control}
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers=headers)
+    # The shared cache may be SQLite or Redis: keep its I/O off the event loop
+    body = await run_in_threadpool(render_cache.get, etag)
+    if body is None:
+        body, cacheable = await build_body()
+        if not cacheable:
+            return Response(body, media_type=media_type, headers={'Cache-Control': 'no-store'})
+        await run_in_threadpool(render_cache.set, etag, body)
+    return Response(body, media_type=media_type, headers=headers)
+
+def login_required(endpoint):
+    async def wrapper(request):
+        if APP_PASSWORD and not load_session(request).get("authenticated"):
+            return RedirectResponse("/login", status_code=302)
+        return await endpoint(request)
+    return wrapper
+
+# --- Routes ---
+
+@login_required
+async def search_clients_route(request):
+    keyword = request.query_params.get("q", "")
+    if not keyword:
+        return JSONResponse([])
+    # Stats the shared index file and may parse it: off the event loop
+    index = await run_in_threadpool(client_index.load)
+    key = search_key(keyword)
+    results = index.search(keyword) if index is not None else await run_in_threadpool(search_cache.get, key)
+    if results is None:
+        results = await async_utils.search_clients_async(keyword)
+        if results:
+            await run_in_threadpool(search_cache.set, key, results)
+    body = json.dumps(results, ensure_ascii=False)
+
+    async def build():
+        return body, True
+    return await conditional_response(request, strong_etag('search', body), build, media_type='application/json',
+                                      cache_control=f'private, max-age={SEARCH_MAX_AGE}')
+
+@login_required
+async def history(request):
+    client_id = request.path_params["client_id"]
+    client_name = request.query_params.get("name", "クライアント")
+
+    sess = load_session(request)
+    records = await async_utils.fetch_client_history_async(client_id, limit=5)
+    with usage_scope(client_id=client_id):
+        summary = await run_in_threadpool(contextvars.copy_context().run, get_rolling_summary, client_id)
+
+    async def build():
+        response = render(sess, "history.html", client_name=client_name, records=records, summary=summary)
+        return response.body, history_summary.is_complete(summary)
+
+    if sess.get('_flashes') or not records:
+        body, _ = await build()
+        return save_session(HTMLResponse(body), sess)
+    return await conditional_response(request, history_etag(client_id, client_name, records, summary, TEMPLATE_VERSION), build)
+
+@login_required
+async def process(request):
+    sess = load_session(request)
+    if not init_gemini():
+        flash(sess, 'Gemini APIの設定エラーが発生しました', 'error')
+        return redirect_with_flash(sess, "/")
+
+    form = await request.form()
+    text_input = (form.get('text_input') or '').strip()
+    audio_file = form.get('audio_file')
+    staff_name = form.get('staff_name')
+    client_id = form.get('client_id', '')
+    client_name = form.get('client_name', '')
+    mode = form.get('mode', 'sales') # sales or qa
+    staged_id = form.get('staged_id', '')
+    live_id = form.get('live_id', '')
+
+    has_audio = audio_file is not None and not isinstance(audio_file, str) and audio_file.filename
+    staged = await run_in_threadpool(claim_staged, staged_id, has_audio)
+    # Recorded in the browser: waits for the last segment, so off the event loop
+    live_path = await run_in_threadpool(live.finish, live_id) if live_id and not has_audio else ''
+    if staged_id and not has_audio and staged is None:
+        flash(sess, '選択した音声ファイルの有効期限が切れました。もう一度選択してください', 'error')
+        return redirect_with_flash(sess, "/")
+    if live_id and not has_audio and not live_path:
+        flash(sess, '録音の有効期限が切れたか、録音が完了していません。もう一度録音してください', 'error')
+        return redirect_with_flash(sess, "/")
+    if not has_audio and not staged and not live_path and not text_input:
+        flash(sess, '音声ファイルまたはテキストを入力してください', 'error')
+        return redirect_with_flash(sess, "/")
+
+    saved_path = None
+    try:
+        data = {}
+        # SQLite catch-up on the first call after a mirror sync: keep it off the event loop
+        reference = await run_in_threadpool(extraction_reference, client_id, text_input, mode)
+        with usage_scope(staff=staff_name, mode=mode, report_id=uuid.uuid4().hex):
+            if has_audio or staged or live_path:
+                uploaded_file = None
+                if has_audio:
+                    saved_path = await run_in_threadpool(save_audio_file, audio_file)
+                elif live_path:
+                    saved_path = live_path
+                else:
+                    # Saved and uploaded to Gemini while the form was being filled in
+                    saved_path = staged['path']
+                    uploaded_file = await run_in_threadpool(staging.uploaded_part, staged['id'])
+                # Live recordings were transcribed while recording: always use that transcript
+                if transcripts.AUDIO_PIPELINE == 'transcript' or live_path:
+                    data = await run_in_threadpool(contextvars.copy_context().run, transcripts.process_audio, saved_path, text_input, mode, reference, uploaded_file)
+                elif text_input:
+                    data = await async_utils.process_audio_and_text_async(saved_path, text_input, mode, reference, uploaded_file)
+                else:
+                    data = await async_utils.process_audio_only_async(saved_path, mode, reference, uploaded_file)
+            elif text_input:
+                data = await async_utils.process_text_only_async(text_input, mode, reference)
+
+        if not data:
+            flash(sess, 'AIによる抽出に失敗しました', 'error')
+            return redirect_with_flash(sess, "/")
+
+        data = complete_extraction(data, mode, client_id, client_name)
+        return render(sess, "confirm.html", **confirm_context(data, saved_path, staff_name, mode, text_input))
+
+    except Exception as e:
+        flash(sess, f"エラーが発生しました: {str(e)}", 'error')
+        return redirect_with_flash(sess, "/")
+
+@login_required
+async def save(request):
+    sess = load_session(request)
+    form = await request.form()
+    form_data = {k: v for k, v in form.items()}
+    batch_id, draft_index, file_key = split_batch_fields(form_data)
+    data, file_path = split_save_form(form_data)
+
+    # Batch drafts may carry a file key uploaded during extraction
+    file_keys = [file_key] if file_key else []
+    if not file_keys and file_path and os.path.exists(file_path):
+        fk = await async_utils.upload_file_to_kintone_async(file_path, os.path.basename(file_path))
+        if fk:
+            file_keys.append(fk)
+
+    success, error_msg = await async_utils.upload_to_kintone_async(data, file_keys)
+    if not success and file_key and file_path and os.path.exists(file_path):
+        # Pre-uploaded key expired (Kintone keeps unused keys for 3 days): upload again
+        fk = await async_utils.upload_file_to_kintone_async(file_path, os.path.basename(file_path))
+        success, error_msg = await async_utils.upload_to_kintone_async(data, [fk] if fk else [])
+    if success:
+        flash(sess, 'Kintoneに正常に登録されました！', 'success')
+        if error_msg:
+            flash(sess, error_msg, 'warning')  # saved, but some option fields blank
+        await run_in_threadpool(similar_reports.add_saved, data)
+        await run_in_threadpool(history_summary.invalidate, data.get('取引先ID', ''))
+        report_mirror.sync_in_background()
+    else:
+        flash(sess, f'Kintoneへの登録に失敗しました: {error_msg}', 'error')
+    return redirect_with_flash(sess, await run_in_threadpool(after_save_target, batch_id, draft_index, success))
+
+async def warm_async_clients():
+    # The coroutine routes use their own pools (httpx / genai aio), separate from
+    # the requests session and sync genai client warmed by health.warm_up
+    async def kintone():
+        if not all([utils.KINTONE_SUBDOMAIN, utils.KINTONE_APP_ID, utils.KINTONE_API_TOKEN]):
+            return False
+        params = {"app": utils.KINTONE_APP_ID, "query": "limit 1", "fields": ["$id"]}
+        resp = await async_utils.get_http_client().get(utils.kintone_url("records.json"), params=params,
+                                                       headers={"X-Cybozu-API-Token": utils.report_app_token()})
+        resp.raise_for_status()
+
+    async def gemini():
+        if not utils.GEMINI_API_KEY:
+            return False
+        await async_utils.get_genai_client().models.get(model=utils.GEMINI_MODEL)
+
+    for name, check in (("kintone_async", kintone), ("gemini_async", gemini)):
+        start = time.perf_counter()
+        try:
+            if await asyncio.wait_for(check(), health.HEALTH_TIMEOUT) is False:
+                health.record(name, skipped=True)
+                continue
+        except Exception as e:
+            print(f"Health Check Error ({name}): {e}")
+            health.record(name, time.perf_counter() - start, error=e)
+            continue
+        health.record(name, time.perf_counter() - start)
+
+@asynccontextmanager
+async def lifespan(_app):
+    health.start_warmup()
+    await warm_async_clients()
+    yield
+    await async_utils.aclose()
+
+app = Starlette(
+    routes=[
+        Route('/api/search_clients', search_clients_route, methods=['GET']),
+        Route('/history/{client_id}', history, methods=['GET']),
+        Route('/process', process, methods=['POST']),
+        Route('/save', save, methods=['POST']),
+        Mount('/', app=WSGIMiddleware(flask_app)),
+    ],
+    lifespan=lifespan,
+)
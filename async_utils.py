@@ -0,0 +1,172 @@
+import time
+import asyncio
+import httpx
+
+import resilience
+
+import utils
+from utils import (
+    GEMINI_MODEL, generation_config, kintone_url, report_app_token, client_search_params, parse_client_records,
+    history_params, parse_history_records, kintone_record_payload, rejected_option_fields,
+    get_system_instruction, get_mime_type, parse_json_response, cached_extraction,
+    AUDIO_ONLY_PROMPT, with_reference, text_only_prompt, audio_and_text_prompt,
+)
+from usage import record_usage
+
+# =============================================================================
+# CLIENTS
+# =============================================================================
+# Async variants of the Kintone / Gemini calls in utils.py for the ASGI serving
+# mode (asgi.py). Request building and response parsing are shared with utils,
+# only the I/O differs. The sync functions remain the API for the Streamlit views.
+
+_http_client = None
+
+def get_http_client() -> httpx.AsyncClient:
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        # Deadlines and the Kintone breaker as in utils.http_session()
+        _http_client = resilience.KintoneAsyncClient(
+            timeout=httpx.Timeout(resilience.KINTONE_WRITE_TIMEOUT, connect=resilience.KINTONE_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=200, max_keepalive_connections=50),
+        )
+    return _http_client
+
+def get_genai_client():
+    return utils.get_genai_client().aio
+
+async def aclose():
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+# =============================================================================
+# KINTONE
+# =============================================================================
+
+async def search_clients_async(keyword: str) -> list:
+    if not utils.KINTONE_CLIENT_APP_ID or not utils.KINTONE_CLIENT_API_TOKEN:
+        print("取引先アプリの設定が不足しています。")
+        return []
+    headers = {"X-Cybozu-API-Token": utils.KINTONE_CLIENT_API_TOKEN}
+
+    async def request():
+        response = await get_http_client().get(kintone_url("records.json"), headers=headers, params=client_search_params(keyword))
+        if response.status_code != 200: return []
+        return parse_client_records(response.json().get("records", []))
+    try:
+        return await resilience.hedged_async("kintone.search", request)
+    except Exception as e:
+        print(f"Client Search Exception: {e}")
+        return []
+
+async def fetch_client_history_async(client_id: str, limit: int = 5) -> list:
+    if not all([utils.KINTONE_SUBDOMAIN, utils.KINTONE_APP_ID, utils.KINTONE_API_TOKEN]): return []
+    headers = {"X-Cybozu-API-Token": report_app_token()}
+
+    async def request():
+        resp = await get_http_client().get(kintone_url("records.json"), headers=headers, params=history_params(client_id, limit))
+        if resp.status_code != 200:
+            print(f"History Fetch Error: {resp.text}")
+            return []
+        return parse_history_records(resp.json().get("records", []))
+    try:
+        return await resilience.hedged_async("kintone.history", request)
+    except Exception as e:
+        print(f"History Fetch Exception: {e}")
+        return []
+
+async def upload_file_to_kintone_async(file_path: str, file_name: str) -> str:
+    if not all([utils.KINTONE_SUBDOMAIN, utils.KINTONE_API_TOKEN]): return ""
+    headers = {"X-Cybozu-API-Token": utils.KINTONE_API_TOKEN}
+    try:
+        with open(file_path, "rb") as f:
+            response = await get_http_client().post(kintone_url("file.json"), headers=headers, files={"file": (file_name, f)})
+        response.raise_for_status()
+        return response.json().get("fileKey", "")
+    except Exception as e:
+        print(f"ファイルアップロードエラー: {e}")
+        return ""
+
+async def upload_to_kintone_async(data: dict, file_keys: list = None):
+    if not all([utils.KINTONE_SUBDOMAIN, utils.KINTONE_APP_ID, utils.KINTONE_API_TOKEN]): return False, "Kintoneの設定が不足しています。"
+    headers = {"X-Cybozu-API-Token": report_app_token(), "Content-Type": "application/json; charset=utf-8"}
+    resp = None
+    try:
+        resp = await get_http_client().post(kintone_url("record.json"), headers=headers, content=kintone_record_payload(data, file_keys))
+        rejected = rejected_option_fields(resp)
+        if rejected:
+            # Same fallback as utils.upload_to_kintone
+            import form_schema
+            form_schema.refresh_in_background()
+            print(f"Kintone rejected options {rejected}; retrying without them")
+            notice = utils.dropped_options_notice(data, rejected)
+            data = {**data, **{code: "" for code in rejected}}
+            resp = await get_http_client().post(kintone_url("record.json"), headers=headers, content=kintone_record_payload(data, file_keys))
+            resp.raise_for_status()
+            return True, notice
+        resp.raise_for_status()
+        return True, ""
+    except Exception as e:
+        error_msg = f"{str(e)}"
+        if resp is not None:
+            error_msg += f" Response: {resp.text}"
+        print(f"Kintone Error: {error_msg}")
+        return False, error_msg
+
+# =============================================================================
+# GEMINI
+# =============================================================================
+
+async def generate_content_async(mode: str = "", **kwargs):
+    async def call(model):
+        start = time.perf_counter()
+        response = await get_genai_client().models.generate_content(**{**kwargs, "model": model})
+        record_usage(response, model, time.perf_counter() - start, mode=mode)
+        return response
+    return await resilience.call_with_fallback_async(kwargs.get("model", GEMINI_MODEL), call)
+
+async def _upload_audio(audio_file_path: str):
+    mime = get_mime_type(audio_file_path)
+    print(f"Uploading file: {audio_file_path} with mime_type: {mime}")
+    return await get_genai_client().files.upload(file=audio_file_path, config={'mime_type': mime})
+
+async def _audio_part(audio_file_path: str):
+    part = await asyncio.to_thread(utils.inline_audio_part, audio_file_path)
+    return part if part is not None else await _upload_audio(audio_file_path)
+
+@cached_extraction
+async def process_audio_only_async(audio_file_path: str, mode: str = "sales", reference: str = "", uploaded_file=None) -> dict:
+    if not utils.GEMINI_API_KEY: return {}
+    if uploaded_file is None:
+        uploaded_file = await _audio_part(audio_file_path)
+    response = await generate_content_async(
+        mode,
+        contents=[uploaded_file, with_reference(AUDIO_ONLY_PROMPT, reference)],
+        config=generation_config(system_instruction=get_system_instruction(mode))
+    )
+    return parse_json_response(response.text)
+
+@cached_extraction
+async def process_text_only_async(text: str, mode: str = "sales", reference: str = "") -> dict:
+    if not utils.GEMINI_API_KEY: return {}
+    response = await resilience.hedged_async("gemini.text", lambda: generate_content_async(
+        mode,
+        contents=text_only_prompt(text, reference),
+        config=generation_config(system_instruction=get_system_instruction(mode),
+                                 http_options=utils.http_options(resilience.GEMINI_TEXT_TIMEOUT))
+    ))
+    return parse_json_response(response.text)
+
+@cached_extraction
+async def process_audio_and_text_async(audio_file_path: str, text: str, mode: str = "sales", reference: str = "", uploaded_file=None) -> dict:
+    if not utils.GEMINI_API_KEY: return {}
+    if uploaded_file is None:
+        uploaded_file = await _audio_part(audio_file_path)
+    response = await generate_content_async(
+        mode,
+        contents=[uploaded_file, audio_and_text_prompt(text, reference)],
+        config=generation_config(system_instruction=get_system_instruction(mode))
+    )
+    return parse_json_response(response.text)
@@ -0,0 +1,107 @@
+import os
+import re
+import json
+import hashlib
+import threading
+from pathlib import Path
+
+import utils
+
+# =============================================================================
+# CONFIGURATION
+# =============================================================================
+# Report attachments (添付ファイル_0, mostly the visit recordings) for the history
+# page. A file is downloaded from Kintone's file API once and then served from
+# local disk with Range and conditional-request support (see the route in
+# app.py), so seeking in the audio player on a phone fetches only what is
+# played, and listening again before the next visit doesn't touch Kintone.
+# The cache is bounded: least recently played files are removed first.
+
+ATTACHMENT_DIR = Path(os.getenv("ATTACHMENT_DIR", "./attachment_cache"))
+ATTACHMENT_CACHE_BYTES = int(os.getenv("ATTACHMENT_CACHE_MB", "2048")) * 1024 * 1024
+DOWNLOAD_CHUNK = 1024 * 1024
+
+_FILE_KEY_PATTERN = re.compile(r"^[0-9A-Za-z_-]{1,128}$")
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+def _key_lock(key: str) -> threading.Lock:
+    with _locks_guard:
+        return _locks.setdefault(key, threading.Lock())
+
+def valid_file_key(file_key: str) -> bool:
+    return bool(_FILE_KEY_PATTERN.match(file_key or ""))
+
+def _paths(file_key: str) -> tuple:
+    key = hashlib.sha256(file_key.encode("utf-8")).hexdigest()[:32]
+    return ATTACHMENT_DIR / f"{key}.bin", ATTACHMENT_DIR / f"{key}.json"
+
+def load(file_key: str) -> tuple:
+    """
+    (path, meta) of a cached attachment, or None. A hit counts as a use for eviction.
+    """
+    path, meta_path = _paths(file_key)
+    try:
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        os.utime(path)
+    except (OSError, ValueError):
+        return None
+    return path, meta
+
+def fetch(file_key: str) -> tuple:
+    """
+    (path, meta) of the attachment, downloaded from Kintone if not cached.
+    Concurrent requests for the same file in this worker share one download.
+    """
+    cached = load(file_key)
+    if cached:
+        return cached
+    with _key_lock(file_key):
+        cached = load(file_key)
+        if cached:
+            return cached
+        path, meta_path = _paths(file_key)
+        ATTACHMENT_DIR.mkdir(parents=True, exist_ok=True)
+        headers = {"X-Cybozu-API-Token": utils.report_app_token()}
+        tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with utils.http_session().get(utils.kintone_url("file.json"), headers=headers,
+                                          params={"fileKey": file_key}, stream=True) as resp:
+                resp.raise_for_status()
+                with open(tmp, "wb") as f:
+                    for chunk in resp.iter_content(DOWNLOAD_CHUNK):
+                        f.write(chunk)
+                content_type = resp.headers.get("Content-Type", "application/octet-stream").split(";")[0].strip()
+            meta = {"content_type": content_type, "size": tmp.stat().st_size}
+            os.replace(tmp, path)
+            meta_path.write_text(json.dumps(meta), encoding="utf-8")
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+    evict()
+    return path, meta
+
+def evict(max_bytes: int = ATTACHMENT_CACHE_BYTES) -> int:
+    """
+    Remove least recently used attachments until the cache fits in max_bytes.
+    """
+    entries = []
+    for path in ATTACHMENT_DIR.glob("*.bin"):
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        # Meta first: a reader that finds no meta downloads again instead of
+        # opening a file that is about to go (an already open file stays readable)
+        path.with_suffix(".json").unlink(missing_ok=True)
+        path.unlink(missing_ok=True)
+        total -= size
+        removed += 1
+    return removed
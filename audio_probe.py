@@ -0,0 +1,342 @@
+import os
+import struct
+
+# =============================================================================
+# CONFIGURATION
+# =============================================================================
+# Header-only probing of recordings: container, duration, bitrate, sample rate
+# and channels, read from the first few KB (WAV fmt/data chunks, MP3 frame
+# header + Xing/VBRI, MP4 mvhd/stsd, WebM Info/Tracks). Nothing is decoded.
+#
+# Used to route audio to Gemini: clips up to INLINE_AUDIO_MAX_BYTES are sent
+# as inline bytes in the generate_content request itself, larger ones go
+# through the Files API (upload, then generate: two round trips).
+
+# Gemini caps a whole request at 20MB and inline data is base64 encoded (4/3)
+INLINE_AUDIO_MAX_BYTES = int(os.getenv("INLINE_AUDIO_MAX_BYTES", str(8 * 1024 * 1024)))  # 0: always upload
+AUDIO_MAX_SECONDS = float(os.getenv("AUDIO_MAX_SECONDS", "34200"))  # Gemini accepts up to 9.5h of audio per prompt
+HEAD_BYTES = 256 * 1024
+MAX_MOOV_BYTES = 16 * 1024 * 1024
+
+MIME_TYPES = {
+    "wav": "audio/wav",
+    "mp3": "audio/mp3",
+    "mp4": "audio/mp4",
+    "webm": "audio/webm",
+}
+
+class AudioLimitError(ValueError):
+    pass
+
+def probe(path: str) -> dict:
+    """
+    {"format", "mime_type", "size", "duration", "bitrate", "sample_rate", "channels"}.
+    Anything the headers don't tell is None (e.g. MediaRecorder WebM has no duration).
+    """
+    info = {"format": None, "mime_type": None, "size": os.path.getsize(path),
+            "duration": None, "bitrate": None, "sample_rate": None, "channels": None}
+    try:
+        with open(path, "rb") as f:
+            head = f.read(HEAD_BYTES)
+            for fmt, matches, parse in _PARSERS:
+                if matches(head):
+                    info["format"] = fmt
+                    info["mime_type"] = MIME_TYPES[fmt]
+                    info.update(parse(f, head, info["size"]))
+                    break
+    except (OSError, struct.error, ValueError, IndexError) as e:
+        print(f"Audio Probe Error ({path}): {e}")
+    if info["duration"] and not info["bitrate"]:
+        info["bitrate"] = int(info["size"] * 8 / info["duration"])
+    return info
+
+def use_inline(info: dict) -> bool:
+    return 0 < info["size"] <= INLINE_AUDIO_MAX_BYTES
+
+def check_limits(info: dict):
+    if info["duration"] and info["duration"] > AUDIO_MAX_SECONDS:
+        raise AudioLimitError(
+            f"音声が長すぎます（{info['duration'] / 60:.0f}分）。{AUDIO_MAX_SECONDS / 60:.0f}分以内のファイルを選択してください")
+
+def describe(info: dict) -> str:
+    parts = [info["format"] or "unknown", f"{info['size'] / 1024:.0f}KB"]
+    if info["duration"]:
+        parts.append(f"{info['duration']:.1f}s")
+    if info["bitrate"]:
+        parts.append(f"{info['bitrate'] // 1000}kbps")
+    if info["sample_rate"]:
+        parts.append(f"{info['sample_rate']}Hz")
+    if info["channels"]:
+        parts.append(f"{info['channels']}ch")
+    return " ".join(parts)
+
+# =============================================================================
+# WAV
+# =============================================================================
+
+def _parse_wav(f, head: bytes, size: int) -> dict:
+    result = {}
+    byte_rate = 0
+    offset = 12
+    f.seek(offset)
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            break
+        chunk_id, chunk_size = struct.unpack("<4sI", header)
+        if chunk_id == b"fmt ":
+            _, channels, sample_rate, byte_rate = struct.unpack("<HHII", f.read(12))
+            result.update(channels=channels, sample_rate=sample_rate, bitrate=byte_rate * 8)
+        elif chunk_id == b"data":
+            if chunk_size in (0, 0xFFFFFFFF):  # written while streaming: runs to the end of the file
+                chunk_size = size - offset - 8
+            if byte_rate:
+                result["duration"] = chunk_size / byte_rate
+            break
+        offset += 8 + chunk_size + (chunk_size & 1)
+        f.seek(offset)
+    return result
+
+# =============================================================================
+# MP3
+# =============================================================================
+
+_MP3_BITRATES = {
+    (1, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (1, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (1, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (2, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (2, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+_MP3_SAMPLE_RATES = {1: [44100, 48000, 32000], 2: [22050, 24000, 16000], 2.5: [11025, 12000, 8000]}
+_MP3_VERSIONS = {3: 1, 2: 2, 0: 2.5}
+_MP3_LAYERS = {3: 1, 2: 2, 1: 3}
+
+def _id3_size(head: bytes) -> int:
+    if head[:3] != b"ID3" or len(head) < 10:
+        return 0
+    size = (head[6] << 21) | (head[7] << 14) | (head[8] << 7) | head[9]
+    return 10 + size + (10 if head[5] & 0x10 else 0)
+
+def _mp3_frame(head: bytes, i: int) -> dict:
+    if i + 4 > len(head) or head[i] != 0xFF or head[i + 1] & 0xE0 != 0xE0:
+        return None
+    b1, b2, b3 = head[i + 1], head[i + 2], head[i + 3]
+    version = _MP3_VERSIONS.get((b1 >> 3) & 3)
+    layer = _MP3_LAYERS.get((b1 >> 1) & 3)
+    bitrate_index, rate_index = b2 >> 4, (b2 >> 2) & 3
+    if version is None or layer is None or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    channels = 1 if b3 >> 6 == 3 else 2
+    if layer == 1:
+        samples = 384
+    elif layer == 3 and version != 1:
+        samples = 576
+    else:
+        samples = 1152
+    return {
+        "version": version, "layer": layer, "channels": channels, "samples": samples,
+        "bitrate": _MP3_BITRATES[(1 if version == 1 else 2, layer)][bitrate_index] * 1000,
+        "sample_rate": _MP3_SAMPLE_RATES[version][rate_index],
+    }
+
+def _mp3_start(head: bytes) -> int:
+    start = _id3_size(head)
+    for i in range(start, min(len(head) - 4, start + 64 * 1024)):
+        if _mp3_frame(head, i):
+            return i
+    return -1
+
+def _is_mp3(head: bytes) -> bool:
+    return head[:3] == b"ID3" or _mp3_frame(head, 0) is not None
+
+def _parse_mp3(f, head: bytes, size: int) -> dict:
+    base = 0
+    if _id3_size(head) + 4 > len(head):  # large embedded cover art: the first frame is past the head
+        base = _id3_size(head)
+        f.seek(base)
+        head = f.read(HEAD_BYTES)
+    start = _mp3_start(head)
+    if start < 0:
+        return {}
+    frame = _mp3_frame(head, start)
+    result = {"sample_rate": frame["sample_rate"], "channels": frame["channels"]}
+
+    # VBR files carry the total frame count in a Xing/Info or VBRI header in the first frame
+    if frame["version"] == 1:
+        side_info = 32 if frame["channels"] == 2 else 17
+    else:
+        side_info = 17 if frame["channels"] == 2 else 9
+    frames = None
+    xing = start + 4 + side_info
+    if head[xing:xing + 4] in (b"Xing", b"Info"):
+        if struct.unpack(">I", head[xing + 4:xing + 8])[0] & 1:
+            frames = struct.unpack(">I", head[xing + 8:xing + 12])[0]
+    elif head[start + 36:start + 40] == b"VBRI":
+        frames = struct.unpack(">I", head[start + 50:start + 54])[0]
+
+    if frames:
+        result["duration"] = frames * frame["samples"] / frame["sample_rate"]
+    else:  # CBR
+        result["duration"] = (size - base - start) * 8 / frame["bitrate"]
+        result["bitrate"] = frame["bitrate"]
+    return result
+
+# =============================================================================
+# MP4 / M4A
+# =============================================================================
+
+_MP4_CONTAINERS = {b"moov", b"trak", b"mdia", b"minf", b"stbl"}
+
+def _mp4_boxes(data: bytes, offset: int = 0, end: int = None):
+    end = len(data) if end is None else end
+    while offset + 8 <= end:
+        box_size, box_type = struct.unpack(">I4s", data[offset:offset + 8])
+        header = 8
+        if box_size == 1:
+            box_size = struct.unpack(">Q", data[offset + 8:offset + 16])[0]
+            header = 16
+        elif box_size == 0:
+            box_size = end - offset
+        if box_size < header:
+            return
+        yield box_type, offset + header, min(offset + box_size, end)
+        offset += box_size
+
+def _read_moov(f, size: int) -> bytes:
+    # moov is at the start (faststart) or after mdat: walk the top-level boxes by seeking
+    offset = 0
+    while offset + 8 <= size:
+        f.seek(offset)
+        header = f.read(16)
+        box_size, box_type = struct.unpack(">I4s", header[:8])
+        if box_size == 1:
+            box_size = struct.unpack(">Q", header[8:16])[0]
+        elif box_size == 0:
+            box_size = size - offset
+        if box_type == b"moov":
+            if box_size > MAX_MOOV_BYTES:
+                return b""
+            f.seek(offset)
+            return f.read(box_size)
+        if box_size < 8:
+            return b""
+        offset += box_size
+    return b""
+
+def _is_mp4(head: bytes) -> bool:
+    return head[4:8] == b"ftyp"
+
+def _parse_mp4(f, head: bytes, size: int) -> dict:
+    moov = _read_moov(f, size)
+    result = {}
+
+    def walk(start, end):
+        for box_type, body, box_end in _mp4_boxes(moov, start, end):
+            if box_type == b"mvhd":
+                if moov[body] == 1:
+                    timescale, duration = struct.unpack(">IQ", moov[body + 20:body + 32])
+                else:
+                    timescale, duration = struct.unpack(">II", moov[body + 12:body + 20])
+                if timescale:
+                    result["duration"] = duration / timescale
+            elif box_type == b"stsd" and "sample_rate" not in result:
+                # First sample entry (mp4a): channels at +24, 16.16 sample rate at +32
+                entry = body + 8
+                if moov[entry + 4:entry + 8] == b"mp4a":
+                    result["channels"] = struct.unpack(">H", moov[entry + 24:entry + 26])[0]
+                    result["sample_rate"] = struct.unpack(">I", moov[entry + 32:entry + 36])[0] >> 16
+            elif box_type in _MP4_CONTAINERS:
+                walk(body, box_end)
+
+    walk(0, len(moov))
+    return result
+
+# =============================================================================
+# WEBM
+# =============================================================================
+
+_EBML = 0x1A45DFA3
+_SEGMENT = 0x18538067
+_INFO = 0x1549A966
+_TIMECODE_SCALE = 0x2AD7B1
+_DURATION = 0x4489
+_TRACKS = 0x1654AE6B
+_TRACK_ENTRY = 0xAE
+_AUDIO = 0xE1
+_SAMPLING_FREQUENCY = 0xB5
+_CHANNELS = 0x9F
+_CLUSTER = 0x1F43B675
+
+def _vint(data: bytes, offset: int, keep_marker: bool = False):
+    first = data[offset]
+    length = 1
+    while length <= 8 and not first & (0x80 >> (length - 1)):
+        length += 1
+    if length > 8:
+        raise ValueError("invalid EBML vint")
+    value = first if keep_marker else first & (0xFF >> length)
+    for byte in data[offset + 1:offset + length]:
+        value = (value << 8) | byte
+    unknown = not keep_marker and value == (1 << (7 * length)) - 1
+    return value, offset + length, unknown
+
+def _ebml_elements(data: bytes, offset: int, end: int):
+    while offset < end:
+        element_id, offset, _ = _vint(data, offset, keep_marker=True)
+        element_size, offset, unknown = _vint(data, offset)
+        element_end = end if unknown else min(offset + element_size, end)
+        yield element_id, offset, element_end
+        if element_id == _CLUSTER:
+            return  # media data: everything we need comes before it
+        offset = element_end
+
+def _ebml_uint(data: bytes, start: int, end: int) -> int:
+    return int.from_bytes(data[start:end], "big")
+
+def _ebml_float(data: bytes, start: int, end: int) -> float:
+    return struct.unpack(">f" if end - start == 4 else ">d", data[start:end])[0]
+
+def _is_webm(head: bytes) -> bool:
+    return head[:4] == _EBML.to_bytes(4, "big")
+
+def _parse_webm(f, head: bytes, size: int) -> dict:
+    result = {}
+    for element_id, start, end in _ebml_elements(head, 0, len(head)):
+        if element_id != _SEGMENT:
+            continue
+        for child_id, child_start, child_end in _ebml_elements(head, start, end):
+            if child_id == _INFO:
+                scale, duration = 1000000, None
+                for info_id, info_start, info_end in _ebml_elements(head, child_start, child_end):
+                    if info_id == _TIMECODE_SCALE:
+                        scale = _ebml_uint(head, info_start, info_end)
+                    elif info_id == _DURATION:
+                        duration = _ebml_float(head, info_start, info_end)
+                if duration:
+                    result["duration"] = duration * scale / 1e9
+            elif child_id == _TRACKS:
+                for entry_id, entry_start, entry_end in _ebml_elements(head, child_start, child_end):
+                    if entry_id != _TRACK_ENTRY:
+                        continue
+                    for track_id, track_start, track_end in _ebml_elements(head, entry_start, entry_end):
+                        if track_id != _AUDIO:
+                            continue
+                        for audio_id, audio_start, audio_end in _ebml_elements(head, track_start, track_end):
+                            if audio_id == _SAMPLING_FREQUENCY:
+                                result["sample_rate"] = int(_ebml_float(head, audio_start, audio_end))
+                            elif audio_id == _CHANNELS:
+                                result["channels"] = _ebml_uint(head, audio_start, audio_end)
+        break
+    return result
+
+def _is_wav(head: bytes) -> bool:
+    return head[:4] == b"RIFF" and head[8:12] == b"WAVE"
+
+_PARSERS = [
+    ("wav", _is_wav, _parse_wav),
+    ("mp4", _is_mp4, _parse_mp4),
+    ("webm", _is_webm, _parse_webm),
+    ("mp3", _is_mp3, _parse_mp3),
+]
@@ -0,0 +1,152 @@
+import os
+import json
+import uuid
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines: in-process locking only
+    fcntl = None
+
+import utils
+from usage import usage_scope
+
+# =============================================================================
+# CONFIGURATION
+# =============================================================================
+# Batch mode: many recordings from one day are extracted concurrently on a
+# bounded pool, then reviewed one by one from a queue of drafts. Drafts are
+# stored on disk so any worker can serve the review queue.
+
+BATCH_DIR = Path(os.getenv("BATCH_DIR", "./batch_drafts"))
+BATCH_MAX_WORKERS = int(os.getenv("BATCH_MAX_WORKERS", "4"))
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "20"))
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+_file_locks = {}
+
+def get_executor() -> ThreadPoolExecutor:
+    # Shared across requests so concurrent batches together stay within the bound
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():  # threads don't survive fork
+            _executor = ThreadPoolExecutor(max_workers=BATCH_MAX_WORKERS, thread_name_prefix="batch")
+            _executor_pid = os.getpid()
+        return _executor
+
+# =============================================================================
+# PIPELINE
+# =============================================================================
+
+def process_item(item: dict, mode: str, pre_upload: bool, finalize) -> dict:
+    """
+    upload -> extract -> (optional) Kintone file pre-upload for one file.
+    """
+    draft = {
+        "original_name": item.get("original_name", ""),
+        "file_path": item["path"],
+        "file_key": "",
+        "status": "ready",
+        "error": "",
+        "data": {},
+    }
+    try:
+        with usage_scope(report_id=uuid.uuid4().hex):
+            if item.get("text"):
+                data = utils.process_audio_and_text(item["path"], item["text"], mode)
+            else:
+                data = utils.process_audio_only(item["path"], mode)
+        if not data:
+            raise ValueError("AIによる抽出に失敗しました")
+        draft["data"] = finalize(data, mode, item.get("client_id", ""), item.get("client_name", ""))
+        if pre_upload and mode != "qa":
+            # Kintone discards unused file keys after 3 days; the draft falls back to uploading on save
+            draft["file_key"] = utils.upload_file_to_kintone(item["path"], os.path.basename(item["path"]))
+    except Exception as e:
+        draft["status"] = "failed"
+        draft["error"] = str(e)
+    return draft
+
+def run_batch(items: list, staff_name: str, mode: str, pre_upload: bool, finalize) -> str:
+    """
+    Process all items concurrently and store the drafts. Returns the batch id.
+    Wall time is bounded by the slowest file (given enough pool slots).
+    """
+    executor = get_executor()
+    with usage_scope(staff=staff_name, mode=mode):
+        # contextvars don't cross into pool threads on their own
+        futures = [
+            executor.submit(contextvars.copy_context().run, process_item, item, mode, pre_upload, finalize)
+            for item in items
+        ]
+    drafts = [f.result() for f in futures]
+    batch = {
+        "batch_id": uuid.uuid4().hex[:12],
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "staff_name": staff_name,
+        "mode": mode,
+        "drafts": drafts,
+    }
+    save_batch(batch)
+    return batch["batch_id"]
+
+# =============================================================================
+# DRAFT STORE
+# =============================================================================
+
+def _batch_path(batch_id: str) -> Path:
+    if not batch_id.isalnum():
+        raise ValueError("invalid batch id")
+    return BATCH_DIR / f"{batch_id}.json"
+
+@contextmanager
+def _batch_lock(batch_id: str):
+    """
+    Blocking cross-worker lock on one batch file.
+    """
+    BATCH_DIR.mkdir(parents=True, exist_ok=True)
+    with open(_batch_path(batch_id).with_suffix(".lock"), "w") as f:
+        if fcntl is None:
+            with _executor_lock:
+                lock = _file_locks.setdefault(batch_id, threading.Lock())
+            with lock:
+                yield
+            return
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def save_batch(batch: dict):
+    BATCH_DIR.mkdir(parents=True, exist_ok=True)
+    path = _batch_path(batch["batch_id"])
+    tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp.write_text(json.dumps(batch, ensure_ascii=False, indent=1), encoding="utf-8")
+    os.replace(tmp, path)
+
+def load_batch(batch_id: str) -> dict:
+    try:
+        return json.loads(_batch_path(batch_id).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+def get_draft(batch_id: str, index: int):
+    batch = load_batch(batch_id)
+    if not batch or not 0 <= index < len(batch["drafts"]):
+        return None, None
+    return batch, batch["drafts"][index]
+
+def mark_draft(batch_id: str, index: int, status: str):
+    with _batch_lock(batch_id):
+        batch = load_batch(batch_id)
+        if batch and 0 <= index < len(batch["drafts"]):
+            batch["drafts"][index]["status"] = status
+            save_batch(batch)
@@ -0,0 +1,97 @@
+"""
+Cold-start benchmark.
+
+Measures, in fresh interpreters:
+  - import-time profile of the app (python -X importtime), heaviest modules first
+  - time-to-first-response for GET / and for the first request after warm-up
+
+Each run is appended to startup_bench.jsonl so regressions show up over time.
+
+    python bench_startup.py [--module app] [--top 15] [--runs 3]
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import subprocess
+from datetime import datetime
+
+RESULTS_PATH = "startup_bench.jsonl"
+
+# Keep the benchmark offline: no Kintone / Gemini credentials in the child.
+CHILD_ENV = {**os.environ, "GEMINI_API_KEY": "", "KINTONE_API_TOKEN": "", "KINTONE_CLIENT_API_TOKEN": "", "APP_PASSWORD": ""}
+
+FIRST_RESPONSE_CODE = """
+import json, time
+t0 = time.perf_counter()
+import {module} as target
+t1 = time.perf_counter()
+if {warm}:
+    import startup
+    startup.warm_shared_state()
+t2 = time.perf_counter()
+flask_app = getattr(target, "flask_app", None) or target.app
+resp = flask_app.test_client().get("/")
+t3 = time.perf_counter()
+print(json.dumps({{"import_s": t1 - t0, "warm_s": t2 - t1, "first_response_s": t3 - t2, "status": resp.status_code}}))
+"""
+
+_IMPORTTIME_RE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s+)(\S+)")
+
+def import_profile(module: str) -> list:
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, env=CHILD_ENV,
+    )
+    rows = []
+    for line in proc.stderr.splitlines():
+        m = _IMPORTTIME_RE.match(line)
+        if m:
+            rows.append({"module": m.group(4), "self_ms": int(m.group(1)) / 1000, "cumulative_ms": int(m.group(2)) / 1000, "depth": (len(m.group(3)) - 1) // 2})
+    return rows
+
+def first_response(module: str, warm: bool) -> dict:
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-c", FIRST_RESPONSE_CODE.format(module=module, warm=warm)],
+        capture_output=True, text=True, env=CHILD_ENV,
+    )
+    wall = time.perf_counter() - start
+    lines = [l for l in proc.stdout.splitlines() if l.startswith("{")]
+    if proc.returncode != 0 or not lines:
+        raise RuntimeError(proc.stderr[-2000:])
+    result = json.loads(lines[-1])
+    result["process_wall_s"] = wall
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="app")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    profile = import_profile(args.module)
+    total = next((r["cumulative_ms"] for r in profile if r["module"] == args.module and r["depth"] == 0), 0)
+    print(f"=== import profile: {args.module} ({total:.1f} ms) ===")
+    top_level = sorted((r for r in profile if r["depth"] <= 1), key=lambda r: r["cumulative_ms"], reverse=True)
+    for r in top_level[:args.top]:
+        print(f"{r['cumulative_ms']:9.1f} ms  {'  ' * r['depth']}{r['module']}")
+
+    results = {}
+    for warm in (False, True):
+        runs = [first_response(args.module, warm) for _ in range(args.runs)]
+        best = min(runs, key=lambda r: r["process_wall_s"])
+        label = "preloaded" if warm else "cold"
+        results[label] = {k: round(v, 4) if isinstance(v, float) else v for k, v in best.items()}
+        print(f"=== {label}: import {best['import_s'] * 1000:.1f} ms, warm-up {best['warm_s'] * 1000:.1f} ms, "
+              f"first response {best['first_response_s'] * 1000:.1f} ms, process wall {best['process_wall_s'] * 1000:.1f} ms")
+
+    entry = {"ts": datetime.now().isoformat(timespec="seconds"), "module": args.module, "import_ms": total, **results}
+    with open(RESULTS_PATH, "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry) + "\n")
+
+if __name__ == "__main__":
+    main()
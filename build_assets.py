@@ -0,0 +1,80 @@
+"""
+Static asset build step.
+
+Copies every source asset under static/ (css/, js/, icons) to static/dist/ under
+a content-hashed filename, writes .gz and .br (when the brotli module is
+installed) siblings next to each, and records the mapping in
+static/dist/asset-manifest.json. Templates resolve names through asset_url()
+in app.py, and serve_static sends dist/ files with immutable cache headers.
+
+Run after editing anything in static/:
+
+    python build_assets.py
+"""
+import os
+import gzip
+import json
+import shutil
+import hashlib
+from pathlib import Path
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_DIR = Path("static")
+DIST_DIR = STATIC_DIR / "dist"
+MANIFEST_PATH = DIST_DIR / "asset-manifest.json"
+
+# Logical names (relative to static/) that get fingerprinted.
+# manifest.json keeps its stable URL because installed PWAs refer to it.
+SOURCE_PATTERNS = ["css/*.css", "js/*.js", "icon.png", "apple-touch-icon.png"]
+COMPRESSIBLE = {".css", ".js", ".json", ".svg"}
+MIN_COMPRESS_BYTES = 256
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:10]
+
+def fingerprinted_name(logical: str, data: bytes) -> str:
+    path = Path(logical)
+    return str(path.with_name(f"{path.stem}.{content_hash(data)}{path.suffix}")).replace(os.sep, "/")
+
+def write_compressed(target: Path, data: bytes):
+    if target.suffix not in COMPRESSIBLE or len(data) < MIN_COMPRESS_BYTES:
+        return
+    # mtime=0 keeps the .gz output byte-identical across builds
+    target.with_name(target.name + ".gz").write_bytes(gzip.compress(data, compresslevel=9, mtime=0))
+    if brotli is not None:
+        target.with_name(target.name + ".br").write_bytes(brotli.compress(data, quality=11))
+
+def collect_sources() -> list:
+    sources = []
+    for pattern in SOURCE_PATTERNS:
+        sources.extend(sorted(p for p in STATIC_DIR.glob(pattern) if DIST_DIR not in p.parents))
+    return sources
+
+def build() -> dict:
+    if DIST_DIR.exists():
+        shutil.rmtree(DIST_DIR)
+    DIST_DIR.mkdir(parents=True)
+
+    manifest = {}
+    for source in collect_sources():
+        logical = source.relative_to(STATIC_DIR).as_posix()
+        data = source.read_bytes()
+        hashed = fingerprinted_name(logical, data)
+        target = DIST_DIR / hashed
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_bytes(data)
+        write_compressed(target, data)
+        manifest[logical] = f"dist/{hashed}"
+        print(f"{logical} -> static/dist/{hashed}")
+
+    MANIFEST_PATH.write_text(json.dumps(manifest, indent=2, sort_keys=True) + "\n", encoding="utf-8")
+    if brotli is None:
+        print("brotli が未インストールのため .br は生成されませんでした。")
+    return manifest
+
+if __name__ == "__main__":
+    build()
@@ -0,0 +1,354 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+# =============================================================================
+# CONFIGURATION
+# =============================================================================
+# One cache abstraction for every caching layer (rendered pages, client search,
+# history summaries, extraction results). Entries live in a namespace
+# ("search", "render", ...) that can be invalidated as a whole.
+#
+# Backends:
+# - "sqlite" (default): one file per host, shared by all workers
+# - "memory": in-process LRU, private to each worker
+# - "redis": any Redis-protocol server (REDIS_URL); the client can be injected
+#   with set_backend(RedisBackend(client)), e.g. a local stand-in
+# Cache errors never fail a request: they count as a miss.
+
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "sqlite")
+CACHE_DIR = Path(os.getenv("CACHE_DIR", "./shared_cache"))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(64 * 1024 * 1024)))        # whole cache (sqlite / memory)
+CACHE_MAX_ENTRY_BYTES = int(os.getenv("CACHE_MAX_ENTRY_BYTES", str(1024 * 1024)))  # larger values are not cached
+MEMORY_MAX_ENTRIES = 1024
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_KEY_PREFIX = os.getenv("REDIS_KEY_PREFIX", "sales-report:")
+
+SQLITE_TOUCH_INTERVAL = 60   # refresh an entry's LRU time at most this often (s)
+SQLITE_PRUNE_EVERY = 50      # sets between expiry / size pruning
+
+def encode(value) -> bytes:
+    if isinstance(value, bytes):
+        return b"b" + value
+    if isinstance(value, str):
+        return b"s" + value.encode("utf-8")
+    return b"j" + json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def decode(raw: bytes):
+    tag, body = raw[:1], raw[1:]
+    if tag == b"b":
+        return bytes(body)
+    if tag == b"s":
+        return bytes(body).decode("utf-8")
+    return json.loads(bytes(body).decode("utf-8"))
+
+def digest(*parts) -> str:
+    """
+    Stable key for arbitrary JSON-serializable parts.
+    """
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+# =============================================================================
+# BACKENDS
+# =============================================================================
+# get(key) -> bytes | None, set(key, raw, ttl), delete(key),
+# delete_prefix(prefix) -> count, info() -> dict
+
+class MemoryBackend:
+    def __init__(self, max_entries: int = MEMORY_MAX_ENTRIES, max_bytes: int = CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()   # key -> (raw, expires)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def _pop(self, key):
+        raw, _ = self._items.pop(key)
+        self._bytes -= len(raw)
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            if item[1] and item[1] < time.time():
+                self._pop(key)
+                return None
+            self._items.move_to_end(key)
+            return item[0]
+
+    def set(self, key, raw: bytes, ttl: float = None):
+        with self._lock:
+            if key in self._items:
+                self._pop(key)
+            self._items[key] = (raw, time.time() + ttl if ttl else None)
+            self._bytes += len(raw)
+            while self._items and (len(self._items) > self.max_entries or self._bytes > self.max_bytes):
+                self._pop(next(iter(self._items)))
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._items:
+                self._pop(key)
+
+    def delete_prefix(self, prefix: str) -> int:
+        with self._lock:
+            keys = [k for k in self._items if k.startswith(prefix)]
+            for key in keys:
+                self._pop(key)
+            return len(keys)
+
+    def info(self) -> dict:
+        with self._lock:
+            return {"backend": "memory", "entries": len(self._items), "bytes": self._bytes, "evictions": self.evictions}
+
+class SQLiteBackend:
+    """
+    Shared by all workers on the host. LRU by an access time refreshed at most
+    every SQLITE_TOUCH_INTERVAL, so reads rarely write.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS entries (
+        key TEXT PRIMARY KEY,
+        value BLOB NOT NULL,
+        size INTEGER NOT NULL,
+        expires REAL,
+        accessed REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed);
+    """
+
+    def __init__(self, path: Path = None, max_bytes: int = CACHE_MAX_BYTES):
+        self.path = path or CACHE_DIR / "cache.db"
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._sets = 0
+        self.evictions = 0
+
+    def connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():  # never reuse a connection across fork
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(self.SCHEMA)
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get(self, key):
+        conn = self.connect()
+        row = conn.execute("SELECT value, expires, accessed FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if row[1] and row[1] < now:
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            return None
+        if now - row[2] > SQLITE_TOUCH_INTERVAL:
+            conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def set(self, key, raw: bytes, ttl: float = None):
+        now = time.time()
+        self.connect().execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                               (key, raw, len(raw), now + ttl if ttl else None, now))
+        self._sets += 1
+        if self._sets % SQLITE_PRUNE_EVERY == 0:
+            self.prune()
+
+    def prune(self):
+        """
+        Drop expired entries, then least recently used ones until under max_bytes.
+        """
+        conn = self.connect()
+        conn.execute("DELETE FROM entries WHERE expires IS NOT NULL AND expires < ?", (time.time(),))
+        excess = (conn.execute("SELECT SUM(size) FROM entries").fetchone()[0] or 0) - self.max_bytes
+        if excess <= 0:
+            return
+        victims = []
+        for key, size in conn.execute("SELECT key, size FROM entries ORDER BY accessed ASC"):
+            victims.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        conn.executemany("DELETE FROM entries WHERE key = ?", victims)
+        self.evictions += len(victims)
+
+    def delete(self, key):
+        self.connect().execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def delete_prefix(self, prefix: str) -> int:
+        # Range scan on the primary key instead of LIKE (no escaping needed)
+        cur = self.connect().execute("DELETE FROM entries WHERE key >= ? AND key < ?", (prefix, prefix + "\U0010ffff"))
+        return cur.rowcount
+
+    def info(self) -> dict:
+        count, size = self.connect().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return {"backend": "sqlite", "path": str(self.path), "entries": count, "bytes": size, "evictions": self.evictions}
+
+class RedisBackend:
+    """
+    Any client with redis-py's get / set(ex=) / delete / scan_iter. The total
+    size limit is the server's maxmemory policy.
+    """
+
+    def __init__(self, client, key_prefix: str = REDIS_KEY_PREFIX):
+        self.client = client
+        self.key_prefix = key_prefix
+
+    def get(self, key):
+        return self.client.get(self.key_prefix + key)
+
+    def set(self, key, raw: bytes, ttl: float = None):
+        self.client.set(self.key_prefix + key, raw, ex=max(int(ttl), 1) if ttl else None)
+
+    def delete(self, key):
+        self.client.delete(self.key_prefix + key)
+
+    def delete_prefix(self, prefix: str) -> int:
+        pattern = "".join("\\" + c if c in "*?[]\\" else c for c in self.key_prefix + prefix) + "*"
+        keys = list(self.client.scan_iter(match=pattern, count=500))
+        for i in range(0, len(keys), 500):
+            self.client.delete(*keys[i:i + 500])
+        return len(keys)
+
+    def info(self) -> dict:
+        return {"backend": "redis", "key_prefix": self.key_prefix}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def create_backend(name: str = CACHE_BACKEND):
+    if name == "memory":
+        return MemoryBackend()
+    if name == "redis":
+        try:
+            import redis  # optional dependency, only needed for CACHE_BACKEND=redis
+            return RedisBackend(redis.Redis.from_url(REDIS_URL))
+        except ImportError:
+            print("redis パッケージが見つかりません。sqlite キャッシュを使用します。")
+    return SQLiteBackend()
+
+def get_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = create_backend()
+        return _backend
+
+def set_backend(backend):
+    """
+    Replace the shared backend (e.g. a Redis client stand-in).
+    """
+    global _backend
+    with _backend_lock:
+        _backend = backend
+
+# =============================================================================
+# NAMESPACED CACHE
+# =============================================================================
+
+class Cache:
+    """
+    One namespace on the shared backend. Stats are per process.
+    """
+
+    def __init__(self, namespace: str, ttl: float = None, max_entry_bytes: int = CACHE_MAX_ENTRY_BYTES):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_entry_bytes = max_entry_bytes
+        self.hits = self.misses = self.sets = self.oversized = self.errors = 0
+
+    def _key(self, key) -> str:
+        return f"{self.namespace}:{key}"
+
+    def get(self, key):
+        try:
+            raw = get_backend().get(self._key(key))
+        except Exception as e:
+            print(f"Cache Get Error ({self.namespace}): {e}")
+            self.errors += 1
+            raw = None
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return decode(raw)
+
+    def set(self, key, value, ttl: float = None):
+        raw = encode(value)
+        if len(raw) > self.max_entry_bytes:
+            self.oversized += 1
+            return
+        try:
+            get_backend().set(self._key(key), raw, ttl or self.ttl)
+            self.sets += 1
+        except Exception as e:
+            print(f"Cache Set Error ({self.namespace}): {e}")
+            self.errors += 1
+
+    def delete(self, key):
+        try:
+            get_backend().delete(self._key(key))
+        except Exception as e:
+            print(f"Cache Delete Error ({self.namespace}): {e}")
+            self.errors += 1
+
+    def get_or_set(self, key, build, ttl: float = None):
+        value = self.get(key)
+        if value is None:
+            value = build()
+            if value is not None:
+                self.set(key, value, ttl)
+        return value
+
+    def invalidate(self) -> int:
+        """
+        Drop every entry in this namespace (all workers, for shared backends).
+        """
+        try:
+            return get_backend().delete_prefix(self.namespace + ":")
+        except Exception as e:
+            print(f"Cache Invalidate Error ({self.namespace}): {e}")
+            self.errors += 1
+            return 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits, "misses": self.misses, "sets": self.sets,
+            "oversized": self.oversized, "errors": self.errors,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "ttl": self.ttl,
+        }
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_cache(namespace: str, ttl: float = None, **kwargs) -> Cache:
+    with _caches_lock:
+        if namespace not in _caches:
+            _caches[namespace] = Cache(namespace, ttl=ttl, **kwargs)
+        return _caches[namespace]
+
+def invalidate(namespace: str) -> int:
+    return get_cache(namespace).invalidate()
+
+def stats() -> dict:
+    with _caches_lock:
+        namespaces = {name: c.stats() for name, c in _caches.items()}
+    try:
+        backend = get_backend().info()
+    except Exception as e:
+        backend = {"error": str(e)}
+    return {"pid": os.getpid(), "backend": backend, "namespaces": namespaces}
@@ -0,0 +1,405 @@
+import os
+import re
+import json
+import gzip
+import time
+import uuid
+import threading
+import unicodedata
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines: in-process locking only
+    fcntl = None
+
+import utils
+import startup
+
+# =============================================================================
+# CONFIGURATION
+# =============================================================================
+# The whole client directory (取引先アプリ) as a compact, versioned index that the
+# browser downloads once and searches locally. The snapshot on disk is shared by
+# all workers; one worker at a time refreshes it from Kintone (file lock).
+
+CLIENT_INDEX_DIR = Path(os.getenv("CLIENT_INDEX_DIR", "./client_index"))
+SNAPSHOT_PATH = CLIENT_INDEX_DIR / "snapshot.json"
+LOCK_PATH = CLIENT_INDEX_DIR / "refresh.lock"
+
+CLIENT_INDEX_TTL = int(os.getenv("CLIENT_INDEX_TTL", "300"))          # incremental refresh interval (s)
+FULL_CHECK_INTERVAL = int(os.getenv("CLIENT_INDEX_FULL_CHECK", "3600"))  # deletion check interval (s)
+MAX_CHANGELOG = 200        # versions kept for /api/client_index/delta
+COMPACT_HOLE_RATIO = 0.25  # rebuild slots (new epoch) once this many are deleted
+
+UPDATED_AT_FIELD = "更新日時"
+FIELDS = ["$id", "取引先ID", "取引先名", UPDATED_AT_FIELD]
+
+def normalize(text: str) -> str:
+    return re.sub(r"\s+", "", unicodedata.normalize("NFKC", text or "")).lower()
+
+def trigrams(text: str) -> set:
+    norm = normalize(text)
+    return {norm[i:i + 3] for i in range(len(norm) - 2)}
+
+# =============================================================================
+# INDEX
+# =============================================================================
+
+class ClientIndex:
+    """
+    Slots are positions in the published arrays. They stay stable within an
+    epoch (deleted clients leave a hole) so browsers can apply deltas by slot.
+    """
+
+    def __init__(self):
+        self.epoch = uuid.uuid4().hex[:8]
+        self.version = 0
+        self.slots = []          # [record_id, client_id, name] or None
+        self.by_record = {}      # record_id -> slot
+        self.postings = {}       # trigram -> set(slot)
+        self.changes = []        # [{"v", "upserts", "deletes"}]
+        self.watermark = ""      # max 更新日時 seen
+        self.refreshed_at = 0.0
+        self.full_checked_at = 0.0
+        self._payload_cache = {}
+
+    # --- mutation -----------------------------------------------------------
+    # Only ever on a copy(): the published index is read by other threads
+    # (search, payload, delta) without a lock, and is replaced, never changed.
+
+    def copy(self) -> "ClientIndex":
+        index = ClientIndex.__new__(ClientIndex)
+        index.__dict__.update(self.__dict__)
+        index.slots = list(self.slots)            # entries are replaced, not mutated
+        index.by_record = dict(self.by_record)
+        index.postings = {gram: set(slots) for gram, slots in self.postings.items()}
+        index.changes = list(self.changes)
+        index._payload_cache = {}
+        return index
+
+    def _index_slot(self, slot: int, add: bool):
+        for gram in trigrams(self.slots[slot][2]):
+            if add:
+                self.postings.setdefault(gram, set()).add(slot)
+            else:
+                bucket = self.postings.get(gram)
+                if bucket:
+                    bucket.discard(slot)
+                    if not bucket: del self.postings[gram]
+
+    def upsert(self, record_id: str, client_id: str, name: str):
+        """
+        Returns the touched slot, or None if nothing changed.
+        """
+        entry = [record_id, client_id, name]
+        slot = self.by_record.get(record_id)
+        if slot is None:
+            slot = len(self.slots)
+            self.slots.append(entry)
+            self.by_record[record_id] = slot
+        elif self.slots[slot] == entry:
+            return None
+        else:
+            self._index_slot(slot, add=False)
+            self.slots[slot] = entry
+        self._index_slot(slot, add=True)
+        return slot
+
+    def delete(self, record_id: str):
+        slot = self.by_record.pop(record_id, None)
+        if slot is None:
+            return None
+        self._index_slot(slot, add=False)
+        self.slots[slot] = None
+        return slot
+
+    def commit(self, upserts: list, deletes: list) -> bool:
+        upserts = [s for s in upserts if s is not None]
+        deletes = [s for s in deletes if s is not None]
+        if not upserts and not deletes:
+            return False
+        holes = sum(1 for s in self.slots if s is None)
+        if self.slots and holes / len(self.slots) > COMPACT_HOLE_RATIO:
+            self.compact()
+            return True
+        self.version += 1
+        self.changes.append({"v": self.version, "upserts": sorted(set(upserts)), "deletes": sorted(set(deletes))})
+        del self.changes[:-MAX_CHANGELOG]
+        self._payload_cache.clear()
+        return True
+
+    def compact(self):
+        live = [s for s in self.slots if s is not None]
+        watermark, refreshed_at, full_checked_at = self.watermark, self.refreshed_at, self.full_checked_at
+        self.__init__()
+        for record_id, client_id, name in live:
+            self.upsert(record_id, client_id, name)
+        self.version = 1
+        self.watermark, self.refreshed_at, self.full_checked_at = watermark, refreshed_at, full_checked_at
+
+    # --- publishing ---------------------------------------------------------
+
+    def payload(self) -> dict:
+        return {
+            "epoch": self.epoch,
+            "v": self.version,
+            "rids": [s[0] if s else None for s in self.slots],
+            "ids": [s[1] if s else None for s in self.slots],
+            "names": [s[2] if s else None for s in self.slots],
+            "tri": {gram: sorted(slots) for gram, slots in self.postings.items()},
+        }
+
+    def payload_bytes(self, compressed: bool) -> bytes:
+        key = (self.epoch, self.version, compressed)
+        if key not in self._payload_cache:
+            raw = json.dumps(self.payload(), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            self._payload_cache[(self.epoch, self.version, False)] = raw
+            self._payload_cache[(self.epoch, self.version, True)] = gzip.compress(raw, compresslevel=6)
+        return self._payload_cache[key]
+
+    def delta(self, epoch: str, since: int) -> dict:
+        oldest = self.changes[0]["v"] - 1 if self.changes else self.version
+        if epoch != self.epoch or since < oldest or since > self.version:
+            return {"full": True, "epoch": self.epoch, "v": self.version}
+        upserts, deletes = set(), set()
+        for change in self.changes:
+            if change["v"] > since:
+                upserts.update(change["upserts"])
+                deletes.update(change["deletes"])
+        return {
+            "epoch": self.epoch,
+            "v": self.version,
+            "upserts": [[slot] + self.slots[slot] for slot in sorted(upserts) if self.slots[slot] is not None],
+            "deletes": sorted(slot for slot in deletes if self.slots[slot] is None),
+        }
+
+    def search(self, keyword: str, limit: int = 20) -> list:
+        query = normalize(keyword)
+        if not query:
+            return []
+        if len(query) >= 3:
+            grams = [query[i:i + 3] for i in range(len(query) - 2)]
+            candidates = set.intersection(*(self.postings.get(g, set()) for g in grams))
+        else:
+            candidates = range(len(self.slots))
+        results = []
+        for slot in sorted(candidates):
+            entry = self.slots[slot]
+            if entry and query in normalize(entry[2]):
+                results.append({"id": entry[1], "record_id": entry[0], "name": entry[2]})
+                if len(results) >= limit: break
+        return results
+
+    # --- persistence --------------------------------------------------------
+
+    def to_snapshot(self) -> dict:
+        return {
+            "epoch": self.epoch, "version": self.version, "slots": self.slots, "changes": self.changes,
+            "watermark": self.watermark, "refreshed_at": self.refreshed_at, "full_checked_at": self.full_checked_at,
+        }
+
+    @classmethod
+    def from_snapshot(cls, snap: dict) -> "ClientIndex":
+        index = cls()
+        index.epoch = snap["epoch"]
+        index.slots = snap["slots"]
+        for slot, entry in enumerate(index.slots):
+            if entry is not None:
+                index.by_record[entry[0]] = slot
+                index._index_slot(slot, add=True)
+        index.version = snap["version"]
+        index.changes = snap["changes"]
+        index.watermark = snap.get("watermark", "")
+        index.refreshed_at = snap.get("refreshed_at", 0.0)
+        index.full_checked_at = snap.get("full_checked_at", 0.0)
+        return index
+
+# =============================================================================
+# SHARED STATE / REFRESH
+# =============================================================================
+
+_index = None
+_snapshot_mtime = 0.0
+_lock = threading.Lock()
+_refreshing = threading.Event()
+
+@contextmanager
+def _refresh_lock():
+    """
+    Non-blocking cross-worker lock. Yields False if another worker holds it.
+    """
+    CLIENT_INDEX_DIR.mkdir(parents=True, exist_ok=True)
+    with open(LOCK_PATH, "w") as f:
+        if fcntl is None:
+            yield True
+            return
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def _save(index: ClientIndex):
+    global _snapshot_mtime
+    CLIENT_INDEX_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = SNAPSHOT_PATH.with_suffix(".tmp")
+    tmp.write_text(json.dumps(index.to_snapshot(), ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, SNAPSHOT_PATH)
+    _snapshot_mtime = SNAPSHOT_PATH.stat().st_mtime
+
+def load() -> ClientIndex:
+    """
+    Current index, reloaded from disk if another worker has published a newer snapshot.
+    """
+    global _index, _snapshot_mtime
+    with _lock:
+        try:
+            mtime = SNAPSHOT_PATH.stat().st_mtime
+        except OSError:
+            mtime = 0.0
+        if mtime and mtime != _snapshot_mtime:
+            try:
+                _index = ClientIndex.from_snapshot(json.loads(SNAPSHOT_PATH.read_text(encoding="utf-8")))
+                _snapshot_mtime = mtime
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Client Index Load Error: {e}")
+        return _index
+
+def client_names() -> dict:
+    """
+    {id: name} for display. Reports store the client's record id in 取引先ID
+    (see index.js), so both the record id and the client app's 取引先ID map to the name.
+    """
+    index = load()
+    names = {}
+    for entry in (index.slots if index else []):
+        if entry:
+            names[entry[1]] = names[entry[0]] = entry[2]
+    return names
+
+def _record_fields(rec: dict):
+    record_id = rec["$id"]["value"]
+    client_id = rec.get("取引先ID", {}).get("value") or record_id
+    name = rec.get("取引先名", {}).get("value", "不明")
+    return record_id, client_id, name, rec.get(UPDATED_AT_FIELD, {}).get("value", "")
+
+def _iter_clients(query: str, fields: list = FIELDS):
+    for page in utils.iter_kintone_records(utils.KINTONE_CLIENT_APP_ID, utils.KINTONE_CLIENT_API_TOKEN, query, fields):
+        yield from page
+
+def refresh(full: bool = False) -> ClientIndex:
+    """
+    Pull changes from the client app into the shared snapshot. Incremental by
+    更新日時; a periodic (or forced) full pass also picks up deleted clients.
+    """
+    global _index
+    if not utils.KINTONE_CLIENT_APP_ID or not utils.KINTONE_CLIENT_API_TOKEN:
+        return load()
+    with _refresh_lock() as acquired:
+        if not acquired:
+            return load()  # another worker is refreshing; use what is on disk
+        current = load()
+        index = current.copy() if current is not None else ClientIndex()
+        now = time.time()
+        full = full or not index.slots or now - index.full_checked_at > FULL_CHECK_INTERVAL
+        upserts, deletes = [], []
+        try:
+            if full:
+                seen = set()
+                for rec in _iter_clients("order by $id asc"):
+                    record_id, client_id, name, updated = _record_fields(rec)
+                    seen.add(record_id)
+                    upserts.append(index.upsert(record_id, client_id, name))
+                    index.watermark = max(index.watermark, updated)
+                for record_id in [r for r in index.by_record if r not in seen]:
+                    deletes.append(index.delete(record_id))
+                index.full_checked_at = now
+            else:
+                # 更新日時 has minute precision: >= re-reads the last minute (unchanged entries are no-ops)
+                query = f'{UPDATED_AT_FIELD} >= "{index.watermark}" order by {UPDATED_AT_FIELD} asc' if index.watermark else ""
+                for rec in _iter_clients(query):
+                    record_id, client_id, name, updated = _record_fields(rec)
+                    upserts.append(index.upsert(record_id, client_id, name))
+                    index.watermark = max(index.watermark, updated)
+        except Exception as e:
+            print(f"Client Index Refresh Error: {e}")
+            return load()
+        index.commit(upserts, deletes)
+        index.refreshed_at = now
+        with _lock:
+            _save(index)
+            _index = index
+        return index
+
+def apply_records(records: list, deleted_ids: list = (), wait: float = 5.0) -> list:
+    """
+    Apply client records pushed by a webhook without querying Kintone.
+    Returns the affected clients' names, old and new. The watermark is left
+    alone, so the next incremental refresh still reads anything in between.
+    """
+    global _index
+    deadline = time.monotonic() + wait
+    while True:
+        with _refresh_lock() as acquired:
+            if acquired:
+                current = load()
+                if current is None:
+                    return []  # nothing built yet: the first refresh reads everything
+                index = current.copy()
+                names, upserts, deletes = [], [], []
+                for rec in records:
+                    record_id, client_id, name, _ = _record_fields(rec)
+                    slot = index.by_record.get(record_id)
+                    if slot is not None:
+                        names.append(index.slots[slot][2])
+                    names.append(name)
+                    upserts.append(index.upsert(record_id, client_id, name))
+                for record_id in deleted_ids:
+                    slot = index.by_record.get(record_id)
+                    if slot is not None:
+                        names.append(index.slots[slot][2])
+                    deletes.append(index.delete(record_id))
+                if index.commit(upserts, deletes):
+                    with _lock:
+                        _save(index)
+                        _index = index
+                return names
+        if time.monotonic() > deadline:
+            # A refresh held the lock throughout; have the next one pick the change up
+            refresh_in_background()
+            return []
+        time.sleep(0.2)
+
+def refresh_in_background(full: bool = False):
+    if _refreshing.is_set():
+        return
+    _refreshing.set()
+
+    def run():
+        try:
+            refresh(full)
+        finally:
+            _refreshing.clear()
+    threading.Thread(target=run, daemon=True).start()
+
+def get_index() -> ClientIndex:
+    """
+    Index for request handling. Builds synchronously only if none exists yet;
+    otherwise a stale index is served while a background refresh runs.
+    """
+    index = load()
+    if index is None:
+        return refresh()
+    if time.time() - index.refreshed_at > CLIENT_INDEX_TTL:
+        refresh_in_background()
+    return index
+
+@startup.on_warmup
+def load_client_index():
+    load()
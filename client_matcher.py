@@ -0,0 +1,214 @@
+import re
+import threading
+import unicodedata
+from collections import deque
+
+import client_index
+import startup
+
+# =============================================================================
+# CONFIGURATION
+# =============================================================================
+# Finds client names mentioned in a memo / transcript / extraction result with
+# one Aho-Corasick pass over every name and alias in the client directory, so
+# the confirm page can pre-fill the client the rep forgot to pick.
+#
+# Kept current from client_index deltas: new or renamed clients go into a small
+# secondary automaton, deleted or renamed slots are filtered on match, and the
+# main automaton is rebuilt only once the secondary one has grown large.
+
+MIN_ALIAS_LENGTH = 3     # shorter aliases match too much unrelated text
+DELTA_REBUILD_SIZE = 200 # secondary patterns before a full rebuild
+MAX_CANDIDATES = 5
+# Pre-filling the confirm page needs a clear winner: one short or shared alias in
+# a memo must not attach the report to the wrong client
+PREFILL_MIN_SCORE = 6.0  # e.g. one unique alias of 6+ characters
+PREFILL_MARGIN = 1.5     # top score over the runner-up
+
+# Legal-entity affixes people leave out when naming a client
+ENTITY_AFFIXES = [
+    "株式会社", "(株)", "有限会社", "(有)", "合同会社", "社会福祉法人", "学校法人", "医療法人社団", "医療法人財団",
+    "医療法人", "一般社団法人", "公益社団法人", "一般財団法人", "公益財団法人", "特定非営利活動法人", "npo法人",
+    "社会医療法人", "独立行政法人", "地方独立行政法人",
+]
+
+def aliases(name: str) -> set:
+    """
+    Normalized full name, the name without legal-entity affixes, and each
+    space-separated part (e.g. the facility name after the corporation name).
+    """
+    found = set()
+    text = unicodedata.normalize("NFKC", name or "")
+    candidates = [text] + re.split(r"\s+", text)
+    for candidate in candidates:
+        norm = client_index.normalize(candidate)
+        found.add(norm)
+        for affix in ENTITY_AFFIXES:
+            norm = norm.replace(affix, "")
+        found.add(norm)
+    return {a for a in found if len(a) >= MIN_ALIAS_LENGTH}
+
+# =============================================================================
+# AUTOMATON
+# =============================================================================
+
+class Automaton:
+    """
+    Aho-Corasick over normalized aliases. outputs[state] lists (alias, slots) ending there.
+    """
+
+    def __init__(self, patterns: dict):
+        self.goto = [{}]
+        self.fail = [0]
+        self.outputs = [[]]
+        for alias, slots in patterns.items():
+            state = 0
+            for ch in alias:
+                nxt = self.goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[state][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.outputs.append([])
+                state = nxt
+            self.outputs[state].append((alias, tuple(slots)))
+        # Breadth-first failure links; outputs inherit their failure state's outputs
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self.goto[state].items():
+                queue.append(nxt)
+                f = self.fail[state]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                self.outputs[nxt] = self.outputs[nxt] + self.outputs[self.fail[nxt]]
+
+    def scan(self, text: str):
+        """
+        Yield (alias, slots) for every occurrence, in one pass over text.
+        """
+        state = 0
+        for ch in text:
+            while state and ch not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(ch, 0)
+            for hit in self.outputs[state]:
+                yield hit
+
+# =============================================================================
+# MATCHER
+# =============================================================================
+
+class ClientMatcher:
+    def __init__(self, index: "client_index.ClientIndex"):
+        self.epoch = index.epoch
+        self.version = index.version
+        self.entries = {}        # slot -> [record_id, client_id, name]
+        self.slot_aliases = {}   # slot -> set(alias) for the current name
+        for slot, entry in enumerate(index.slots):
+            if entry is not None:
+                self.entries[slot] = entry
+                self.slot_aliases[slot] = aliases(entry[2])
+        self.main = Automaton(self._patterns(self.slot_aliases))
+        self.delta_aliases = {}
+        self.delta = Automaton({})
+
+    @staticmethod
+    def _patterns(slot_aliases: dict) -> dict:
+        patterns = {}
+        for slot, names in slot_aliases.items():
+            for alias in names:
+                patterns.setdefault(alias, []).append(slot)
+        return patterns
+
+    def apply_delta(self, delta: dict) -> bool:
+        """
+        Apply a client_index delta. Returns False if a full rebuild is needed instead.
+        """
+        if delta.get("full"):
+            return False
+        for slot in delta["deletes"]:
+            self.entries.pop(slot, None)
+            self.slot_aliases.pop(slot, None)
+            self.delta_aliases.pop(slot, None)
+        for slot, record_id, client_id, name in delta["upserts"]:
+            self.entries[slot] = [record_id, client_id, name]
+            self.slot_aliases[slot] = aliases(name)
+            self.delta_aliases[slot] = self.slot_aliases[slot]
+        if sum(len(a) for a in self.delta_aliases.values()) > DELTA_REBUILD_SIZE:
+            return False
+        self.delta = Automaton(self._patterns(self.delta_aliases))
+        self.version = delta["v"]
+        return True
+
+    def match(self, text: str, limit: int = MAX_CANDIDATES) -> list:
+        """
+        Ranked candidates [{"id", "record_id", "name", "score"}] for clients named in text.
+        """
+        norm = client_index.normalize(text)
+        if not norm:
+            return []
+        scores = {}
+        seen = set()
+        for automaton in (self.main, self.delta):
+            for alias, slots in automaton.scan(norm):
+                # Main-automaton hits for deleted or changed slots are dropped (the delta one covers those)
+                live = [s for s in slots if alias in self.slot_aliases.get(s, ())
+                        and (automaton is self.delta or s not in self.delta_aliases)]
+                if not live:
+                    continue
+                for slot in live:
+                    # Longer aliases are stronger evidence; aliases shared by many clients weaker,
+                    # and repeated mentions add only a little
+                    weight = len(alias) / len(live)
+                    if (alias, slot) in seen:
+                        weight *= 0.25
+                    seen.add((alias, slot))
+                    scores[slot] = scores.get(slot, 0.0) + weight
+        ranked = sorted(scores.items(), key=lambda kv: (-kv[1], kv[0]))[:limit]
+        # Same shape as ClientIndex.search, plus the score
+        return [{"id": self.entries[slot][1], "record_id": self.entries[slot][0], "name": self.entries[slot][2],
+                 "score": round(score, 2)} for slot, score in ranked]
+
+# =============================================================================
+# SHARED STATE
+# =============================================================================
+
+_matcher = None
+_lock = threading.Lock()
+
+def get_matcher():
+    """
+    Matcher for the current client index, updated from its deltas (None if no index yet).
+    """
+    global _matcher
+    index = client_index.load()
+    if index is None:
+        return None
+    with _lock:
+        if _matcher is not None and (_matcher.epoch, _matcher.version) == (index.epoch, index.version):
+            return _matcher
+        if _matcher is None or _matcher.epoch != index.epoch or not _matcher.apply_delta(index.delta(_matcher.epoch, _matcher.version)):
+            _matcher = ClientMatcher(index)
+        return _matcher
+
+def suggest_clients(*texts, limit: int = MAX_CANDIDATES) -> list:
+    matcher = get_matcher()
+    if matcher is None:
+        return []
+    return matcher.match("\n".join(t for t in texts if isinstance(t, str) and t), limit=limit)
+
+def confident(candidates: list) -> bool:
+    """
+    True if the top candidate is strong and clearly ahead of the runner-up.
+    """
+    if not candidates or candidates[0]["score"] < PREFILL_MIN_SCORE:
+        return False
+    return len(candidates) == 1 or candidates[0]["score"] >= PREFILL_MARGIN * candidates[1]["score"]
+
+@startup.on_warmup
+def build_client_matcher():
+    # Built before fork when preloading, so workers share the automaton
+    get_matcher()
@@ -0,0 +1,246 @@
+"""
+Bulk export of the report app (日報) as CSV or Parquet.
+
+Records are read page by page through Kintone's cursor API and written out as
+they arrive, so memory stays flat however many reports match. Used by
+GET /api/export/reports (a streamed download) and from the command line:
+
+    python export_reports.py --month 2026-09 -o reports-2026-09.csv
+    python export_reports.py --from 2026-04-01 --to 2026-09-30 --staff "水野 邦彦" --format parquet -o h1.parquet
+
+Parquet needs pyarrow (pip install pyarrow); CSV is UTF-8 with a BOM so Excel opens it as is.
+"""
+import io
+import csv
+import sys
+import argparse
+import calendar
+from datetime import date, datetime
+
+import utils
+import client_index
+
+# =============================================================================
+# CONFIGURATION
+# =============================================================================
+
+# (Kintone field code, column header)
+COLUMNS = [
+    ("$id", "レコード番号"),
+    ("対応日", "対応日"),
+    ("取引先ID", "取引先ID"),
+    (None, "取引先名"),  # from the client index, not a report field
+    ("対応者", "対応者"),
+    ("新規営業件名", "新規営業件名"),
+    ("商談内容", "商談内容"),
+    ("現在の課題・問題点", "現在の課題・問題点"),
+    ("競合・マーケット情報", "競合・マーケット情報"),
+    ("次回提案内容", "次回提案内容"),
+    ("次回提案予定日", "次回提案予定日"),
+    ("次回営業件名", "次回営業件名"),
+    ("更新日時", "更新日時"),
+]
+FIELDS = [code for code, _ in COLUMNS if code]
+DATE_COLUMNS = {"対応日", "次回提案予定日"}
+
+CSV_FLUSH_BYTES = 64 * 1024   # CSV is sent in chunks of about this size
+PARQUET_ROW_GROUP = 5000      # rows buffered per Parquet row group
+
+FORMATS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+# =============================================================================
+# QUERY
+# =============================================================================
+
+def parse_date(value: str) -> str:
+    """
+    YYYY-MM-DD, validated (raises ValueError), or "" if empty.
+    """
+    return date.fromisoformat(value).isoformat() if value else ""
+
+def month_range(month: str) -> tuple:
+    year, mon = (int(part) for part in month.split("-"))
+    return date(year, mon, 1).isoformat(), date(year, mon, calendar.monthrange(year, mon)[1]).isoformat()
+
+def build_query(date_from: str = "", date_to: str = "", staff: list = (), activities: list = ()) -> str:
+    conditions = []
+    if date_from:
+        conditions.append(f"対応日 >= {utils.kintone_quote(parse_date(date_from))}")
+    if date_to:
+        conditions.append(f"対応日 <= {utils.kintone_quote(parse_date(date_to))}")
+    if staff:
+        # 対応者 is a user field: matched by login name (the code in STAFF_CODE_MAP)
+        codes = [utils.STAFF_CODE_MAP.get(name, name) for name in staff]
+        conditions.append(f"対応者 in ({', '.join(utils.kintone_quote(c) for c in codes)})")
+    if activities:
+        conditions.append(f"新規営業件名 in ({', '.join(utils.kintone_quote(a) for a in activities)})")
+    return " ".join([" and ".join(conditions), "order by 対応日 asc, $id asc"]).strip()
+
+# =============================================================================
+# ROWS
+# =============================================================================
+
+def _cell(rec: dict, code: str) -> str:
+    value = rec.get(code, {}).get("value")
+    if code == "対応者":
+        return ", ".join(user.get("name", "") for user in value or [])
+    return value or ""
+
+def iter_rows(query: str):
+    """
+    One list per report, in COLUMNS order, streamed from the cursor API.
+    """
+    names = client_index.client_names()
+    for page in utils.iter_kintone_records(utils.KINTONE_APP_ID, utils.report_app_token(), query, FIELDS):
+        for rec in page:
+            row = []
+            for code, _ in COLUMNS:
+                row.append(_cell(rec, code) if code else names.get(_cell(rec, "取引先ID"), ""))
+            yield row
+
+# =============================================================================
+# WRITERS
+# =============================================================================
+
+def iter_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write("\ufeff")  # BOM: Excel reads the file as UTF-8
+    writer.writerow([header for _, header in COLUMNS])
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= CSV_FLUSH_BYTES:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")
+
+class _ChunkSink:
+    """
+    Write-only file object for ParquetWriter: written bytes are handed out by drain().
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+def _parquet_schema():
+    import pyarrow as pa
+    types = {"レコード番号": pa.int64(), "更新日時": pa.timestamp("s", tz="UTC")}
+    return pa.schema([(header, pa.date32() if header in DATE_COLUMNS else types.get(header, pa.string()))
+                      for _, header in COLUMNS])
+
+def _parquet_value(header: str, value: str):
+    if header == "レコード番号":
+        return int(value) if value else None
+    if header in DATE_COLUMNS:
+        return date.fromisoformat(value) if value else None
+    if header == "更新日時":
+        return datetime.fromisoformat(value.replace("Z", "+00:00")) if value else None
+    return value
+
+def iter_parquet(rows):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    schema = _parquet_schema()
+    headers = [header for _, header in COLUMNS]
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+
+    def write(batch):
+        columns = {h: [_parquet_value(h, row[i]) for row in batch] for i, h in enumerate(headers)}
+        writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= PARQUET_ROW_GROUP:
+            write(batch)
+            batch = []
+            yield sink.drain()
+    if batch:
+        write(batch)
+    writer.close()
+    yield sink.drain()
+
+def configured() -> bool:
+    return all([utils.KINTONE_SUBDOMAIN, utils.KINTONE_APP_ID, utils.KINTONE_API_TOKEN])
+
+def parquet_available() -> bool:
+    try:
+        import pyarrow.parquet  # noqa: F401  (optional dependency)
+        return True
+    except ImportError:
+        return False
+
+def export(fmt: str, query: str):
+    """
+    Byte chunks of the whole export.
+    """
+    rows = iter_rows(query)
+    return iter_parquet(rows) if fmt == "parquet" else iter_csv(rows)
+
+def filename(fmt: str, date_from: str = "", date_to: str = "") -> str:
+    span = f"{date_from or 'start'}_{date_to or date.today().isoformat()}"
+    return f"reports_{span}.{FORMATS[fmt][1]}"
+
+# =============================================================================
+# CLI
+# =============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--month", help="YYYY-MM (instead of --from / --to)")
+    parser.add_argument("--from", dest="date_from", default="")
+    parser.add_argument("--to", dest="date_to", default="")
+    parser.add_argument("--staff", action="append", default=[], help="対応者 (repeatable)")
+    parser.add_argument("--activity", action="append", default=[], help="新規営業件名 (repeatable)")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="csv")
+    parser.add_argument("-o", "--output", help="default: reports_<from>_<to>.<ext>")
+    args = parser.parse_args()
+
+    if not configured():
+        print("Error: Missing Kintone configuration.")
+        sys.exit(1)
+    if args.format == "parquet" and not parquet_available():
+        print("Error: pyarrow is required for Parquet (pip install pyarrow).")
+        sys.exit(1)
+    date_from, date_to = month_range(args.month) if args.month else (args.date_from, args.date_to)
+    try:
+        query = build_query(date_from, date_to, args.staff, args.activity)
+    except ValueError as e:
+        parser.error(f"invalid date: {e}")
+    output = args.output or filename(args.format, date_from, date_to)
+
+    written = 0
+    with open(output, "wb") as f:
+        for chunk in export(args.format, query):
+            f.write(chunk)
+            written += len(chunk)
+    print(f"{output}: {written / 1024:.0f} KB")
+
+if __name__ == "__main__":
+    main()
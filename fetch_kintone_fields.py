@@ -1,54 +1,37 @@
+import sys
 
-import os
-import requests
-from dotenv import load_dotenv
+import utils
+import form_schema
 
-load_dotenv()
+def get_field_options(properties, field_code):
+    if field_code in properties:
+        print(f"--- Options for {field_code} ---")
+        for label in form_schema.field_options(properties, field_code):
+            print(f"{label}")
+    else:
+        print(f"Field code '{field_code}' not found.")
+        print("Available fields:", properties.keys())
 
-KINTONE_SUBDOMAIN = os.getenv("KINTONE_SUBDOMAIN")
-KINTONE_APP_ID = os.getenv("KINTONE_APP_ID")
-KINTONE_API_TOKEN = os.getenv("KINTONE_API_TOKEN")
-
-def get_field_options(field_code):
-    if not all([KINTONE_SUBDOMAIN, KINTONE_APP_ID, KINTONE_API_TOKEN]):
+if __name__ == "__main__":
+    if not all([utils.KINTONE_SUBDOMAIN, utils.KINTONE_APP_ID, utils.KINTONE_API_TOKEN]):
         print("Error: Missing Kintone configuration.")
-        return
-
-    url = f"https://{KINTONE_SUBDOMAIN}.cybozu.com/k/v1/app/form/fields.json"
-    headers = {"X-Cybozu-API-Token": KINTONE_API_TOKEN}
-    params = {"app": KINTONE_APP_ID}
-
+        sys.exit(1)
     try:
-        response = requests.get(url, headers=headers, params=params)
-        response.raise_for_status()
-        data = response.json()
-        
-        properties = data.get("properties", {})
-        if field_code in properties:
-             field_info = properties[field_code]
-             options = field_info.get("options", {})
-             sorted_options = sorted(options.items(), key=lambda x: int(x[1].get("index", 0)))
-             print(f"--- Options for {field_code} ---")
-             for label, details in sorted_options:
-                 print(f"{label}")
-        else:
-            print(f"Field code '{field_code}' not found.")
-            print("Available fields:", properties.keys())
-
+        fields = form_schema.fetch_fields()
     except Exception as e:
         print(f"Error fetching fields: {e}")
-        if 'response' in locals():
-            print(response.text)
+        sys.exit(1)
+    # Running workers pick the published snapshot up on their next check
+    form_schema.publish(fields)
+    properties = fields.get("properties", {})
 
-if __name__ == "__main__":
     with open("kintone_options.txt", "w", encoding="utf-8") as f:
         # Redirect print to file
-        import sys
         original_stdout = sys.stdout
         sys.stdout = f
         print("Fetching '新規営業件名' options...")
-        get_field_options("新規営業件名")
+        get_field_options(properties, "新規営業件名")
         print("\nFetching '次回営業件名' options...")
-        get_field_options("次回営業件名")
+        get_field_options(properties, "次回営業件名")
         sys.stdout = original_stdout
-        print("Done writing to kintone_options.txt")
+        print(f"Done writing to kintone_options.txt (form revision {fields.get('revision')})")
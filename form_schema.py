@@ -0,0 +1,209 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines: in-process locking only
+    fcntl = None
+
+import utils
+import startup
+
+# =============================================================================
+# CONFIGURATION
+# =============================================================================
+# The report app's form schema (app/form/fields.json) decides which option
+# labels Kintone accepts. It is fetched in the background only, stored on disk
+# for all workers, and applied in place to utils.SALES_ACTIVITY_OPTIONS /
+# NEXT_SALES_ACTIVITY_OPTIONS (and the prompts built from them). Request
+# handling never fetches it; until the first fetch the hardcoded lists apply.
+
+SCHEMA_DIR = Path(os.getenv("FORM_SCHEMA_DIR", "./form_schema"))
+SNAPSHOT_PATH = SCHEMA_DIR / "fields.json"
+LOCK_PATH = SCHEMA_DIR / "refresh.lock"
+
+FORM_SCHEMA_TTL = int(os.getenv("FORM_SCHEMA_TTL", "600"))  # revision check interval (s)
+
+# field code -> option list in utils that mirrors it
+OPTION_FIELDS = {
+    "新規営業件名": utils.SALES_ACTIVITY_OPTIONS,
+    "次回営業件名": utils.NEXT_SALES_ACTIVITY_OPTIONS,
+}
+SEPARATOR_PREFIX = "※"  # e.g. "※下記項目は公示用": a divider in the dropdown, not a real activity
+
+_snapshot_mtime = 0.0
+_revision = ""
+_lock = threading.Lock()
+_refreshing = threading.Event()
+_watcher_started = threading.Event()
+
+@contextmanager
+def _refresh_lock():
+    """
+    Non-blocking cross-worker lock. Yields False if another worker holds it.
+    """
+    SCHEMA_DIR.mkdir(parents=True, exist_ok=True)
+    with open(LOCK_PATH, "w") as f:
+        if fcntl is None:
+            yield True
+            return
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+# =============================================================================
+# SCHEMA
+# =============================================================================
+
+def fetch_fields(app_id: str = None, token: str = None) -> dict:
+    """
+    GET app/form/fields.json -> {"revision": ..., "properties": {...}}
+    """
+    headers = {"X-Cybozu-API-Token": token or utils.KINTONE_API_TOKEN}
+    resp = utils.http_session().get(utils.kintone_url("app/form/fields.json"), headers=headers,
+                                    params={"app": app_id or utils.KINTONE_APP_ID})
+    resp.raise_for_status()
+    return resp.json()
+
+def fetch_modified_at(app_id: str = None, token: str = None) -> str:
+    """
+    GET app.json -> modifiedAt: a few hundred bytes, bumped whenever the app's
+    settings (the form included) are deployed. Checked before fields.json.
+    """
+    headers = {"X-Cybozu-API-Token": token or utils.KINTONE_API_TOKEN}
+    resp = utils.http_session().get(utils.kintone_url("app.json"), headers=headers,
+                                    params={"id": app_id or utils.KINTONE_APP_ID})
+    resp.raise_for_status()
+    return resp.json().get("modifiedAt", "")
+
+def field_options(properties: dict, field_code: str) -> list:
+    """
+    Option labels of a dropdown / radio field in display order (dividers included).
+    """
+    options = properties.get(field_code, {}).get("options", {})
+    return [label for label, details in sorted(options.items(), key=lambda x: int(x[1].get("index", 0)))]
+
+def apply(snapshot: dict) -> bool:
+    """
+    Update the option lists in place and invalidate the prompts built from them.
+    Returns True if anything changed.
+    """
+    global _revision
+    changed = False
+    properties = snapshot.get("properties", {})
+    for field_code, target in OPTION_FIELDS.items():
+        labels = [l for l in field_options(properties, field_code) if not l.startswith(SEPARATOR_PREFIX)]
+        if labels and labels != target:
+            target[:] = labels
+            changed = True
+    _revision = snapshot.get("revision", "")
+    if changed:
+        utils.get_extraction_prompt.cache_clear()
+        utils.get_qa_extraction_prompt.cache_clear()
+        print(f"Form schema applied (revision {_revision})")
+    return changed
+
+def load() -> bool:
+    """
+    Apply the snapshot on disk if another worker has published a newer one.
+    """
+    global _snapshot_mtime
+    with _lock:
+        try:
+            mtime = SNAPSHOT_PATH.stat().st_mtime
+        except OSError:
+            return False
+        if mtime == _snapshot_mtime:
+            return False
+        try:
+            snapshot = json.loads(SNAPSHOT_PATH.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as e:
+            print(f"Form Schema Load Error: {e}")
+            return False
+        _snapshot_mtime = mtime
+        return apply(snapshot)
+
+def publish(fields: dict, modified_at: str = ""):
+    """
+    Write a fetched fields.json response as the shared snapshot.
+    """
+    SCHEMA_DIR.mkdir(parents=True, exist_ok=True)
+    snapshot = {"revision": fields.get("revision", ""), "modified_at": modified_at, "fetched_at": time.time(),
+                "properties": fields.get("properties", {})}
+    tmp = SNAPSHOT_PATH.with_suffix(".tmp")
+    tmp.write_text(json.dumps(snapshot, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, SNAPSHOT_PATH)
+
+def _published_modified_at() -> str:
+    try:
+        return json.loads(SNAPSHOT_PATH.read_text(encoding="utf-8")).get("modified_at", "")
+    except (OSError, ValueError):
+        return ""
+
+def refresh() -> bool:
+    """
+    Check the app's modifiedAt; only if it moved, fetch the schema and publish
+    it (if the form revision changed).
+    """
+    if not all([utils.KINTONE_SUBDOMAIN, utils.KINTONE_APP_ID, utils.KINTONE_API_TOKEN]):
+        return False
+    with _refresh_lock() as acquired:
+        if acquired:
+            try:
+                try:
+                    modified_at = fetch_modified_at()
+                except Exception as e:
+                    # e.g. a token without access to app.json: always fetch the fields
+                    print(f"Form Schema Revision Check Error: {e}")
+                    modified_at = ""
+                if not modified_at or modified_at != _published_modified_at():
+                    fields = fetch_fields()
+                    # A new modifiedAt is recorded even if this form revision is already applied
+                    if fields.get("revision") != _revision or not SNAPSHOT_PATH.exists() or modified_at:
+                        publish(fields, modified_at)
+            except Exception as e:
+                print(f"Form Schema Refresh Error: {e}")
+    return load()
+
+def refresh_in_background():
+    if _refreshing.is_set():
+        return
+    _refreshing.set()
+
+    def run():
+        try:
+            refresh()
+        finally:
+            _refreshing.clear()
+    threading.Thread(target=run, daemon=True).start()
+
+def _watch():
+    while True:
+        try:
+            refresh()
+        except Exception as e:
+            print(f"Form Schema Watch Error: {e}")
+        time.sleep(FORM_SCHEMA_TTL)
+
+@startup.on_worker_start
+def start_watcher():
+    if _watcher_started.is_set():
+        return
+    _watcher_started.set()
+    threading.Thread(target=_watch, daemon=True, name="form-schema").start()
+
+@startup.on_warmup
+def load_form_schema():
+    # Before fork: prompts built afterwards use the last published options
+    load()
+    utils.build_prompt_templates()
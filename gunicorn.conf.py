@@ -0,0 +1,24 @@
+import os
+
+# Loaded automatically by gunicorn from the working directory.
+#
+# GUNICORN_PRELOAD=1 (default) imports the app and builds shared read-only state
+# once in the master, then forks workers that share it copy-on-write. Set it to
+# 0 to import per worker (e.g. for --reload during development).
+#
+# Each worker reports ready on /readyz once its dependency connections are warm.
+
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "1200"))
+
+def when_ready(server):
+    if preload_app:
+        import startup
+        startup.warm_shared_state()
+
+def post_worker_init(worker):
+    # Per worker, never in the master: warms shared state if not preloaded, then
+    # opens the Kintone / Gemini connections in the background (/readyz waits for it)
+    import health
+    health.start_warmup()
@@ -0,0 +1,130 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import utils
+
+# =============================================================================
+# DEPENDENCY WARM-UP / READINESS
+# =============================================================================
+# Each worker opens its Kintone and Gemini connections once at boot (DNS, TLS,
+# pooled keep-alive sockets) before it reports ready, so the first real request
+# after a deploy or scale-up doesn't pay for them. Connections are never opened
+# in the gunicorn master: pooled sockets must not be shared across fork.
+
+HEALTH_TIMEOUT = float(os.getenv("HEALTH_TIMEOUT", "10"))           # per dependency check (s)
+HEALTH_RECHECK_INTERVAL = int(os.getenv("HEALTH_RECHECK_INTERVAL", "60"))  # /readyz re-check age (s)
+
+_status = {}          # name -> {"ok", "latency_ms", "last_error", "last_error_at", "checked_at"}
+_status_lock = threading.Lock()
+_ready = threading.Event()
+_started = threading.Event()
+_rechecking = threading.Event()
+
+def record(name: str, latency: float = None, error: Exception = None, skipped: bool = False):
+    with _status_lock:
+        entry = _status.setdefault(name, {"ok": False, "latency_ms": None, "last_error": "", "last_error_at": None})
+        entry["checked_at"] = time.time()
+        if skipped:
+            entry.update(ok=None, last_error="not configured")
+            return
+        entry["ok"] = error is None
+        if latency is not None:
+            entry["latency_ms"] = round(latency * 1000, 1)
+        if error is not None:
+            entry["last_error"] = f"{type(error).__name__}: {error}"
+            entry["last_error_at"] = entry["checked_at"]
+
+def timed_check(name: str, check):
+    start = time.perf_counter()
+    try:
+        if check() is False:
+            record(name, skipped=True)
+            return
+    except Exception as e:
+        print(f"Health Check Error ({name}): {e}")
+        record(name, time.perf_counter() - start, error=e)
+        return
+    record(name, time.perf_counter() - start)
+
+# =============================================================================
+# CHECKS
+# =============================================================================
+
+def check_kintone():
+    if not all([utils.KINTONE_SUBDOMAIN, utils.KINTONE_APP_ID, utils.KINTONE_API_TOKEN]):
+        return False
+    # Smallest authenticated read; also leaves a warm connection in utils.http_session()
+    params = {"app": utils.KINTONE_APP_ID, "query": "limit 1", "fields": ["$id"]}
+    resp = utils.http_session().get(utils.kintone_url("records.json"), headers={"X-Cybozu-API-Token": utils.report_app_token()},
+                                    params=params, timeout=HEALTH_TIMEOUT)
+    resp.raise_for_status()
+
+def check_gemini():
+    if not utils.GEMINI_API_KEY:
+        return False
+    # Model metadata: no tokens spent, but the same host and connection pool as generate_content
+    utils.get_genai_client().models.get(model=utils.GEMINI_MODEL)
+
+CHECKS = {"kintone": check_kintone, "gemini": check_gemini}
+
+def run_checks():
+    with ThreadPoolExecutor(max_workers=len(CHECKS)) as pool:
+        for name, check in CHECKS.items():
+            pool.submit(timed_check, name, check)
+
+def warm_up():
+    """
+    Blocking: shared state (if not already built), per-worker hooks, then every dependency check.
+    """
+    import startup
+    startup.warm_shared_state()
+    startup.start_worker()
+    run_checks()
+    _ready.set()
+    print(f"Ready: {snapshot()}")
+
+def start_warmup():
+    """
+    Start warm-up in the background (once per process). /readyz reports 503 until it finishes.
+    """
+    if _started.is_set():
+        return
+    _started.set()
+    threading.Thread(target=warm_up, daemon=True, name="warmup").start()
+
+def recheck_in_background():
+    if _rechecking.is_set():
+        return
+    _rechecking.set()
+
+    def run():
+        try:
+            run_checks()
+        finally:
+            _rechecking.clear()
+    threading.Thread(target=run, daemon=True).start()
+
+# =============================================================================
+# REPORTING
+# =============================================================================
+
+def is_ready() -> bool:
+    return _ready.is_set()
+
+def snapshot() -> dict:
+    with _status_lock:
+        return {name: dict(entry) for name, entry in _status.items()}
+
+def readiness() -> dict:
+    """
+    Body for /readyz. Dependency failures are reported but don't hold readiness
+    back: a Kintone outage shouldn't take the whole app out of rotation.
+    """
+    if not _started.is_set():
+        start_warmup()  # served by something other than gunicorn (flask run, uvicorn)
+    deps = snapshot()
+    if _ready.is_set() and any(time.time() - d.get("checked_at", 0) > HEALTH_RECHECK_INTERVAL for d in deps.values()):
+        recheck_in_background()
+    return {"ready": _ready.is_set(), "pid": os.getpid(), "dependencies": deps}
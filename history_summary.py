@@ -0,0 +1,173 @@
+import os
+import json
+import hashlib
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+import cache
+import utils
+
+# =============================================================================
+# CONFIGURATION
+# =============================================================================
+# Rolling per-client summary over the full report history. The stored summary
+# remembers the highest record $id folded in (watermark); each request only
+# sends the records added since then to Gemini, together with the previous
+# summary. Edits to already-folded records are not re-read here: with Kintone
+# webhooks enabled, an edited or deleted folded record (or one found by the
+# periodic reconciliation) deletes the summary so it is rebuilt (webhooks.py).
+# Without webhooks the summary keeps the folded version of such records.
+
+SUMMARY_DIR = Path(os.getenv("HISTORY_SUMMARY_DIR", "./history_summaries"))
+FOLD_CHUNK = int(os.getenv("HISTORY_FOLD_CHUNK", "20"))  # records per Gemini call
+# Between checks for new records, any worker serves the summary from the shared cache
+SUMMARY_CACHE_TTL = int(os.getenv("HISTORY_SUMMARY_CACHE_TTL", "300"))
+
+summary_cache = cache.get_cache("summary", ttl=SUMMARY_CACHE_TTL)
+
+_locks = {}   # client_id -> [lock, users]; only clients being summarized right now
+_locks_guard = threading.Lock()
+
+@contextmanager
+def _client_lock(client_id: str):
+    with _locks_guard:
+        entry = _locks.setdefault(client_id, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _locks_guard:
+            entry[1] -= 1
+            if not entry[1]:
+                del _locks[client_id]
+
+def _summary_path(client_id: str) -> Path:
+    return SUMMARY_DIR / f"{hashlib.sha1(client_id.encode('utf-8')).hexdigest()}.json"
+
+def load_summary(client_id: str) -> dict:
+    try:
+        return json.loads(_summary_path(client_id).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+def save_summary(client_id: str, summary: dict):
+    SUMMARY_DIR.mkdir(parents=True, exist_ok=True)
+    path = _summary_path(client_id)
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(summary, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, path)
+
+def delete_summary(client_id: str):
+    summary_cache.delete(client_id)
+    try:
+        _summary_path(client_id).unlink()
+    except OSError:
+        pass
+
+def invalidate(client_id: str):
+    """
+    Check for new records on the next request (e.g. right after a report was saved).
+    """
+    summary_cache.delete(client_id)
+
+# =============================================================================
+# FOLDING
+# =============================================================================
+
+def fold_prompt(previous: dict, new_records: list) -> str:
+    context_text = ""
+    for item in sorted(new_records, key=lambda r: r["date"]):
+        context_text += f"[{item['date']}] {item['type']} (担当: {item['staff']})\n"
+        context_text += f"内容: {item['content']}\n"
+        context_text += f"次回: {item['next_action']}\n\n"
+
+    if previous:
+        previous_text = f"""## これまでの要約 (過去{previous['count']}件分)
+- flow: {previous['flow']}
+- latest_status: {previous['latest_status']}
+"""
+    else:
+        previous_text = "## これまでの要約\n(なし: 最初の履歴です)\n"
+
+    return f"""
+あなたは営業アシスタントです。あるクライアントとの商談履歴の要約を更新してください。
+「これまでの要約」に「新しい商談履歴」({len(new_records)}件)の内容を反映し、全期間を通した要約を作成してください。
+
+{previous_text}
+## 新しい商談履歴
+{context_text}
+## 出力要件 (JSON形式)
+- **flow**: 全期間の経緯や主な議論の流れを「3〜5行程度」で簡潔にまとめてください。古い経緯は要点のみ残してください。
+- **latest_status**: 直近の商談で何が決まり、今はどういう状態か（次に何をする予定か）を「1行」でまとめてください。
+
+## 出力例
+```json
+{{
+  "flow": "初回訪問でニーズをヒアリングし、見積を提示したが価格面で難色を示された。\\nその後、上長同行で再提案を行い、検討フェーズに入った。",
+  "latest_status": "最終見積を提出済みで、来月の決裁会議の結果待ち状態。"
+}}
+```
+"""
+
+def fold(previous: dict, new_records: list) -> dict:
+    """
+    One Gemini call: previous summary + new records -> updated summary.
+    """
+    resp = utils.generate_content(utils.get_genai_client(), "history", contents=fold_prompt(previous, new_records))
+    parsed = utils.parse_json_response(resp.text)
+    if not parsed or "flow" not in parsed:
+        raise ValueError("要約の解析に失敗しました")
+    return {
+        "flow": parsed.get("flow", ""),
+        "latest_status": parsed.get("latest_status", ""),
+        "count": (previous or {}).get("count", 0) + len(new_records),
+        "watermark": max(int(r["id"]) for r in new_records),
+    }
+
+def get_rolling_summary(client_id: str) -> dict:
+    """
+    Summary over the client's full history, folding in only records newer than
+    the stored watermark. Returns {"flow", "latest_status", "count", ...}.
+    """
+    if not utils.GEMINI_API_KEY or not all([utils.KINTONE_SUBDOMAIN, utils.KINTONE_APP_ID, utils.KINTONE_API_TOKEN]):
+        return {"flow": "履歴がありません。", "latest_status": "", "count": 0}
+
+    cached = summary_cache.get(client_id)
+    if cached is not None:
+        return cached
+
+    with _client_lock(client_id):
+        summary = load_summary(client_id)
+        watermark = summary["watermark"] if summary else 0
+        try:
+            pending = []
+            for page in utils.iter_client_history(client_id, after_id=watermark):
+                pending.extend(page)
+                while len(pending) >= FOLD_CHUNK:
+                    summary = fold(summary, pending[:FOLD_CHUNK])
+                    pending = pending[FOLD_CHUNK:]
+                    save_summary(client_id, {**summary, "client_id": client_id, "updated": datetime.now().isoformat(timespec="seconds")})
+            if pending:
+                summary = fold(summary, pending)
+                save_summary(client_id, {**summary, "client_id": client_id, "updated": datetime.now().isoformat(timespec="seconds")})
+        except Exception as e:
+            print(f"Rolling Summary Error: {e}")
+            if not summary:
+                return {"flow": utils.SUMMARY_FAILED, "latest_status": "", "count": 0}
+            # Serve the last stored summary, flagged: it misses the records past its
+            # watermark, so it must not be cached. The next request retries from there.
+            return {**summary, "incomplete": True}
+
+    if not summary:
+        return {"flow": "履歴がありません。", "latest_status": "", "count": 0}
+    summary_cache.set(client_id, summary)
+    return summary
+
+def is_complete(summary: dict) -> bool:
+    """
+    True if the summary covers the whole history, i.e. may be cached with the page.
+    """
+    return bool(summary) and summary.get("flow") != utils.SUMMARY_FAILED and not summary.get("incomplete")
@@ -0,0 +1,357 @@
+import os
+import re
+import json
+import time
+import uuid
+import wave
+import array
+import shutil
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines: in-process locking only
+    fcntl = None
+
+import audio_probe
+import transcripts
+import utils
+
+# =============================================================================
+# CONFIGURATION
+# =============================================================================
+# In-app recording. While the rep records, the browser posts 16 kHz mono PCM
+# every few seconds to /api/live/<id>/chunk. Chunks are appended to the
+# session's audio in sequence order, and every LIVE_SEGMENT_SECONDS of audio is
+# cut off as a WAV segment and transcribed right away (inline, see
+# audio_probe.py) in a background thread. When recording stops only the last
+# segment is left to transcribe.
+#
+# The joined transcript is stored for the assembled recording like any other
+# (transcripts.py), so /process, /reprocess and the Kintone attachment work on
+# it exactly as for an uploaded file.
+#
+# PCM rather than MediaRecorder output: any byte range of it is playable audio,
+# so segments can be cut anywhere (at a pause) and the recording stays one file.
+# Chunks may arrive at any worker; the session directory is shared, under a file lock.
+
+LIVE_DIR = Path(os.getenv("LIVE_DIR", "./live_sessions"))
+SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2
+BYTES_PER_SECOND = SAMPLE_RATE * SAMPLE_WIDTH
+SEGMENT_SECONDS = int(os.getenv("LIVE_SEGMENT_SECONDS", "60"))
+CUT_WINDOW_SECONDS = 2.0     # a segment ends at the quietest 100ms within this much before its nominal end
+MAX_CHUNK_BYTES = 1024 * 1024
+FINISH_WAIT = float(os.getenv("LIVE_FINISH_WAIT", "120"))    # how long /process waits for the last chunks / segments (s)
+STALE_SEGMENT = 300          # a segment transcribing longer than this (its worker died) is redone (s)
+LIVE_TTL = int(os.getenv("LIVE_TTL", "21600"))               # sessions are removed after this (s)
+GC_INTERVAL = 600
+POLL_INTERVAL = 0.5
+MAX_WORKERS = 4
+
+_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+_executor = None
+_executor_pid = None
+_futures = {}          # (live_id, segment index) -> future (this process only)
+_lock = threading.Lock()
+_last_gc = 0.0
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor, _executor_pid
+    with _lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="live")
+            _executor_pid = os.getpid()
+        return _executor
+
+# =============================================================================
+# SESSION STATE
+# =============================================================================
+
+def _session_dir(live_id: str) -> Path:
+    return LIVE_DIR / live_id
+
+def _chunk_path(live_id: str, seq: int) -> Path:
+    return _session_dir(live_id) / f"chunk-{seq:06d}.pcm"
+
+def _segment_path(live_id: str, index: int, suffix: str) -> Path:
+    return _session_dir(live_id) / f"segment-{index:04d}{suffix}"
+
+def load(live_id: str) -> dict:
+    if not _ID_PATTERN.match(live_id or ""):
+        return None
+    try:
+        return json.loads((_session_dir(live_id) / "meta.json").read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+def _save(meta: dict):
+    path = _session_dir(meta["id"]) / "meta.json"
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, path)
+
+@contextmanager
+def _session_lock(live_id: str):
+    """
+    Blocking cross-worker lock on one session.
+    """
+    with open(_session_dir(live_id) / "lock", "w") as f:
+        if fcntl is None:
+            with _lock:
+                yield
+            return
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def start() -> dict:
+    live_id = uuid.uuid4().hex
+    _session_dir(live_id).mkdir(parents=True)
+    meta = {
+        "id": live_id,
+        "created_at": time.time(),
+        "next_seq": 0,          # chunks before this are in audio.pcm
+        "bytes": 0,
+        "cut_at": 0,            # audio.pcm offset where the next segment starts
+        "segments": [],         # {"index", "start", "end", "status", "started_at", "error"}
+        "total_chunks": None,   # set when recording stops
+        "final_path": "",
+    }
+    _save(meta)
+    gc_in_background()
+    return meta
+
+def status(meta: dict) -> dict:
+    done = sum(1 for s in meta["segments"] if s["status"] == "done")
+    return {
+        "live_id": meta["id"],
+        "seconds": round(meta["bytes"] / BYTES_PER_SECOND, 1),
+        "received": meta["next_seq"],
+        "segments": len(meta["segments"]),
+        "transcribed": done,
+        "stopped": meta["total_chunks"] is not None,
+    }
+
+# =============================================================================
+# INGESTION
+# =============================================================================
+
+def _quiet_cut(pcm, target: int) -> int:
+    """
+    Offset of the quietest 100ms frame within CUT_WINDOW_SECONDS before target,
+    so segments tend to end between words rather than in the middle of one.
+    """
+    frame = BYTES_PER_SECOND // 10
+    window = int(CUT_WINDOW_SECONDS * BYTES_PER_SECOND) // frame * frame
+    start = max(target - window, 0)
+    pcm.seek(start)
+    samples = array.array("h")
+    samples.frombytes(pcm.read(target - start))
+    step = frame // SAMPLE_WIDTH
+    best, best_energy = target, None
+    for i in range(0, len(samples) - step + 1, step):
+        energy = sum(s * s for s in samples[i:i + step])
+        if best_energy is None or energy <= best_energy:  # ties: the latest, nearest the nominal end
+            best, best_energy = start + (i + step // 2) * SAMPLE_WIDTH, energy
+    return best
+
+def _write_wav(path: Path, pcm, start: int, end: int):
+    with wave.open(str(path), "wb") as out:
+        out.setnchannels(1)
+        out.setsampwidth(SAMPLE_WIDTH)
+        out.setframerate(SAMPLE_RATE)
+        pcm.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            data = pcm.read(min(remaining, 1024 * 1024))
+            if not data:
+                break
+            out.writeframesraw(data)
+            remaining -= len(data)
+
+def _advance(live_id: str) -> tuple:
+    """
+    Append the chunks that are next in sequence and cut any segment that is due.
+    Returns (meta, indexes of new segments). Caller holds the session lock.
+    """
+    meta = load(live_id)
+    pcm_path = _session_dir(live_id) / "audio.pcm"
+    with open(pcm_path, "ab") as pcm:
+        while _chunk_path(live_id, meta["next_seq"]).exists():
+            chunk = _chunk_path(live_id, meta["next_seq"])
+            pcm.write(chunk.read_bytes())
+            chunk.unlink()
+            meta["next_seq"] += 1
+        meta["bytes"] = pcm.tell()
+
+    complete = meta["total_chunks"] is not None and meta["next_seq"] >= meta["total_chunks"]
+    segment_bytes = SEGMENT_SECONDS * BYTES_PER_SECOND
+    new = []
+    with open(pcm_path, "rb") as pcm:
+        while True:
+            if meta["bytes"] - meta["cut_at"] >= segment_bytes:
+                end = _quiet_cut(pcm, meta["cut_at"] + segment_bytes)
+            elif complete and meta["bytes"] > meta["cut_at"]:
+                end = meta["bytes"]  # the tail
+            else:
+                break
+            index = len(meta["segments"])
+            _write_wav(_segment_path(live_id, index, ".wav"), pcm, meta["cut_at"], end)
+            meta["segments"].append({"index": index, "start": meta["cut_at"], "end": end,
+                                     "status": "pending", "started_at": time.time(), "error": ""})
+            meta["cut_at"] = end
+            new.append(index)
+    _save(meta)
+    return meta, new
+
+def _transcribe(live_id: str, index: int):
+    try:
+        text = transcripts.transcribe(str(_segment_path(live_id, index, ".wav")))
+        _segment_path(live_id, index, ".txt").write_text(text, encoding="utf-8")
+        outcome = {"status": "done", "error": ""}
+    except Exception as e:
+        print(f"Live Segment Error ({live_id} #{index}): {e}")
+        outcome = {"status": "failed", "error": str(e)}
+    with _session_lock(live_id):
+        meta = load(live_id)
+        meta["segments"][index].update(outcome)
+        _save(meta)
+
+def _submit(live_id: str, indexes: list):
+    for index in indexes:
+        future = get_executor().submit(contextvars.copy_context().run, _transcribe, live_id, index)
+        key = (live_id, index)
+        with _lock:
+            _futures[key] = future
+        future.add_done_callback(lambda _, key=key: _futures.pop(key, None))
+
+def add_chunk(live_id: str, seq: int, data: bytes) -> dict:
+    """
+    Store chunk `seq` (retries overwrite it), then ingest whatever is contiguous.
+    None if the session is unknown or already finished.
+    """
+    meta = load(live_id)
+    if meta is None or meta["final_path"]:
+        return None
+    if len(data) % SAMPLE_WIDTH or len(data) > MAX_CHUNK_BYTES:
+        raise ValueError("chunk must be 16-bit PCM, at most 1MB")
+    if meta["bytes"] / BYTES_PER_SECOND > audio_probe.AUDIO_MAX_SECONDS:
+        raise audio_probe.AudioLimitError("録音が長すぎます。一度停止してください")
+    if seq >= meta["next_seq"]:
+        chunk = _chunk_path(live_id, seq)
+        tmp = chunk.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, chunk)
+    with _session_lock(live_id):
+        meta, new = _advance(live_id)
+    _submit(live_id, new)
+    return meta
+
+def stop(live_id: str, total_chunks: int) -> dict:
+    """
+    Recording ended after `total_chunks` chunks: the tail is cut once they are all in.
+    """
+    if load(live_id) is None:
+        return None
+    with _session_lock(live_id):
+        meta = load(live_id)
+        meta["total_chunks"] = total_chunks
+        _save(meta)
+        meta, new = _advance(live_id)
+    _submit(live_id, new)
+    return meta
+
+# =============================================================================
+# FINISHING
+# =============================================================================
+
+def _settled(meta: dict) -> bool:
+    return (meta["total_chunks"] is not None and meta["next_seq"] >= meta["total_chunks"]
+            and all(s["status"] != "pending" for s in meta["segments"]))
+
+def finish(live_id: str, timeout: float = FINISH_WAIT) -> str:
+    """
+    The assembled recording (a WAV in saved_audio), with its transcript stored
+    if every segment was transcribed. Waits for the last chunks and segments.
+    "" if the session is unknown, expired or never stopped.
+    """
+    meta = load(live_id)
+    if meta is None or meta["total_chunks"] is None:
+        return ""
+    if meta["final_path"]:
+        return meta["final_path"] if os.path.isfile(meta["final_path"]) else ""
+    deadline = time.monotonic() + timeout
+    while not _settled(meta) and time.monotonic() < deadline:
+        # Pending in a worker that has gone away: transcribe here instead
+        for segment in meta["segments"]:
+            key = (live_id, segment["index"])
+            if segment["status"] == "pending" and key not in _futures and time.time() - segment["started_at"] > STALE_SEGMENT:
+                _transcribe(live_id, segment["index"])
+        time.sleep(POLL_INTERVAL)
+        meta = load(live_id)
+    for segment in meta["segments"]:
+        if segment["status"] == "failed":
+            _transcribe(live_id, segment["index"])  # one retry, in the request
+
+    with _session_lock(live_id):
+        meta = load(live_id)
+        if meta["final_path"]:
+            return meta["final_path"]
+        if not meta["bytes"]:
+            return ""
+        utils.init_directories()
+        path = utils.SAVED_AUDIO_DIR / f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_live_{live_id[:6]}.wav"
+        with open(_session_dir(live_id) / "audio.pcm", "rb") as pcm:
+            _write_wav(path, pcm, 0, meta["bytes"])
+        texts = []
+        for segment in meta["segments"]:
+            text_path = _segment_path(live_id, segment["index"], ".txt")
+            texts.append(text_path.read_text(encoding="utf-8").strip() if text_path.exists() else None)
+        if meta["segments"] and all(t is not None for t in texts) and _settled(meta):
+            transcripts.save_transcript(transcripts.audio_digest(str(path)), "\n".join(texts), utils.GEMINI_MODEL)
+        else:
+            # Otherwise the whole recording is transcribed in one go, as for an upload
+            print(f"Live Session {live_id}: transcript incomplete, falling back to the full recording")
+        meta["final_path"] = str(path)
+        _save(meta)
+    # The recording is in saved_audio now; the segment texts stay until gc
+    for leftover in [*_session_dir(live_id).glob("*.pcm"), *_session_dir(live_id).glob("segment-*.wav")]:
+        leftover.unlink()
+    return str(path)
+
+# =============================================================================
+# GARBAGE COLLECTION
+# =============================================================================
+
+def gc(ttl: int = LIVE_TTL) -> int:
+    """
+    Remove sessions older than ttl (assembled recordings in saved_audio stay).
+    """
+    removed = 0
+    now = time.time()
+    for session in LIVE_DIR.glob("*/meta.json"):
+        try:
+            if now - session.stat().st_mtime < ttl:
+                continue
+        except OSError:
+            continue
+        shutil.rmtree(session.parent, ignore_errors=True)
+        removed += 1
+    return removed
+
+def gc_in_background():
+    global _last_gc
+    with _lock:
+        if time.time() - _last_gc < GC_INTERVAL:
+            return
+        _last_gc = time.time()
+    threading.Thread(target=gc, daemon=True).start()
@@ -0,0 +1,187 @@
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import hmac
+import threading
+from collections import Counter
+from pathlib import Path
+
+# =============================================================================
+# CONFIGURATION
+# =============================================================================
+# Opt-in wall-clock stack sampling for slow requests. While a request is being
+# profiled, a sampler thread reads its stack every PROFILE_INTERVAL_MS via
+# sys._current_frames(), so time spent waiting on Kintone / Gemini shows up
+# as well as Python work (JSON parsing, Jinja rendering).
+#
+# A request is profiled when
+# - PROFILE_THRESHOLD_MS is set: every request is sampled, and kept only if
+#   it took longer than the threshold
+# - or it carries X-Debug-Profile: <PROFILE_TOKEN>: always kept
+# With neither, nothing is sampled and no thread runs.
+#
+# Profiles are stored as folded stacks (flamegraph.pl / speedscope input) in a
+# ring of the PROFILE_KEEP most recent, browsable at /admin/profiles.
+# Only WSGI (Flask) requests are profiled: coroutine routes share the event
+# loop thread, so their samples can't be told apart.
+
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", "./profiles"))
+PROFILE_THRESHOLD_MS = float(os.getenv("PROFILE_THRESHOLD_MS", "0"))  # 0: threshold profiling off
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")                        # unset: debug header ignored
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "10"))
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "50"))
+DEBUG_HEADER = "X-Debug-Profile"
+MAX_DEPTH = 128
+
+_NAME_PATTERN = re.compile(r"^[0-9]{8}-[0-9]{6}-[0-9]+-[0-9a-f]{6}$")
+
+def wanted(header_value: str) -> str:
+    """
+    Why this request should be sampled ("threshold" / "header"), or "" to skip it.
+    """
+    if header_value and PROFILE_TOKEN and hmac.compare_digest(header_value, PROFILE_TOKEN):
+        return "header"
+    if PROFILE_THRESHOLD_MS > 0:
+        return "threshold"
+    return ""
+
+# =============================================================================
+# SAMPLER
+# =============================================================================
+
+class RequestProfile:
+    def __init__(self, thread_id: int, trigger: str):
+        self.thread_id = thread_id
+        self.trigger = trigger
+        self.start = time.perf_counter()
+        self.counts = Counter()
+        self.samples = 0
+
+_active = {}          # thread id -> RequestProfile
+_lock = threading.Lock()
+_wake = threading.Event()
+_sampler_pid = None
+
+def fold(frame) -> str:
+    names = []
+    while frame is not None and len(names) < MAX_DEPTH:
+        names.append(f"{frame.f_globals.get('__name__', '?')}.{frame.f_code.co_qualname}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+def _sample_loop():
+    interval = PROFILE_INTERVAL_MS / 1000
+    while True:
+        if not _active:
+            _wake.wait()
+            _wake.clear()
+            continue
+        time.sleep(interval)
+        frames = sys._current_frames()
+        with _lock:
+            profiles = list(_active.values())
+        for profile in profiles:
+            frame = frames.get(profile.thread_id)
+            if frame is not None:
+                profile.counts[fold(frame)] += 1
+                profile.samples += 1
+        del frames
+
+def _ensure_sampler():
+    global _sampler_pid
+    if _sampler_pid != os.getpid():  # threads don't survive fork
+        _sampler_pid = os.getpid()
+        threading.Thread(target=_sample_loop, daemon=True, name="profiler").start()
+
+def start(trigger: str) -> RequestProfile:
+    """
+    Start sampling the calling thread.
+    """
+    profile = RequestProfile(threading.get_ident(), trigger)
+    with _lock:
+        _ensure_sampler()
+        _active[profile.thread_id] = profile
+    _wake.set()
+    return profile
+
+def stop(profile: RequestProfile, **meta) -> str:
+    """
+    Stop sampling. Returns the stored profile's name, or "" if it wasn't kept.
+    """
+    with _lock:
+        _active.pop(profile.thread_id, None)
+    duration_ms = (time.perf_counter() - profile.start) * 1000
+    if profile.trigger == "threshold" and duration_ms < PROFILE_THRESHOLD_MS:
+        return ""
+    if not profile.samples:
+        return ""
+    return save(profile, dict(meta, duration_ms=round(duration_ms, 1)))
+
+# =============================================================================
+# STORAGE
+# =============================================================================
+
+def save(profile: RequestProfile, meta: dict) -> str:
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+    folded = "".join(f"{stack} {count}\n" for stack, count in profile.counts.most_common())
+    (PROFILE_DIR / f"{name}.folded").write_text(folded, encoding="utf-8")
+    meta = dict(meta, name=name, trigger=profile.trigger, samples=profile.samples,
+                interval_ms=PROFILE_INTERVAL_MS, pid=os.getpid(), created=time.time())
+    # Metadata last: list_profiles() only shows profiles whose stacks are complete
+    (PROFILE_DIR / f"{name}.json").write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+    prune()
+    return name
+
+def prune(keep: int = PROFILE_KEEP):
+    for path in sorted(PROFILE_DIR.glob("*.json"))[:-keep or None]:
+        for stale in (path, path.with_suffix(".folded")):
+            try:
+                stale.unlink()
+            except OSError:
+                pass  # another worker removed it first
+
+def folded_path(name: str) -> Path:
+    if not _NAME_PATTERN.match(name or ""):
+        return None
+    path = PROFILE_DIR / f"{name}.folded"
+    return path if path.is_file() else None
+
+def list_profiles() -> list:
+    profiles = []
+    for path in sorted(PROFILE_DIR.glob("*.json"), reverse=True):
+        try:
+            profiles.append(json.loads(path.read_text(encoding="utf-8")))
+        except (OSError, ValueError):
+            continue
+    return profiles
+
+def load_profile(name: str) -> dict:
+    path = folded_path(name)
+    if path is None:
+        return None
+    try:
+        meta = json.loads(path.with_suffix(".json").read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    stacks = Counter()
+    for line in path.read_text(encoding="utf-8").splitlines():
+        stack, _, count = line.rpartition(" ")
+        if stack:
+            stacks[stack] = int(count)
+    return dict(meta, stacks=stacks)
+
+def top_functions(stacks: Counter, limit: int = 30) -> dict:
+    """
+    Per function: self samples (leaf frame) and total samples (anywhere on the stack).
+    """
+    own, total = Counter(), Counter()
+    for stack, count in stacks.items():
+        frames = stack.split(";")
+        own[frames[-1]] += count
+        for function in set(frames):
+            total[function] += count
+    return {"self": own.most_common(limit), "total": total.most_common(limit)}
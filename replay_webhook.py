@@ -0,0 +1,75 @@
+"""
+Replay Kintone webhook payloads, for testing the receiver locally.
+
+    python replay_webhook.py payload.json [more.json ...] [--url http://localhost:8501/webhooks/kintone]
+    python replay_webhook.py payload.json --local    # apply in-process (webhooks.handle), no server
+    python replay_webhook.py --reconcile             # run the reconciliation sweep once
+
+A file holds one payload or a JSON list of them, in the shape Kintone sends
+(type, app.id, record / recordId); "-" reads stdin. Requests carry
+?token=<WEBHOOK_TOKEN> and, if WEBHOOK_SECRET is set, an X-Webhook-Signature.
+"""
+import sys
+import json
+import argparse
+
+import requests
+
+import webhooks
+
+DEFAULT_URL = "http://localhost:8501/webhooks/kintone"
+
+def read_payloads(paths: list) -> list:
+    payloads = []
+    for path in paths:
+        if path == "-":
+            data = json.load(sys.stdin)
+        else:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        payloads.extend(data if isinstance(data, list) else [data])
+    return payloads
+
+def send(url: str, payload: dict) -> tuple:
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    headers = {"Content-Type": "application/json"}
+    if webhooks.WEBHOOK_SECRET:
+        headers[webhooks.SIGNATURE_HEADER] = webhooks.sign(body)
+    params = {"token": webhooks.WEBHOOK_TOKEN} if webhooks.WEBHOOK_TOKEN else {}
+    resp = requests.post(url, data=body, headers=headers, params=params, timeout=30)
+    try:
+        return resp.status_code, resp.json()
+    except ValueError:
+        return resp.status_code, resp.text[:500]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("payloads", nargs="*")
+    parser.add_argument("--url", default=DEFAULT_URL)
+    parser.add_argument("--local", action="store_true", help="apply in this process instead of posting")
+    parser.add_argument("--reconcile", action="store_true", help="run the reconciliation sweep")
+    args = parser.parse_args()
+
+    if args.reconcile:
+        print(json.dumps(webhooks.reconcile(), ensure_ascii=False, indent=1))
+    if not args.payloads:
+        if not args.reconcile:
+            parser.error("no payload files given")
+        return
+    if not args.local and not webhooks.enabled():
+        print("Error: WEBHOOK_TOKEN or WEBHOOK_SECRET must be set (the receiver rejects unauthenticated requests).")
+        sys.exit(1)
+
+    failed = 0
+    for payload in read_payloads(args.payloads):
+        label = f"{payload.get('type')} app={(payload.get('app') or {}).get('id')}"
+        if args.local:
+            print(label, json.dumps(webhooks.handle(payload), ensure_ascii=False))
+            continue
+        status, result = send(args.url, payload)
+        failed += status != 200
+        print(label, status, json.dumps(result, ensure_ascii=False))
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
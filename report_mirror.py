@@ -0,0 +1,369 @@
+import os
+import time
+import sqlite3
+import threading
+from contextlib import closing, contextmanager
+from datetime import date, timedelta
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines: in-process locking only
+    fcntl = None
+
+import utils
+import startup
+
+# =============================================================================
+# CONFIGURATION
+# =============================================================================
+# Local SQLite copy of the sales-report app (KINTONE_APP_ID), kept current by a
+# delta sync on 更新日時. Per-client and per-subject aggregates are maintained
+# alongside the records, so dashboards read one local table instead of issuing
+# a Kintone query per client. All workers share the same database file.
+
+MIRROR_DIR = Path(os.getenv("REPORT_MIRROR_DIR", "./report_mirror"))
+DB_PATH = MIRROR_DIR / "reports.db"
+LOCK_PATH = MIRROR_DIR / "sync.lock"
+
+MIRROR_TTL = int(os.getenv("REPORT_MIRROR_TTL", "300"))                 # delta sync interval (s)
+FULL_CHECK_INTERVAL = int(os.getenv("REPORT_MIRROR_FULL_CHECK", "3600"))  # deletion check interval (s)
+
+UPDATED_AT_FIELD = "更新日時"
+FIELDS = [
+    "$id", "$revision", "取引先ID", "新規営業件名", "対応日", "対応者", "商談内容",
+    "現在の課題・問題点", "競合・マーケット情報", "次回提案内容", "次回提案予定日", "次回営業件名",
+    UPDATED_AT_FIELD,
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    id INTEGER PRIMARY KEY,
+    revision INTEGER,
+    client_id TEXT,
+    subject TEXT,
+    report_date TEXT,
+    staff TEXT,
+    content TEXT,
+    issues TEXT,
+    market TEXT,
+    next_proposal TEXT,
+    next_date TEXT,
+    next_subject TEXT,
+    updated_at TEXT
+);
+CREATE INDEX IF NOT EXISTS reports_client ON reports (client_id, report_date);
+CREATE INDEX IF NOT EXISTS reports_subject ON reports (subject, report_date);
+
+-- Aggregates, recomputed for the touched keys on every sync
+CREATE TABLE IF NOT EXISTS subject_stats (
+    subject TEXT PRIMARY KEY,
+    report_count INTEGER,
+    last_date TEXT
+);
+CREATE TABLE IF NOT EXISTS client_stats (
+    client_id TEXT PRIMARY KEY,
+    report_count INTEGER,
+    last_contact TEXT,
+    last_report_id INTEGER,
+    next_date TEXT,
+    next_staff TEXT,
+    next_subject TEXT,
+    next_proposal TEXT
+);
+CREATE INDEX IF NOT EXISTS client_stats_next ON client_stats (next_date, next_staff);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# =============================================================================
+# DATABASE
+# =============================================================================
+
+_local = threading.local()
+_syncing = threading.Event()
+
+def connect() -> sqlite3.Connection:
+    """
+    One connection per thread. WAL lets readers in other workers continue while a sync writes.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.pid != os.getpid():  # never reuse a connection across fork
+        MIRROR_DIR.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(DB_PATH, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        _local.conn, _local.pid = conn, os.getpid()
+    return conn
+
+def get_meta(key: str, default: str = "") -> str:
+    row = connect().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row["value"] if row else default
+
+def _set_meta(conn: sqlite3.Connection, key: str, value):
+    conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+@contextmanager
+def _sync_lock():
+    """
+    Non-blocking cross-worker lock. Yields False if another worker holds it.
+    """
+    MIRROR_DIR.mkdir(parents=True, exist_ok=True)
+    with open(LOCK_PATH, "w") as f:
+        if fcntl is None:
+            yield True
+            return
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+# =============================================================================
+# SYNC
+# =============================================================================
+
+def _value(rec: dict, field: str) -> str:
+    return rec.get(field, {}).get("value") or ""
+
+def parse_record(rec: dict) -> tuple:
+    staff = rec.get("対応者", {}).get("value") or []
+    return (
+        int(rec["$id"]["value"]),
+        int(_value(rec, "$revision") or 0),
+        _value(rec, "取引先ID"),
+        _value(rec, "新規営業件名"),
+        _value(rec, "対応日"),
+        staff[0].get("name", "") if staff else "",
+        _value(rec, "商談内容"),
+        _value(rec, "現在の課題・問題点"),
+        _value(rec, "競合・マーケット情報"),
+        _value(rec, "次回提案内容"),
+        _value(rec, "次回提案予定日"),
+        _value(rec, "次回営業件名"),
+        _value(rec, UPDATED_AT_FIELD),
+    )
+
+def _refresh_aggregates(conn: sqlite3.Connection, client_ids: set, subjects: set):
+    for subject in subjects:
+        conn.execute("DELETE FROM subject_stats WHERE subject = ?", (subject,))
+        conn.execute("""
+            INSERT INTO subject_stats (subject, report_count, last_date)
+            SELECT subject, COUNT(*), MAX(report_date) FROM reports WHERE subject = ? GROUP BY subject
+        """, (subject,))
+    for client_id in client_ids:
+        conn.execute("DELETE FROM client_stats WHERE client_id = ?", (client_id,))
+        # The latest report's 次回提案予定日 supersedes the ones before it
+        conn.execute("""
+            INSERT INTO client_stats
+            SELECT r.client_id, s.report_count, r.report_date, r.id, r.next_date, r.staff, r.next_subject, r.next_proposal
+            FROM (SELECT COUNT(*) AS report_count FROM reports WHERE client_id = ?) s,
+                 (SELECT * FROM reports WHERE client_id = ? ORDER BY report_date DESC, id DESC LIMIT 1) r
+        """, (client_id, client_id))
+
+def apply_changes(conn: sqlite3.Connection, rows: list, deleted_ids: list = ()) -> dict:
+    """
+    Upsert parsed rows / delete ids and update the aggregates they touch, in one transaction.
+    Returns {client_id: lowest changed report id} for reports that are new,
+    deleted or at a different $revision (rows already mirrored as-is don't count).
+    """
+    client_ids, subjects = set(), set()
+    old_rows = {}
+    ids = [row[0] for row in rows] + list(deleted_ids)
+    for chunk in (ids[i:i + 500] for i in range(0, len(ids), 500)):
+        marks = ",".join("?" * len(chunk))
+        for old in conn.execute(f"SELECT id, revision, client_id, subject FROM reports WHERE id IN ({marks})", chunk):
+            old_rows[old["id"]] = old
+            client_ids.add(old["client_id"])
+            subjects.add(old["subject"])
+    changed = {}
+
+    def mark(client_id, report_id):
+        changed[client_id] = min(changed.get(client_id, report_id), report_id)
+
+    for row in rows:
+        old = old_rows.get(row[0])
+        if old is None or old["revision"] != row[1]:
+            mark(row[2], row[0])
+            if old is not None and old["client_id"] != row[2]:
+                mark(old["client_id"], row[0])
+    for report_id in deleted_ids:
+        if report_id in old_rows:
+            mark(old_rows[report_id]["client_id"], report_id)
+    with conn:
+        conn.executemany(f"INSERT OR REPLACE INTO reports VALUES ({','.join('?' * len(FIELDS))})", rows)
+        conn.executemany("DELETE FROM reports WHERE id = ?", [(i,) for i in deleted_ids])
+        client_ids.update(row[2] for row in rows)
+        subjects.update(row[3] for row in rows)
+        _refresh_aggregates(conn, client_ids, subjects)
+    return changed
+
+def merge_changed(changed: dict, more: dict):
+    for client_id, report_id in more.items():
+        changed[client_id] = min(changed.get(client_id, report_id), report_id)
+
+def _kintone_time(ts: float) -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(ts))
+
+def sync(full: bool = False) -> dict:
+    """
+    Pull changed reports into the mirror. The initial load pages by $id (resumable
+    at initial_cursor); after it, incremental by 更新日時, and a periodic (or
+    forced) full pass also removes reports deleted in Kintone.
+    """
+    if not all([utils.KINTONE_SUBDOMAIN, utils.KINTONE_APP_ID, utils.KINTONE_API_TOKEN]):
+        return {"skipped": True}
+    with _sync_lock() as acquired:
+        if not acquired:
+            return {"skipped": True}  # another worker is syncing the shared file
+        conn = connect()
+        now = time.time()
+        # full_checked_at is only set once the initial load has read every record
+        initial = not get_meta("full_checked_at")
+        full = not initial and (full or now - float(get_meta("full_checked_at", "0")) > FULL_CHECK_INTERVAL)
+        token = utils.report_app_token()
+        upserted = deleted = 0
+        changed = {}
+        try:
+            if initial:
+                cursor = int(get_meta("initial_cursor", "0"))
+                if not cursor:
+                    # Records edited while the load runs are behind its $id position:
+                    # the first incremental sync re-reads everything updated since it started
+                    with conn:
+                        _set_meta(conn, "initial_started_at", _kintone_time(now - 60))
+                query = f"$id > {cursor} order by $id asc"
+            else:
+                # 更新日時 has minute precision: >= re-reads the last minute so later edits in it aren't missed
+                query = f'{UPDATED_AT_FIELD} >= {utils.kintone_quote(get_meta("watermark"))} order by {UPDATED_AT_FIELD} asc'
+            watermark = get_meta("watermark")
+            for page in utils.iter_kintone_records(utils.KINTONE_APP_ID, token, query, FIELDS):
+                rows = [parse_record(rec) for rec in page]
+                merge_changed(changed, apply_changes(conn, rows))
+                upserted += len(rows)
+                if rows:
+                    with conn:  # resume point if a later page fails
+                        if initial:
+                            _set_meta(conn, "initial_cursor", max(row[0] for row in rows))
+                        else:
+                            watermark = max(watermark, max(row[-1] for row in rows))
+                            _set_meta(conn, "watermark", watermark)
+            if initial:
+                with conn:
+                    _set_meta(conn, "watermark", get_meta("initial_started_at"))
+                    _set_meta(conn, "full_checked_at", now)
+            elif full:
+                seen = set()
+                for page in utils.iter_kintone_records(utils.KINTONE_APP_ID, token, "order by $id asc", ["$id"]):
+                    seen.update(int(rec["$id"]["value"]) for rec in page)
+                missing = [row["id"] for row in conn.execute("SELECT id FROM reports") if row["id"] not in seen]
+                if missing:
+                    merge_changed(changed, apply_changes(conn, [], missing))
+                deleted = len(missing)
+                with conn:
+                    _set_meta(conn, "full_checked_at", now)
+        except Exception as e:
+            print(f"Report Mirror Sync Error: {e}")
+            return {"error": str(e), "upserted": upserted, "changed": changed}
+        with conn:
+            _set_meta(conn, "synced_at", now)
+        return {"upserted": upserted, "deleted": deleted, "full": full, "initial": initial, "changed": changed}
+
+def sync_in_background(full: bool = False):
+    if _syncing.is_set():
+        return
+    _syncing.set()
+
+    def run():
+        try:
+            sync(full)
+        finally:
+            _syncing.clear()
+    threading.Thread(target=run, daemon=True).start()
+
+def ready() -> bool:
+    # The initial load has completed
+    return bool(get_meta("full_checked_at"))
+
+def ensure_fresh() -> bool:
+    """
+    Never syncs in the request: stale data is served while a background sync
+    catches up. False until the initial load (also in the background) has
+    finished; callers then answer "not ready" rather than reading Kintone in the request.
+    """
+    if not ready():
+        sync_in_background()
+        return False
+    if time.time() - float(get_meta("synced_at", "0")) > MIRROR_TTL:
+        sync_in_background()
+    return True
+
+# =============================================================================
+# QUERIES
+# =============================================================================
+
+def subject_counts(since: str = "", conn: sqlite3.Connection = None) -> list:
+    """
+    Activity count per 新規営業件名 (optionally only reports on/after `since`).
+    """
+    conn = conn or connect()
+    if since:
+        rows = conn.execute("""
+            SELECT subject, COUNT(*) AS report_count, MAX(report_date) AS last_date
+            FROM reports WHERE report_date >= ? GROUP BY subject ORDER BY report_count DESC
+        """, (since,))
+    else:
+        rows = conn.execute("SELECT * FROM subject_stats ORDER BY report_count DESC")
+    return [dict(row) for row in rows]
+
+def last_contact(client_id: str = "", limit: int = 100, conn: sqlite3.Connection = None) -> list:
+    """
+    Last contact date per client, least recently contacted first.
+    """
+    conn = conn or connect()
+    if client_id:
+        rows = conn.execute("SELECT * FROM client_stats WHERE client_id = ?", (client_id,))
+    else:
+        rows = conn.execute("SELECT * FROM client_stats ORDER BY last_contact ASC LIMIT ?", (limit,))
+    return [dict(row) for row in rows]
+
+def followups(staff: str = "", days: int = 14, include_overdue: bool = True, conn: sqlite3.Connection = None) -> list:
+    """
+    Clients whose latest report has a 次回提案予定日 within the next `days` days,
+    per 対応者 (overdue ones first when included).
+    """
+    today = date.today()
+    start = "0000-00-00" if include_overdue else today.isoformat()
+    end = (today + timedelta(days=days)).isoformat()
+    query = "SELECT * FROM client_stats WHERE next_date != '' AND next_date BETWEEN ? AND ?"
+    params = [start, end]
+    if staff:
+        query += " AND next_staff = ?"
+        params.append(staff)
+    rows = (conn or connect()).execute(query + " ORDER BY next_date ASC, next_staff ASC", params)
+    return [dict(row, overdue=row["next_date"] < today.isoformat()) for row in rows]
+
+def status() -> dict:
+    conn = connect()
+    return {
+        "reports": conn.execute("SELECT COUNT(*) FROM reports").fetchone()[0],
+        "synced_at": float(get_meta("synced_at", "0")),
+        "watermark": get_meta("watermark"),
+        "ready": ready(),
+    }
+
+@startup.on_warmup
+def create_report_mirror_schema():
+    MIRROR_DIR.mkdir(parents=True, exist_ok=True)
+    # Runs in the gunicorn master: close the connection so it isn't inherited by forked workers
+    with closing(sqlite3.connect(DB_PATH, timeout=30)) as conn:
+        conn.executescript(SCHEMA)
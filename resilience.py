@@ -0,0 +1,393 @@
+import os
+import time
+import asyncio
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, TimeoutError as FutureTimeout, wait
+
+import httpx
+import requests
+
+# =============================================================================
+# CONFIGURATION
+# =============================================================================
+# Deadlines, hedged reads and circuit breakers for the Kintone and Gemini
+# calls. Reps notice the slowest requests, not the median ones:
+# - every call has a deadline, so nothing holds a worker until gunicorn kills it
+# - idempotent reads that are still running after their observed p95 are sent
+#   a second time, and whichever answer arrives first is used
+# - after repeated timeouts / 5xx a dependency is failed fast for a while, and
+#   Gemini calls move to GEMINI_FALLBACK_MODEL if one is configured
+# State and metrics are per process (see /api/resilience).
+
+KINTONE_CONNECT_TIMEOUT = float(os.getenv("KINTONE_CONNECT_TIMEOUT", "5"))
+KINTONE_READ_TIMEOUT = float(os.getenv("KINTONE_READ_TIMEOUT", "20"))    # record / cursor reads
+KINTONE_WRITE_TIMEOUT = float(os.getenv("KINTONE_WRITE_TIMEOUT", "60"))  # record saves, file uploads
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "300"))               # any Gemini call (audio upload + generation)
+GEMINI_TEXT_TIMEOUT = float(os.getenv("GEMINI_TEXT_TIMEOUT", "90"))      # text-only extraction
+GEMINI_FALLBACK_MODEL = os.getenv("GEMINI_FALLBACK_MODEL", "")
+
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "1") != "0"
+HEDGE_QUANTILE = 0.95
+HEDGE_MIN_SAMPLES = 20     # no hedging until the p95 means something
+HEDGE_MAX_RATIO = 0.1      # at most one extra request per ten calls
+HEDGE_MAX_WORKERS = 16
+LATENCY_WINDOW = 200       # recent samples per operation
+
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))          # consecutive failures before opening
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))  # seconds before a trial call
+
+def kintone_timeout(method: str, url: str) -> tuple:
+    """
+    (connect, read) deadline for a Kintone request.
+    """
+    if method.upper() in ("GET", "DELETE") or "cursor.json" in url:
+        return (KINTONE_CONNECT_TIMEOUT, KINTONE_READ_TIMEOUT)
+    return (KINTONE_CONNECT_TIMEOUT, KINTONE_WRITE_TIMEOUT)
+
+# Failures that say nothing about the request itself. Anything else (a bad
+# argument, a parse error, a bug on our side) is raised as-is and left out of
+# the breaker, so it can't open a circuit or trigger a fallback call.
+TRANSIENT_ERRORS = (
+    requests.Timeout, requests.ConnectionError,
+    httpx.TimeoutException, httpx.NetworkError,
+    TimeoutError, ConnectionError, asyncio.TimeoutError, FutureTimeout,
+)
+
+def status_code(error: Exception):
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    if status is None:
+        status = getattr(error, "code", None)  # google.genai.errors.APIError
+    return status if isinstance(status, int) else None
+
+def is_transient(error: Exception) -> bool:
+    """
+    Timeouts, connection errors, 429 and 5xx count against a breaker; 4xx
+    mean the dependency is up and the request was wrong.
+    """
+    status = status_code(error)
+    if status is not None:
+        return status == 429 or status >= 500
+    return isinstance(error, TRANSIENT_ERRORS)
+
+# =============================================================================
+# CIRCUIT BREAKERS
+# =============================================================================
+
+class CircuitOpenError(Exception):
+    pass
+
+class CircuitBreaker:
+    """
+    closed -> open after BREAKER_FAILURES consecutive failures -> half-open
+    after BREAKER_RESET_TIMEOUT (one trial call) -> closed on success.
+    """
+
+    def __init__(self, name: str, failures: int = BREAKER_FAILURES, reset_timeout: float = BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.threshold = failures
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.open_count = 0
+        self.rejected = 0
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state, self._trial = "half_open", False
+            if self.state == "closed":
+                return True
+            if self.state == "half_open" and not self._trial:
+                self._trial = True
+                return True
+            self.rejected += 1
+            return False
+
+    def before(self):
+        if not self.allow():
+            raise CircuitOpenError(f"{self.name} は連続エラーのため一時的に停止中です（{int(self.reset_timeout)}秒後に再試行）")
+
+    def success(self):
+        with self._lock:
+            self.state, self.failures, self._trial = "closed", 0, False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial = False
+            if self.state == "half_open" or (self.state == "closed" and self.failures >= self.threshold):
+                self.state, self.opened_at = "open", time.monotonic()
+                self.open_count += 1
+                print(f"Circuit opened: {self.name} ({self.failures} failures)")
+
+    def release(self):
+        # Neither success nor failure: a half-open breaker may try again
+        with self._lock:
+            self._trial = False
+
+    def outcome(self, error: Exception = None):
+        if error is None or (status_code(error) is not None and not is_transient(error)):
+            self.success()  # the dependency answered
+        elif is_transient(error):
+            self.failure()
+        else:
+            self.release()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"state": self.state, "failures": self.failures, "open_count": self.open_count, "rejected": self.rejected}
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def breaker(name: str) -> CircuitBreaker:
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+class KintoneSession(requests.Session):
+    """
+    requests.Session with Kintone deadlines and the "kintone" breaker on every request.
+    """
+
+    def request(self, method, url, *args, **kwargs):
+        kwargs.setdefault("timeout", kintone_timeout(method, url))
+        circuit = breaker("kintone")
+        circuit.before()
+        try:
+            resp = super().request(method, url, *args, **kwargs)
+        except Exception as e:
+            circuit.outcome(e)
+            raise
+        except BaseException:
+            circuit.release()  # cancelled (losing hedge, client gone): not the trial's answer
+            raise
+        circuit.outcome(requests.HTTPError(response=resp) if resp.status_code == 429 or resp.status_code >= 500 else None)
+        return resp
+
+class KintoneAsyncClient(httpx.AsyncClient):
+    """
+    httpx counterpart of KintoneSession for the ASGI routes.
+    """
+
+    async def request(self, method, url, *args, **kwargs):
+        if kwargs.get("timeout", httpx.USE_CLIENT_DEFAULT) is httpx.USE_CLIENT_DEFAULT:
+            connect, read = kintone_timeout(method, str(url))
+            kwargs["timeout"] = httpx.Timeout(read, connect=connect)
+        return await super().request(method, url, *args, **kwargs)
+
+    async def send(self, request, *args, **kwargs):
+        circuit = breaker("kintone")
+        circuit.before()
+        try:
+            resp = await super().send(request, *args, **kwargs)
+        except Exception as e:
+            circuit.outcome(e)
+            raise
+        except BaseException:
+            circuit.release()  # cancelled (losing hedge, client gone): not the trial's answer
+            raise
+        circuit.outcome(httpx.HTTPStatusError("", request=request, response=resp)
+                        if resp.status_code == 429 or resp.status_code >= 500 else None)
+        return resp
+
+def gemini_models(model: str) -> list:
+    if GEMINI_FALLBACK_MODEL and GEMINI_FALLBACK_MODEL != model:
+        return [model, GEMINI_FALLBACK_MODEL]
+    return [model]
+
+def call_with_fallback(model: str, call):
+    """
+    call(model) behind the model's breaker; on an open breaker or a transient
+    failure, call(GEMINI_FALLBACK_MODEL) instead.
+    """
+    error = None
+    for candidate in gemini_models(model):
+        circuit = breaker(f"gemini:{candidate}")
+        if not circuit.allow():
+            error = CircuitOpenError(f"gemini:{candidate} circuit open")
+            continue
+        try:
+            result = call(candidate)
+        except BaseException as e:
+            if not isinstance(e, Exception):
+                circuit.release()  # cancelled (losing hedge, client gone): not the trial's answer
+                raise
+            circuit.outcome(e)
+            if not is_transient(e):
+                raise
+            print(f"Gemini Error ({candidate}): {e}")
+            error = e
+            continue
+        circuit.success()
+        return result
+    raise error
+
+async def call_with_fallback_async(model: str, call):
+    error = None
+    for candidate in gemini_models(model):
+        circuit = breaker(f"gemini:{candidate}")
+        if not circuit.allow():
+            error = CircuitOpenError(f"gemini:{candidate} circuit open")
+            continue
+        try:
+            result = await call(candidate)
+        except BaseException as e:
+            if not isinstance(e, Exception):
+                circuit.release()  # cancelled (losing hedge, client gone): not the trial's answer
+                raise
+            circuit.outcome(e)
+            if not is_transient(e):
+                raise
+            print(f"Gemini Error ({candidate}): {e}")
+            error = e
+            continue
+        circuit.success()
+        return result
+    raise error
+
+# =============================================================================
+# HEDGED READS
+# =============================================================================
+
+_latencies = {}   # name -> deque of recent primary-request seconds
+_hedges = {}      # name -> {"calls", "hedged", "hedge_wins"}
+_stats_lock = threading.Lock()
+_executor = None
+_executor_pid = None
+
+def observe(name: str, seconds: float):
+    with _stats_lock:
+        _latencies.setdefault(name, deque(maxlen=LATENCY_WINDOW)).append(seconds)
+
+def percentile(name: str, quantile: float):
+    with _stats_lock:
+        samples = sorted(_latencies.get(name, ()))
+    if not samples:
+        return None
+    return samples[min(int(len(samples) * quantile), len(samples) - 1)]
+
+def _count(name: str, key: str):
+    with _stats_lock:
+        stats = _hedges.setdefault(name, {"calls": 0, "hedged": 0, "hedge_wins": 0})
+        stats[key] += 1
+
+def hedge_delay(name: str):
+    """
+    Seconds to wait before hedging, or None if this call must not be hedged.
+    """
+    if not HEDGE_ENABLED:
+        return None
+    with _stats_lock:
+        samples = len(_latencies.get(name, ()))
+        stats = _hedges.get(name, {"calls": 0, "hedged": 0})
+        over_budget = stats["hedged"] >= HEDGE_MAX_RATIO * stats["calls"]
+    if samples < HEDGE_MIN_SAMPLES or over_budget:
+        return None
+    return percentile(name, HEDGE_QUANTILE)
+
+def _pool() -> ThreadPoolExecutor:
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():  # threads don't survive fork
+        _executor = ThreadPoolExecutor(max_workers=HEDGE_MAX_WORKERS, thread_name_prefix="hedge")
+        _executor_pid = os.getpid()
+    return _executor
+
+def _observe_on_success(name: str, start: float):
+    def callback(task):
+        # A cancelled attempt (the slower one of a hedge) took at least this long:
+        # leaving it out would bias the p95 low
+        if task.cancelled() or task.exception() is None:
+            observe(name, time.perf_counter() - start)
+    return callback
+
+def hedged(name: str, func, *args, **kwargs):
+    """
+    func(*args, **kwargs), sent again if it is still running after the
+    observed p95 for `name`. Only for idempotent calls. Errors of the first
+    request are raised as-is; they are not retried.
+    """
+    _count(name, "calls")
+    delay = hedge_delay(name)
+    start = time.perf_counter()
+    if delay is None:
+        result = func(*args, **kwargs)
+        observe(name, time.perf_counter() - start)
+        return result
+    primary = _pool().submit(contextvars.copy_context().run, func, *args, **kwargs)
+    primary.add_done_callback(_observe_on_success(name, start))
+    try:
+        return primary.result(timeout=delay)
+    except FutureTimeout:
+        pass
+    _count(name, "hedged")
+    hedge = _pool().submit(contextvars.copy_context().run, func, *args, **kwargs)
+    pending, error = {primary, hedge}, None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                if future is hedge:
+                    _count(name, "hedge_wins")
+                return future.result()
+            error = future.exception()
+    raise error
+
+async def hedged_async(name: str, make_call):
+    """
+    hedged() for coroutines: make_call() returns a new coroutine per attempt.
+    The slower attempt is cancelled.
+    """
+    _count(name, "calls")
+    delay = hedge_delay(name)
+    primary = asyncio.ensure_future(make_call())
+    primary.add_done_callback(_observe_on_success(name, time.perf_counter()))
+    if delay is None:
+        return await primary
+    done, _ = await asyncio.wait({primary}, timeout=delay)
+    if done:
+        return primary.result()
+    _count(name, "hedged")
+    hedge = asyncio.ensure_future(make_call())
+    pending, error = {primary, hedge}, None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is hedge:
+                        _count(name, "hedge_wins")
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+# =============================================================================
+# METRICS
+# =============================================================================
+
+def snapshot() -> dict:
+    with _breakers_lock:
+        breakers = {name: b.snapshot() for name, b in _breakers.items()}
+    with _stats_lock:
+        hedges = {name: dict(stats) for name, stats in _hedges.items()}
+        names = list(_latencies)
+    for name in names:
+        entry = hedges.setdefault(name, {"calls": 0, "hedged": 0, "hedge_wins": 0})
+        p50, p95, p99 = (percentile(name, q) for q in (0.5, 0.95, 0.99))
+        entry.update(
+            p50_ms=round(p50 * 1000, 1) if p50 is not None else None,
+            p95_ms=round(p95 * 1000, 1) if p95 is not None else None,
+            p99_ms=round(p99 * 1000, 1) if p99 is not None else None,
+            hedge_win_rate=round(entry["hedge_wins"] / entry["hedged"], 3) if entry["hedged"] else None,
+        )
+    return {"pid": os.getpid(), "breakers": breakers, "hedges": hedges,
+            "fallback_model": GEMINI_FALLBACK_MODEL or None}
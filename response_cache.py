@@ -0,0 +1,64 @@
+import hashlib
+import json
+from pathlib import Path
+
+import cache
+
+# =============================================================================
+# RENDERED-BODY CACHE
+# =============================================================================
+# Rendered pages and JSON bodies, keyed by strong ETag, in the shared cache
+# (cache.py) so every worker benefits from a render done by any of them.
+# Identical inputs give an identical ETag, so a hit can be sent without
+# re-rendering.
+
+RENDER_CACHE_TTL = 86400       # ETag-keyed bodies never go stale; this only bounds storage
+SEARCH_RESULTS_TTL = 60        # seconds a client search result is reused
+SEARCH_MAX_AGE = 60            # browser-side lifetime for /api/search_clients
+
+render_cache = cache.get_cache("render", ttl=RENDER_CACHE_TTL)
+search_cache = cache.get_cache("search", ttl=SEARCH_RESULTS_TTL)
+
+# =============================================================================
+# ETAGS
+# =============================================================================
+
+def strong_etag(*parts) -> str:
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+def template_version(template_dir: str = "templates", extra=None) -> str:
+    """
+    Hash of all template sources (plus e.g. the asset manifest). Templates are
+    read once per process, so a deploy naturally changes every page ETag.
+    """
+    digest = hashlib.sha256()
+    for path in sorted(Path(template_dir).glob("*.html")):
+        digest.update(path.name.encode())
+        digest.update(path.read_bytes())
+    if extra is not None:
+        digest.update(json.dumps(extra, sort_keys=True).encode())
+    return digest.hexdigest()[:16]
+
+def history_etag(client_id: str, client_name: str, records: list, summary: dict, version: str) -> str:
+    # Kintone bumps $revision on every edit, so (id, revision) pins the content.
+    # The summary covers the whole history: a backdated report or an edit to an
+    # older one changes it without touching the latest records.
+    revisions = [(r.get("id"), r.get("revision")) for r in records]
+    summary_key = [summary.get(k) for k in ("watermark", "count", "flow", "latest_status", "incomplete")]
+    return strong_etag("history", version, client_id, client_name, revisions, summary_key)
+
+def search_key(keyword: str) -> str:
+    # Key within the "search" namespace
+    return keyword.strip().lower()
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """
+    Strong comparison against a raw If-None-Match header value.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [c.strip() for c in if_none_match.split(",")]
+    return f'"{etag}"' in candidates
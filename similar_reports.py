@@ -0,0 +1,267 @@
+import os
+import re
+import math
+import time
+import heapq
+import itertools
+import threading
+import unicodedata
+from collections import Counter
+
+import report_mirror
+import startup
+
+# =============================================================================
+# CONFIGURATION
+# =============================================================================
+# BM25 over past report texts, in memory per worker, built from the local
+# report mirror (report_mirror.py) so nothing beyond SQLite is needed.
+# Japanese has no word boundaries, so CJK text is indexed as character
+# bigrams; ASCII words (product names, model numbers) are kept whole.
+#
+# A report saved through this worker is searchable immediately; other workers
+# pick it up once the mirror sync that /save triggers has pulled it in.
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+MAX_QUERY_TERMS = 64   # highest-IDF query terms only; common bigrams add cost, not ranking
+SNIPPET_CHARS = 160
+PROMPT_SNIPPETS = int(os.getenv("SIMILAR_REPORTS_IN_PROMPT", "3"))  # 0: no past reports in the extraction prompt
+
+# mirror column -> report field
+TEXT_FIELDS = {
+    "content": "商談内容",
+    "issues": "現在の課題・問題点",
+    "market": "競合・マーケット情報",
+    "next_proposal": "次回提案内容",
+}
+
+_ASCII_WORD = re.compile(r"[0-9a-z]+")
+_WORD_RUN = re.compile(r"\w+")
+
+def tokenize(text: str) -> list:
+    tokens = []
+    for run in _WORD_RUN.findall(unicodedata.normalize("NFKC", text or "").lower()):
+        if _ASCII_WORD.fullmatch(run):
+            tokens.append(run)
+        elif len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+def document_text(fields: dict) -> str:
+    return "\n".join(fields.get(column) or "" for column in TEXT_FIELDS)
+
+# =============================================================================
+# INDEX
+# =============================================================================
+
+class BM25Index:
+    """
+    Inverted index: postings[term] = {doc_id: tf}. Docs keep their own term
+    counts too, so scoring one client's handful of reports skips the postings.
+    """
+
+    def __init__(self):
+        self.docs = {}        # doc_id -> {"client_id", "length", "tf", "report"}
+        self.postings = {}
+        self.by_client = {}   # client_id -> set(doc_id)
+        self.total_length = 0
+
+    def add(self, doc_id, client_id: str, report: dict):
+        self.remove(doc_id)
+        tf = Counter(tokenize(document_text(report)))
+        length = sum(tf.values())
+        if not length:
+            return
+        self.docs[doc_id] = {"client_id": client_id, "length": length, "tf": tf, "report": report}
+        self.by_client.setdefault(client_id, set()).add(doc_id)
+        self.total_length += length
+        for term, count in tf.items():
+            self.postings.setdefault(term, {})[doc_id] = count
+
+    def remove(self, doc_id):
+        doc = self.docs.pop(doc_id, None)
+        if doc is None:
+            return
+        self.total_length -= doc["length"]
+        client_docs = self.by_client.get(doc["client_id"])
+        if client_docs is not None:
+            client_docs.discard(doc_id)
+            if not client_docs:
+                del self.by_client[doc["client_id"]]
+        for term in doc["tf"]:
+            posting = self.postings.get(term)
+            if posting is not None:
+                posting.pop(doc_id, None)
+                if not posting:
+                    del self.postings[term]
+
+    def _query_terms(self, query: str) -> list:
+        n = len(self.docs)
+        weighted = []
+        for term in set(tokenize(query)):
+            df = len(self.postings.get(term, ()))
+            if df:
+                weighted.append((math.log(1 + (n - df + 0.5) / (df + 0.5)), term))
+        weighted.sort(reverse=True)
+        return weighted[:MAX_QUERY_TERMS]
+
+    def _score(self, tf: int, length: int, avg_length: float) -> float:
+        return tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length))
+
+    def search(self, query: str, client_id: str = "", limit: int = 5, exclude=()) -> list:
+        """
+        [(doc_id, score)] best first, optionally within one client's reports.
+        """
+        if not self.docs:
+            return []
+        avg_length = self.total_length / len(self.docs)
+        terms = self._query_terms(query)
+        scores = {}
+        if client_id:
+            for doc_id in self.by_client.get(client_id, ()):
+                doc = self.docs[doc_id]
+                score = sum(idf * self._score(doc["tf"][term], doc["length"], avg_length)
+                            for idf, term in terms if term in doc["tf"])
+                if score:
+                    scores[doc_id] = score
+        else:
+            for idf, term in terms:
+                for doc_id, tf in self.postings[term].items():
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * self._score(tf, self.docs[doc_id]["length"], avg_length)
+        for doc_id in exclude:
+            scores.pop(doc_id, None)
+        return heapq.nlargest(limit, scores.items(), key=lambda kv: kv[1])
+
+    def latest(self, client_id: str, limit: int = 5) -> list:
+        docs = self.by_client.get(client_id, ())
+        return heapq.nlargest(limit, docs, key=lambda d: (self.docs[d]["report"].get("report_date") or "", str(d)))
+
+# =============================================================================
+# SHARED STATE
+# =============================================================================
+
+_index = BM25Index()
+_synced_at = ""       # mirror sync this worker has caught up with
+_watermark = ""       # highest 更新日時 ingested from the mirror
+_mirror_ids = set()   # every mirror row ingested, including ones with no text
+_pending = {}         # provisional doc_id -> time saved (reports not in the mirror yet)
+_pending_ids = itertools.count(1)
+_lock = threading.Lock()
+
+_COLUMNS = ["id", "client_id", "subject", "report_date"] + list(TEXT_FIELDS)
+
+def _ingest(rows):
+    global _watermark
+    for row in rows:
+        report = {column: row[column] for column in _COLUMNS}
+        _index.add(row["id"], row["client_id"], report)
+        _mirror_ids.add(row["id"])
+        _watermark = max(_watermark, row["updated_at"] or "")
+
+def _rebuild(conn):
+    global _index, _watermark
+    _index, _watermark = BM25Index(), ""
+    _mirror_ids.clear()
+    _pending.clear()
+    _ingest(conn.execute(f"SELECT {', '.join(_COLUMNS)}, updated_at FROM reports"))
+
+def load() -> BM25Index:
+    """
+    The index, caught up with the mirror's latest sync (a no-op between syncs).
+    """
+    global _synced_at
+    conn = report_mirror.connect()
+    synced_at = report_mirror.get_meta("synced_at")
+    with _lock:
+        if synced_at == _synced_at:
+            return _index
+        if not _synced_at:
+            _rebuild(conn)
+        else:
+            # 更新日時 has minute precision: >= also takes rows synced later within the last minute
+            _ingest(conn.execute(f"SELECT {', '.join(_COLUMNS)}, updated_at FROM reports WHERE updated_at >= ?", (_watermark,)))
+            # That sync started after these were saved, so the real records are in now
+            for doc_id in [d for d, saved in _pending.items() if saved < float(synced_at or 0)]:
+                _index.remove(doc_id)
+                del _pending[doc_id]
+            if conn.execute("SELECT COUNT(*) FROM reports").fetchone()[0] < len(_mirror_ids):
+                _rebuild(conn)  # the mirror dropped reports deleted in Kintone
+        _synced_at = synced_at
+        return _index
+
+def add_saved(data: dict):
+    """
+    Index a report just saved to Kintone, until the mirror brings in the real record.
+    """
+    report = {column: data.get(field, "") for column, field in TEXT_FIELDS.items()}
+    if not document_text(report).strip():
+        return
+    client_id = data.get("取引先ID", "")
+    doc_id = f"pending-{next(_pending_ids)}"
+    report.update(id=None, client_id=client_id, subject=data.get("新規営業件名", ""), report_date=data.get("対応日", ""))
+    with _lock:
+        _index.add(doc_id, client_id, report)
+        _pending[doc_id] = time.time()
+
+# =============================================================================
+# QUERIES
+# =============================================================================
+
+def _snippet(text: str) -> str:
+    text = re.sub(r"\s+", " ", text or "").strip()
+    return text if len(text) <= SNIPPET_CHARS else text[:SNIPPET_CHARS] + "…"
+
+def _result(index: BM25Index, doc_id, score) -> dict:
+    report = index.docs[doc_id]["report"]
+    result = {
+        "id": report["id"],
+        "client_id": report["client_id"],
+        "date": report["report_date"],
+        "subject": report["subject"],
+        "score": round(score, 3) if score is not None else None,
+    }
+    result.update({column: _snippet(report[column]) for column in TEXT_FIELDS})
+    return result
+
+def similar_reports(text: str, client_id: str = "", limit: int = 5, exclude_id: int = None) -> list:
+    """
+    Past reports most similar to text (the client's latest ones if text is empty).
+    """
+    index = load()
+    with _lock:  # inserts from /save mutate the same dicts
+        if not text.strip():
+            return [_result(index, doc_id, None) for doc_id in index.latest(client_id, limit)] if client_id else []
+        exclude = [exclude_id] if exclude_id is not None else []
+        return [_result(index, doc_id, score) for doc_id, score in index.search(text, client_id, limit, exclude)]
+
+def prompt_reference(client_id: str, text: str = "", limit: int = PROMPT_SNIPPETS) -> str:
+    """
+    Prompt section with the client's most similar past reports, or "".
+    Never syncs in the request: without a mirror yet, it starts one and returns "".
+    """
+    if not client_id or limit <= 0:
+        return ""
+    if not report_mirror.get_meta("synced_at"):
+        report_mirror.sync_in_background()
+        return ""
+    reports = similar_reports(text, client_id, limit)
+    if not reports:
+        return ""
+    lines = [
+        "## 参考: この取引先の過去の報告 (抜粋)",
+        "表現や経緯の参考にのみ使い、今回の内容に無い事柄を抽出結果に含めないでください。",
+    ]
+    for report in reports:
+        lines.append(f"- {report['date']} {report['subject']}")
+        for column, field in TEXT_FIELDS.items():
+            if report[column]:
+                lines.append(f"  - {field}: {report[column]}")
+    return "\n".join(lines)
+
+@startup.on_warmup
+def build_similar_reports_index():
+    # Before fork when preloading: workers start from the shared copy
+    load()
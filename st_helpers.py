@@ -0,0 +1,79 @@
+import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+import streamlit as st
+
+import utils
+import client_index
+import form_schema
+from response_cache import SEARCH_RESULTS_TTL
+
+# =============================================================================
+# CONFIGURATION
+# =============================================================================
+# Shared state for the Streamlit views. Every widget interaction reruns the
+# whole script, so anything that talks to Kintone is cached across reruns and
+# sessions, and Gemini jobs run on a shared pool while the page polls.
+
+HISTORY_TTL = 300          # seconds a client's history is reused
+JOB_MAX_WORKERS = 4
+POLL_INTERVAL = 1.0        # seconds between reruns while a job is running
+
+# Streamlit has no worker boot hook; the first import in the process starts the schema watcher
+form_schema.load()
+form_schema.start_watcher()
+
+@st.cache_resource
+def get_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=JOB_MAX_WORKERS, thread_name_prefix="st-job")
+
+@st.cache_resource
+def get_genai_client():
+    return utils.get_genai_client()
+
+# =============================================================================
+# CACHED KINTONE READS
+# =============================================================================
+
+@st.cache_data(ttl=SEARCH_RESULTS_TTL, show_spinner=False)
+def search_clients(keyword: str) -> list:
+    # The local client index answers without Kintone once it has been built
+    index = client_index.load()
+    if index is not None:
+        return index.search(keyword)
+    return utils.search_clients(keyword)
+
+@st.cache_data(ttl=HISTORY_TTL, show_spinner=False)
+def fetch_client_history(client_id: str, limit: int = 5) -> list:
+    return utils.fetch_client_history(client_id, limit=limit)
+
+# =============================================================================
+# BACKGROUND JOBS
+# =============================================================================
+
+def start_job(key: str, func, *args, **kwargs):
+    """
+    Run func on the shared pool; the session keeps the future under `key`.
+    """
+    future = get_executor().submit(contextvars.copy_context().run, func, *args, **kwargs)
+    st.session_state[key] = {"future": future, "started": time.monotonic()}
+
+def poll_job(key: str, message: str, expected_seconds: float = 60):
+    """
+    While the job is running: show progress, wait POLL_INTERVAL and rerun.
+    Once it has finished: forget it and return the finished future.
+    Returns None if there is no job under `key`.
+    """
+    job = st.session_state.get(key)
+    if not job:
+        return None
+    future = job["future"]
+    if not future.done():
+        elapsed = time.monotonic() - job["started"]
+        # Gemini gives no progress signal; approach 95% over the expected duration
+        st.progress(min(elapsed / expected_seconds, 0.95), text=f"{message} ({int(elapsed)}秒経過)")
+        time.sleep(POLL_INTERVAL)
+        st.rerun()
+    del st.session_state[key]
+    return future
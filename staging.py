@@ -0,0 +1,201 @@
+import os
+import re
+import json
+import time
+import uuid
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from pathlib import Path
+
+import audio_probe
+import utils
+
+# =============================================================================
+# CONFIGURATION
+# =============================================================================
+# Speculative upload: the index page posts the recording as soon as it is
+# selected, and the Gemini Files upload runs while the rep picks the client and
+# types the memo. /process then refers to the staged upload by id instead of
+# sending the file again. Metadata is stored on disk, so /process may land on
+# another worker than the one that staged the file.
+
+STAGING_DIR = Path(os.getenv("STAGING_DIR", "./staged_uploads"))
+STAGED_TTL = int(os.getenv("STAGED_TTL", "21600"))  # unclaimed staged files are removed after this (s)
+GC_INTERVAL = 600
+UPLOAD_WAIT = float(os.getenv("STAGED_UPLOAD_WAIT", "120"))  # how long /process waits for a running upload (s)
+POLL_INTERVAL = 0.5
+MAX_WORKERS = 4
+
+_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+_executor = None
+_executor_pid = None
+_futures = {}          # staged_id -> upload future (this process only)
+_lock = threading.Lock()
+_last_gc = 0.0
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor, _executor_pid
+    with _lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="stage")
+            _executor_pid = os.getpid()
+        return _executor
+
+def _meta_path(staged_id: str) -> Path:
+    return STAGING_DIR / f"{staged_id}.json"
+
+def load(staged_id: str) -> dict:
+    if not _ID_PATTERN.match(staged_id or ""):
+        return None
+    try:
+        return json.loads(_meta_path(staged_id).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+def _save(meta: dict):
+    STAGING_DIR.mkdir(parents=True, exist_ok=True)
+    path = _meta_path(meta["id"])
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, path)
+
+def _update(staged_id: str, **changes) -> dict:
+    meta = load(staged_id)
+    if meta is None:
+        return None
+    meta.update(changes)
+    _save(meta)
+    return meta
+
+# =============================================================================
+# STAGING
+# =============================================================================
+
+def _upload(staged_id: str, path: str) -> dict:
+    try:
+        uploaded = utils.upload_audio(utils.get_genai_client(), path)
+    except Exception as e:
+        print(f"Staged Upload Error: {e}")
+        _update(staged_id, status="failed", error=str(e))
+        raise
+    return _update(staged_id, status="ready", gemini_file={
+        "name": uploaded.name, "uri": uploaded.uri, "mime_type": uploaded.mime_type,
+    })
+
+def stage(uploaded_file) -> dict:
+    """
+    Save the recording and start its Gemini upload in the background.
+    Clips small enough to go inline aren't uploaded (status "inline").
+    """
+    path = utils.save_audio_file(uploaded_file)
+    staged_id = uuid.uuid4().hex
+    info = audio_probe.probe(path)
+    meta = {
+        "id": staged_id,
+        "path": path,
+        "original_name": getattr(uploaded_file, "filename", "") or "",
+        "status": "uploading",
+        "error": "",
+        "gemini_file": None,
+        "claimed": False,
+        "created_at": time.time(),
+        "audio": info,
+    }
+    try:
+        audio_probe.check_limits(info)
+    except audio_probe.AudioLimitError as e:
+        meta.update(status="failed", error=str(e))
+    else:
+        if audio_probe.use_inline(info):
+            meta["status"] = "inline"
+    _save(meta)
+    gc_in_background()
+    if meta["status"] != "uploading":
+        return meta
+    future = get_executor().submit(contextvars.copy_context().run, _upload, staged_id, path)
+    with _lock:
+        _futures[staged_id] = future
+    future.add_done_callback(lambda _: _futures.pop(staged_id, None))
+    return meta
+
+def claim(staged_id: str) -> dict:
+    """
+    Staged metadata for /process, marked as used so GC keeps the audio file. None if unknown or expired.
+    """
+    meta = load(staged_id)
+    if meta is None or not os.path.isfile(meta["path"]):
+        return None
+    return _update(staged_id, claimed=True)
+
+def uploaded_part(staged_id: str, timeout: float = UPLOAD_WAIT):
+    """
+    The staged Gemini file as a content part, waiting for a running upload.
+    None if the clip goes inline, or the upload failed or didn't finish in time
+    (the caller sends the audio itself).
+    """
+    with _lock:
+        future = _futures.get(staged_id)
+    deadline = time.monotonic() + timeout
+    if future is not None:
+        try:
+            future.result(timeout=timeout)
+        except FutureTimeout:
+            return None
+        except Exception:
+            pass  # recorded as failed in the metadata
+    meta = load(staged_id)
+    # Uploading in another worker: follow its metadata
+    while meta is not None and meta["status"] == "uploading" and time.monotonic() < deadline:
+        time.sleep(POLL_INTERVAL)
+        meta = load(staged_id)
+    if meta is None or meta["status"] != "ready":
+        return None
+    from google.genai import types
+    return types.Part.from_uri(file_uri=meta["gemini_file"]["uri"], mime_type=meta["gemini_file"]["mime_type"])
+
+# =============================================================================
+# GARBAGE COLLECTION
+# =============================================================================
+
+def gc(ttl: int = STAGED_TTL) -> int:
+    """
+    Remove staged entries older than ttl. Unclaimed ones also lose their audio
+    file and Gemini upload; claimed audio belongs to the report by then.
+    """
+    removed = 0
+    now = time.time()
+    for path in STAGING_DIR.glob("*.json"):
+        try:
+            if now - path.stat().st_mtime < ttl:
+                continue
+            meta = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            continue
+        if meta.get("status") == "uploading" and meta.get("id") in _futures:
+            continue
+        if not meta.get("claimed"):
+            try:
+                os.remove(meta["path"])
+            except OSError:
+                pass
+            if meta.get("gemini_file"):
+                try:
+                    utils.get_genai_client().files.delete(name=meta["gemini_file"]["name"])
+                except Exception as e:
+                    print(f"Staged File Delete Error: {e}")
+        try:
+            path.unlink()
+        except OSError:
+            pass
+        removed += 1
+    return removed
+
+def gc_in_background():
+    global _last_gc
+    with _lock:
+        if time.time() - _last_gc < GC_INTERVAL:
+            return
+        _last_gc = time.time()
+    threading.Thread(target=gc, daemon=True).start()
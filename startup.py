@@ -0,0 +1,52 @@
+import time
+
+# =============================================================================
+# SHARED STATE WARM-UP
+# =============================================================================
+# Modules register builders for read-only state (prompt templates, option
+# lists, client index, heavy SDK imports). gunicorn.conf.py runs them once in
+# the master before fork when preload is on, otherwise once per worker before
+# it accepts requests. Builders must not open sockets that would be shared
+# across forked workers.
+
+_warmers = []
+_warmed = False
+_worker_hooks = []
+
+def on_warmup(func):
+    _warmers.append(func)
+    return func
+
+def on_worker_start(func):
+    """
+    Register per-process startup work that must not run before fork
+    (background threads, sockets). Run by health.warm_up in every worker.
+    """
+    _worker_hooks.append(func)
+    return func
+
+def warm_shared_state(force: bool = False) -> dict:
+    """
+    Run every registered builder once. Returns {name: seconds}.
+    """
+    global _warmed
+    if _warmed and not force:
+        return {}
+    timings = {}
+    for func in _warmers:
+        start = time.perf_counter()
+        try:
+            func()
+        except Exception as e:
+            print(f"Warm-up Error ({func.__name__}): {e}")
+        timings[func.__name__] = round(time.perf_counter() - start, 4)
+    _warmed = True
+    print(f"Warm-up complete: {timings}")
+    return timings
+
+def start_worker():
+    for func in _worker_hooks:
+        try:
+            func()
+        except Exception as e:
+            print(f"Worker Start Error ({func.__name__}): {e}")
@@ -0,0 +1,42 @@
+function showLoading() {
+    document.getElementById('loading').style.display = 'flex';
+}
+
+// iOS PWA standalone mode fix for input focus
+(function () {
+    // Check if running as iOS PWA (standalone mode)
+    var isIOSPWA = ('standalone' in window.navigator) && window.navigator.standalone;
+
+    if (isIOSPWA) {
+        // Force focus on touch for all inputs in iOS PWA mode
+        document.addEventListener('touchend', function (e) {
+            var target = e.target;
+            if (target.tagName === 'INPUT' || target.tagName === 'TEXTAREA') {
+                setTimeout(function () {
+                    target.focus();
+                }, 100);
+            }
+        }, false);
+    }
+})();
+
+// File upload visual feedback
+document.addEventListener('DOMContentLoaded', function () {
+    const fileInput = document.querySelector('.file-upload-input');
+    const wrapper = document.querySelector('.file-upload-wrapper');
+    const icon = document.querySelector('.file-upload-icon');
+    const text = document.querySelector('.file-upload-text');
+    const sub = document.querySelector('.file-upload-sub');
+
+    if (fileInput) {
+        fileInput.addEventListener('change', function (e) {
+            if (this.files && this.files[0]) {
+                wrapper.classList.add('has-file');
+                icon.classList.remove('fa-cloud-upload-alt');
+                icon.classList.add('fa-check-circle');
+                text.textContent = this.files[0].name;
+                if (sub) sub.style.display = 'none';
+            }
+        });
+    }
+});
@@ -0,0 +1,80 @@
+// Batch form: one row per selected file with an optional client tag.
+// Tags are posted as client_id_<n> / client_name_<n> in file order.
+document.addEventListener('DOMContentLoaded', function () {
+    const fileInput = document.getElementById('batchFiles');
+    const rows = document.getElementById('batchRows');
+    const STORAGE_KEY = 'sales_report_last_staff';
+    const staffSelect = document.getElementById('staffSelect');
+
+    if (staffSelect) {
+        const lastStaff = localStorage.getItem(STORAGE_KEY);
+        if (lastStaff) staffSelect.value = lastStaff;
+        staffSelect.addEventListener('change', () => localStorage.setItem(STORAGE_KEY, staffSelect.value));
+    }
+
+    function buildRow(file, n) {
+        const row = document.createElement('div');
+        row.style.cssText = 'border:1px solid #e5e7eb; border-radius:10px; padding:10px; background:#fff;';
+
+        const title = document.createElement('div');
+        title.style.cssText = 'font-weight:600; font-size:0.85rem; margin-bottom:6px; overflow:hidden; text-overflow:ellipsis; white-space:nowrap;';
+        title.textContent = `${n + 1}. ${file.name}`;
+
+        const wrap = document.createElement('div');
+        wrap.style.position = 'relative';
+        const input = document.createElement('input');
+        input.type = 'text';
+        input.placeholder = 'クライアント名 (任意)';
+        input.autocomplete = 'off';
+        const idInput = document.createElement('input');
+        idInput.type = 'hidden';
+        idInput.name = `client_id_${n}`;
+        const nameInput = document.createElement('input');
+        nameInput.type = 'hidden';
+        nameInput.name = `client_name_${n}`;
+        const results = document.createElement('div');
+        results.style.cssText = 'display:none; position:absolute; top:100%; left:0; right:0; background:white; border:1px solid #ddd; border-radius:8px; max-height:200px; overflow-y:auto; z-index:1000; box-shadow:0 4px 6px rgba(0,0,0,0.1);';
+
+        let debounceTimer;
+        input.addEventListener('input', function () {
+            clearTimeout(debounceTimer);
+            const query = this.value;
+            idInput.value = '';
+            nameInput.value = '';
+            if (query.length < 2) {
+                results.style.display = 'none';
+                return;
+            }
+            debounceTimer = setTimeout(() => {
+                ClientIndex.search(query).then(data => {
+                    results.innerHTML = '';
+                    data.forEach(client => {
+                        const div = document.createElement('div');
+                        div.style.padding = '10px';
+                        div.style.borderBottom = '1px solid #eee';
+                        div.textContent = client.name;
+                        div.onclick = () => {
+                            input.value = client.name;
+                            idInput.value = client.record_id;
+                            nameInput.value = client.name;
+                            results.style.display = 'none';
+                        };
+                        results.appendChild(div);
+                    });
+                    results.style.display = data.length ? 'block' : 'none';
+                });
+            }, 50);
+        });
+
+        wrap.append(input, idInput, nameInput, results);
+        row.append(title, wrap);
+        return row;
+    }
+
+    if (fileInput) {
+        fileInput.addEventListener('change', function () {
+            rows.innerHTML = '';
+            Array.from(this.files).forEach((file, n) => rows.appendChild(buildRow(file, n)));
+        });
+    }
+});
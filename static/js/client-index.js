@@ -0,0 +1,134 @@
+// Local client directory search.
+// Downloads /api/client_index once (kept in localStorage), then only fetches
+// deltas keyed by version. Queries are answered locally with a trigram table;
+// falls back to /api/search_clients until the index is available.
+(function () {
+    const STORAGE_KEY = 'sales_report_client_index';
+    let index = null;
+    let loading = null;
+
+    function normalize(text) {
+        return (text || '').normalize('NFKC').replace(/\s+/g, '').toLowerCase();
+    }
+
+    function trigrams(text) {
+        const norm = normalize(text);
+        const grams = new Set();
+        for (let i = 0; i + 3 <= norm.length; i++) grams.add(norm.slice(i, i + 3));
+        return grams;
+    }
+
+    function indexSlot(slot, add) {
+        trigrams(index.names[slot]).forEach(gram => {
+            if (add) {
+                (index.tri[gram] = index.tri[gram] || []).push(slot);
+            } else if (index.tri[gram]) {
+                index.tri[gram] = index.tri[gram].filter(s => s !== slot);
+                if (!index.tri[gram].length) delete index.tri[gram];
+            }
+        });
+    }
+
+    function applyDelta(delta) {
+        delta.deletes.forEach(slot => {
+            if (index.names[slot] != null) indexSlot(slot, false);
+            index.rids[slot] = index.ids[slot] = index.names[slot] = null;
+        });
+        delta.upserts.forEach(([slot, rid, id, name]) => {
+            if (index.names[slot] != null) indexSlot(slot, false);
+            index.rids[slot] = rid;
+            index.ids[slot] = id;
+            index.names[slot] = name;
+            indexSlot(slot, true);
+        });
+        index.v = delta.v;
+    }
+
+    function persist() {
+        try {
+            localStorage.setItem(STORAGE_KEY, JSON.stringify(index));
+        } catch (e) {
+            // Quota exceeded: keep the in-memory copy only
+        }
+    }
+
+    function fetchFull() {
+        return fetch('/api/client_index')
+            .then(res => (res.ok ? res.json() : Promise.reject(res.status)))
+            .then(data => {
+                index = data;
+                persist();
+                return index;
+            });
+    }
+
+    function sync() {
+        if (!index) {
+            try {
+                index = JSON.parse(localStorage.getItem(STORAGE_KEY));
+            } catch (e) {
+                index = null;
+            }
+        }
+        if (!index) return fetchFull();
+        return fetch(`/api/client_index/delta?epoch=${encodeURIComponent(index.epoch)}&since=${index.v}`)
+            .then(res => (res.ok ? res.json() : Promise.reject(res.status)))
+            .then(delta => {
+                if (delta.full) return fetchFull();
+                if (delta.v !== index.v) {
+                    applyDelta(delta);
+                    persist();
+                }
+                return index;
+            })
+            .catch(() => index); // offline: search the copy we have
+    }
+
+    function ensureLoaded() {
+        if (!loading) {
+            loading = sync().catch(() => {
+                loading = null;
+                return null;
+            });
+        }
+        return loading;
+    }
+
+    function searchLocal(query, limit) {
+        const q = normalize(query);
+        if (!q) return [];
+        let candidates;
+        if (q.length >= 3) {
+            const lists = [...trigrams(q)].map(gram => index.tri[gram] || []);
+            lists.sort((a, b) => a.length - b.length);
+            const others = lists.slice(1).map(list => new Set(list));
+            candidates = lists[0].filter(slot => others.every(set => set.has(slot)));
+            candidates.sort((a, b) => a - b);
+        } else {
+            candidates = index.names.map((_, slot) => slot);
+        }
+        const results = [];
+        for (const slot of candidates) {
+            const name = index.names[slot];
+            if (name != null && normalize(name).includes(q)) {
+                results.push({ id: index.ids[slot], record_id: index.rids[slot], name: name });
+                if (results.length >= limit) break;
+            }
+        }
+        return results;
+    }
+
+    window.ClientIndex = {
+        ensureLoaded: ensureLoaded,
+        // Resolves to [{id, record_id, name}], the same shape as /api/search_clients
+        search: function (query, limit) {
+            limit = limit || 20;
+            return ensureLoaded().then(loaded => {
+                if (loaded) return searchLocal(query, limit);
+                return fetch(`/api/search_clients?q=${encodeURIComponent(query)}`).then(res => res.json());
+            });
+        },
+    };
+
+    document.addEventListener('DOMContentLoaded', ensureLoaded);
+})();
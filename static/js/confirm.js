@@ -0,0 +1,110 @@
+// Client Search Logic for Confirm Page
+document.addEventListener('DOMContentLoaded', function () {
+    const clientInput = document.getElementById('clientSearchInputConfirm');
+    const resultsDiv = document.getElementById('searchResultsConfirm');
+    const clientIdInput = document.getElementById('client_id_confirm');
+    const clientNameInput = document.getElementById('client_name_confirm');
+    let debounceTimer;
+
+    if (clientInput) {
+        clientInput.addEventListener('input', function () {
+            clearTimeout(debounceTimer);
+            const query = this.value;
+
+            // Update hidden field as user types
+            clientNameInput.value = query;
+
+            if (query.length < 2) {
+                resultsDiv.style.display = 'none';
+                return;
+            }
+
+            debounceTimer = setTimeout(() => {
+                ClientIndex.search(query)
+                    .then(data => {
+                        resultsDiv.innerHTML = '';
+                        if (data.length === 0) {
+                            resultsDiv.style.display = 'none';
+                            return;
+                        }
+                        data.forEach(client => {
+                            const div = document.createElement('div');
+                            div.style.padding = '10px';
+                            div.style.borderBottom = '1px solid #eee';
+                            div.style.cursor = 'pointer';
+                            div.textContent = client.name;
+                            div.onclick = () => {
+                                clientInput.value = client.name;
+                                clientIdInput.value = client.record_id;
+                                clientNameInput.value = client.name;
+                                resultsDiv.style.display = 'none';
+                            };
+                            resultsDiv.appendChild(div);
+                        });
+                        resultsDiv.style.display = 'block';
+                    });
+            }, 50); // local search: debounce only to coalesce keystrokes
+        });
+
+        // Candidates detected in the memo / extracted text
+        document.querySelectorAll('.client-candidate').forEach(btn => {
+            btn.addEventListener('click', function () {
+                clientInput.value = this.dataset.name;
+                clientIdInput.value = this.dataset.id;
+                clientNameInput.value = this.dataset.name;
+                document.querySelectorAll('.client-candidate').forEach(b => { b.style.background = 'white'; });
+                this.style.background = '#e0f2fe';
+            });
+        });
+
+        // Hide results on click outside
+        document.addEventListener('click', function (e) {
+            if (e.target !== clientInput && e.target !== resultsDiv) {
+                resultsDiv.style.display = 'none';
+            }
+        });
+    }
+});
+
+// Regenerate a single field from the stored transcript (text-only call)
+document.addEventListener('DOMContentLoaded', function () {
+    const form = document.getElementById('confirmForm');
+    if (!form) return;
+
+    form.querySelectorAll('.regen-btn').forEach(btn => {
+        btn.addEventListener('click', function () {
+            const field = this.dataset.field;
+            const target = form.elements[field];
+            const icon = this.querySelector('i');
+            const data = {};
+            new FormData(form).forEach((value, key) => { data[key] = value; });
+
+            this.disabled = true;
+            icon.classList.add('fa-spin');
+            fetch('/api/regenerate_field', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({
+                    field: field,
+                    mode: form.dataset.mode,
+                    file_path: data.file_path,
+                    memo: data.memo,
+                    data: data,
+                }),
+            })
+                .then(res => res.json())
+                .then(result => {
+                    if (result.error) {
+                        alert(result.error);
+                    } else if (target) {
+                        target.value = result.value;
+                    }
+                })
+                .catch(() => alert('再生成に失敗しました'))
+                .finally(() => {
+                    this.disabled = false;
+                    icon.classList.remove('fa-spin');
+                });
+        });
+    });
+});
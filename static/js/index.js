@@ -0,0 +1,256 @@
+// Persistent Staff Selection
+document.addEventListener('DOMContentLoaded', function () {
+    const staffSelect = document.getElementById('staffSelect');
+    const STORAGE_KEY = 'sales_report_last_staff';
+
+    if (staffSelect) {
+        // Restore
+        const lastStaff = localStorage.getItem(STORAGE_KEY);
+        if (lastStaff) {
+            staffSelect.value = lastStaff;
+        }
+
+        // Save on change and submit
+        const saveStaff = () => localStorage.setItem(STORAGE_KEY, staffSelect.value);
+        staffSelect.addEventListener('change', saveStaff); // Optional immediate save
+        staffSelect.form.addEventListener('submit', saveStaff);
+    }
+
+    // Speculative upload: the server saves the recording and starts the Gemini
+    // upload while the rest of the form is filled in (see staging.py)
+    const audioInput = document.querySelector('input[name="audio_file"]');
+    const stagedInput = document.getElementById('staged_id');
+    if (audioInput && stagedInput) {
+        let latest = null;
+        audioInput.addEventListener('change', function () {
+            stagedInput.value = '';
+            const file = this.files[0];
+            if (!file) return;
+            const body = new FormData();
+            body.append('audio_file', file);
+            const request = latest = fetch('/api/stage_audio', { method: 'POST', body: body })
+                .then(r => r.ok ? r.json() : null)
+                .then(data => {
+                    // Ignore responses for a file that has been replaced since
+                    if (request === latest && data && data.staged_id) stagedInput.value = data.staged_id;
+                })
+                .catch(() => { /* not staged: the file is sent with the form as before */ });
+        });
+        audioInput.form.addEventListener('submit', function () {
+            // Already on the server: don't send the file a second time
+            if (stagedInput.value) audioInput.disabled = true;
+        });
+        window.addEventListener('pageshow', function () {
+            audioInput.disabled = false;
+        });
+    }
+
+    // In-app recording: 16 kHz mono PCM posted every CHUNK_SECONDS while
+    // recording, so the server transcribes it minute by minute (see live.py)
+    const recordBtn = document.getElementById('liveRecordBtn');
+    const liveInput = document.getElementById('live_id');
+    const recordStatus = document.getElementById('liveRecordStatus');
+    if (recordBtn && liveInput && audioInput) {
+        const SAMPLE_RATE = 16000;
+        const CHUNK_SECONDS = 2;
+        let recording = null;
+
+        const formatTime = seconds => Math.floor(seconds / 60) + ':' + String(Math.floor(seconds % 60)).padStart(2, '0');
+        const setLabel = text => { recordBtn.querySelector('span').textContent = text; };
+
+        // Average each run of input samples down to one output sample
+        const downsample = function (input, rate) {
+            const ratio = rate / SAMPLE_RATE;
+            const output = new Int16Array(Math.floor(input.length / ratio));
+            for (let i = 0; i < output.length; i++) {
+                const start = Math.floor(i * ratio), end = Math.min(Math.floor((i + 1) * ratio), input.length);
+                let sum = 0;
+                for (let j = start; j < end; j++) sum += input[j];
+                const value = Math.max(-1, Math.min(1, sum / Math.max(end - start, 1)));
+                output[i] = value < 0 ? value * 0x8000 : value * 0x7fff;
+            }
+            return output;
+        };
+
+        // Chunks go out one at a time, in order; a failed post is retried
+        const post = function (url, body, attempt) {
+            return fetch(url, { method: 'POST', body: body, headers: { 'Content-Type': 'application/octet-stream' } })
+                .then(r => {
+                    if (r.ok) return r.json();
+                    const err = new Error('live ' + r.status);
+                    err.final = r.status >= 400 && r.status < 500;  // unknown session, bad chunk
+                    throw err;
+                })
+                .catch(err => {
+                    if (err.final || attempt >= 5) throw err;
+                    return new Promise(resolve => setTimeout(resolve, 1000 * 2 ** attempt))
+                        .then(() => post(url, body, attempt + 1));
+                });
+        };
+
+        const flush = function (rec, all) {
+            const size = SAMPLE_RATE * CHUNK_SECONDS;
+            while (rec.pending.length >= size || (all && rec.pending.length)) {
+                const chunk = Int16Array.from(rec.pending.splice(0, size));
+                const seq = rec.seq++;
+                rec.queue = rec.queue
+                    .then(() => post(`/api/live/${rec.id}/chunk?seq=${seq}`, chunk.buffer, 0))
+                    .then(data => { if (data && rec === recording) recordStatus.textContent = `録音中 ${formatTime(data.seconds)}（文字起こし ${data.transcribed}/${data.segments}）`; })
+                    .catch(err => { rec.failed = rec.failed || err; });
+            }
+        };
+
+        const start = function () {
+            return Promise.all([
+                navigator.mediaDevices.getUserMedia({ audio: true }),
+                fetch('/api/live', { method: 'POST' }).then(r => r.ok ? r.json() : Promise.reject(new Error('live ' + r.status))),
+            ]).then(([stream, data]) => {
+                const context = new (window.AudioContext || window.webkitAudioContext)();
+                const source = context.createMediaStreamSource(stream);
+                const processor = context.createScriptProcessor(4096, 1, 1);
+                const rec = { id: data.live_id, stream, context, source, processor, pending: [], seq: 0, queue: Promise.resolve(), failed: null, started: Date.now() };
+                processor.onaudioprocess = function (e) {
+                    Array.prototype.push.apply(rec.pending, downsample(e.inputBuffer.getChannelData(0), context.sampleRate));
+                    flush(rec, false);
+                };
+                source.connect(processor);
+                processor.connect(context.destination);
+                rec.timer = setInterval(() => { recordBtn.title = formatTime((Date.now() - rec.started) / 1000); }, 1000);
+                recording = rec;
+                // A recording replaces any chosen file
+                audioInput.value = '';
+                stagedInput.value = '';
+                liveInput.value = '';
+                const wrapper = audioInput.closest('.file-upload-wrapper');
+                if (wrapper.classList.contains('has-file')) {
+                    wrapper.classList.remove('has-file');
+                    wrapper.querySelector('.file-upload-icon').classList.replace('fa-check-circle', 'fa-microphone-alt');
+                    wrapper.querySelector('.file-upload-text').textContent = '音声 / ファイルを選択';
+                }
+                setLabel('停止');
+                recordStatus.textContent = '録音中 0:00';
+            });
+        };
+
+        const stop = function () {
+            const rec = recording;
+            recording = null;
+            clearInterval(rec.timer);
+            rec.processor.disconnect();
+            rec.source.disconnect();
+            rec.stream.getTracks().forEach(track => track.stop());
+            rec.context.close();
+            flush(rec, true);
+            recordBtn.disabled = true;
+            recordStatus.textContent = '送信中...';
+            return rec.queue
+                .then(() => rec.failed ? Promise.reject(rec.failed) : post(`/api/live/${rec.id}/stop?chunks=${rec.seq}`, null, 0))
+                .then(data => {
+                    liveInput.value = rec.id;
+                    recordStatus.textContent = `録音済み ${formatTime(data.seconds)}`;
+                })
+                .catch(() => { recordStatus.textContent = '録音の送信に失敗しました。もう一度録音してください'; })
+                .finally(() => { recordBtn.disabled = false; setLabel('この場で録音'); });
+        };
+
+        recordBtn.addEventListener('click', function () {
+            if (recording) return stop();
+            recordBtn.disabled = true;
+            start()
+                .catch(() => { recordStatus.textContent = 'マイクを使用できません'; })
+                .finally(() => { recordBtn.disabled = false; });
+        });
+        audioInput.addEventListener('change', function () {
+            if (this.files[0]) { liveInput.value = ''; recordStatus.textContent = ''; }
+        });
+        recordBtn.form.addEventListener('submit', function (e) {
+            // Submitted mid-recording: finish sending first, then submit again
+            if (!recording) return;
+            e.preventDefault();
+            e.stopImmediatePropagation();
+            const form = this;
+            stop().then(() => { if (liveInput.value) form.requestSubmit(); });
+        }, true);
+    }
+
+    // Mode UI Toggle
+    window.updateModeUI = function () {
+        const isSales = document.getElementById('mode_sales').checked;
+        document.getElementById('label_sales').style.background = isSales ? 'white' : 'transparent';
+        document.getElementById('label_sales').style.color = isSales ? 'var(--primary)' : 'var(--text-sub)';
+
+        document.getElementById('label_qa').style.background = !isSales ? 'white' : 'transparent';
+        document.getElementById('label_qa').style.color = !isSales ? 'var(--primary)' : 'var(--text-sub)';
+
+        // Toggle Input Groups
+        const displayStyle = isSales ? 'block' : 'none';
+        const clientGroup = document.getElementById('clientSearchGroup');
+        const staffGroup = document.getElementById('staffSelectGroup');
+
+        if (clientGroup) clientGroup.style.display = displayStyle;
+        if (staffGroup) staffGroup.style.display = displayStyle;
+    }
+
+    // Client Search Logic
+    const clientInput = document.getElementById('clientSearchInput');
+    const resultsDiv = document.getElementById('searchResults');
+    let debounceTimer;
+
+    if (clientInput) {
+        clientInput.addEventListener('input', function () {
+            clearTimeout(debounceTimer);
+            const query = this.value;
+            if (query.length < 2) {
+                resultsDiv.style.display = 'none';
+                return;
+            }
+
+            debounceTimer = setTimeout(() => {
+                ClientIndex.search(query)
+                    .then(data => {
+                        resultsDiv.innerHTML = '';
+                        if (data.length === 0) {
+                            resultsDiv.style.display = 'none';
+                            return;
+                        }
+                        data.forEach(client => {
+                            const div = document.createElement('div');
+                            div.style.padding = '10px';
+                            div.style.borderBottom = '1px solid #eee';
+                            div.textContent = client.name;
+                            div.onclick = () => {
+                                clientInput.value = client.name;
+                                document.getElementById('client_id').value = client.record_id; // Using record_id for Kintone
+                                document.getElementById('client_name').value = client.name;
+                                resultsDiv.style.display = 'none';
+
+                                // Show History Button
+                                let histBtn = document.getElementById('historyBtn');
+                                if (!histBtn) {
+                                    histBtn = document.createElement('div');
+                                    histBtn.id = 'historyBtn';
+                                    histBtn.style.marginTop = '5px';
+                                    clientInput.parentNode.parentNode.appendChild(histBtn);
+                                }
+                                histBtn.innerHTML = `
+                                    <a href="/history/${client.record_id}?name=${encodeURIComponent(client.name)}" target="_blank" 
+                                       style="display:block; background:#f0f9ff; color:#0284c7; padding:8px; border-radius:6px; text-decoration:none; text-align:center; font-weight:bold; border:1px solid #bae6fd;">
+                                       <i class="fas fa-history"></i> 📝 ${client.name} との過去のやり取りを確認 (AI要約)
+                                    </a>
+                                `;
+                            };
+                            resultsDiv.appendChild(div);
+                        });
+                        resultsDiv.style.display = 'block';
+                    });
+            }, 50); // local search: debounce only to coalesce keystrokes
+        });
+
+        // Hide results on click outside
+        document.addEventListener('click', function (e) {
+            if (e.target !== clientInput && e.target !== resultsDiv) {
+                resultsDiv.style.display = 'none';
+            }
+        });
+    }
+});
@@ -0,0 +1,127 @@
+import os
+import json
+import threading
+from datetime import datetime
+from pathlib import Path
+
+import utils
+
+# =============================================================================
+# CONFIGURATION
+# =============================================================================
+# Two-stage audio pipeline: each recording is transcribed once (one audio call)
+# and the transcript is stored under the SHA-256 of the audio bytes. Extraction
+# in either mode, re-extraction after a mode switch and single-field
+# regeneration are then text-only calls on the stored transcript.
+
+TRANSCRIPT_DIR = Path(os.getenv("TRANSCRIPT_DIR", "./transcripts"))
+# "direct": /process listens and extracts in one call (default)
+# "transcript": /process goes through the stored transcript
+AUDIO_PIPELINE = os.getenv("AUDIO_PIPELINE", "direct")
+
+TRANSCRIBE_PROMPT = """この音声ファイルを文字起こししてください。
+- 話された内容を省略・要約せず、そのまま書き起こしてください。
+- 話者が変わるところで改行し、分かる場合は「営業:」「顧客:」のように話者を付けてください。
+- 文字起こし以外の説明や前置きは出力しないでください。"""
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+def _digest_lock(digest: str) -> threading.Lock:
+    with _locks_guard:
+        return _locks.setdefault(digest, threading.Lock())
+
+def audio_digest(file_path: str) -> str:
+    return utils.file_digest(file_path)
+
+def _transcript_path(digest: str) -> Path:
+    return TRANSCRIPT_DIR / f"{digest}.json"
+
+def load_transcript(digest: str) -> str:
+    try:
+        return json.loads(_transcript_path(digest).read_text(encoding="utf-8"))["transcript"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+def save_transcript(digest: str, transcript: str, model: str):
+    TRANSCRIPT_DIR.mkdir(parents=True, exist_ok=True)
+    path = _transcript_path(digest)
+    tmp = path.with_suffix(".tmp")
+    entry = {"digest": digest, "model": model, "created": datetime.now().isoformat(timespec="seconds"), "transcript": transcript}
+    tmp.write_text(json.dumps(entry, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, path)
+
+# =============================================================================
+# PIPELINE
+# =============================================================================
+
+def transcribe(audio_file_path: str, uploaded_file=None) -> str:
+    client = utils.get_genai_client()
+    if uploaded_file is None:
+        uploaded_file = utils.audio_part(client, audio_file_path)
+    response = utils.generate_content(client, "transcribe", contents=[uploaded_file, TRANSCRIBE_PROMPT])
+    return (response.text or "").strip()
+
+def get_transcript(audio_file_path: str, uploaded_file=None) -> str:
+    """
+    Stored transcript for this recording, transcribing it on first use.
+    """
+    digest = audio_digest(audio_file_path)
+    with _digest_lock(digest):
+        transcript = load_transcript(digest)
+        if transcript is None:
+            transcript = transcribe(audio_file_path, uploaded_file)
+            if transcript:
+                save_transcript(digest, transcript, utils.GEMINI_MODEL)
+        return transcript
+
+def source_text(transcript: str, memo: str = "") -> str:
+    if not memo:
+        return transcript
+    if not transcript:
+        return memo
+    # Same precedence as audio_and_text_prompt: the memo wins on conflicts
+    return f"## 商談の文字起こし\n{transcript}\n\n## テキストメモ (優先)\n{memo}"
+
+def process_audio(audio_file_path: str, text: str = "", mode: str = "sales", reference: str = "", uploaded_file=None) -> dict:
+    """
+    Drop-in for process_audio_only / process_audio_and_text via the stored transcript.
+    """
+    if not utils.GEMINI_API_KEY: return {}
+    transcript = get_transcript(audio_file_path, uploaded_file)
+    if not transcript:
+        return {}
+    return utils.process_text_only(source_text(transcript, text), mode, reference=reference)
+
+def field_prompt(field: str, text: str, data: dict) -> str:
+    others = {k: v for k, v in (data or {}).items() if k != field and isinstance(v, str) and v}
+    return f"""以下のテキストから「{field}」の項目だけを抽出し直してください。
+他の項目の現在の値は参考情報です（変更しないでください）:
+{json.dumps(others, ensure_ascii=False, indent=1)}
+
+## テキスト
+{text}
+
+## 出力形式 (JSON)
+```json
+{{"{field}": "..."}}
+```
+"""
+
+def regenerate_field(field: str, audio_file_path: str = "", memo: str = "", mode: str = "sales", data: dict = None):
+    """
+    Re-extract a single field as a text-only call. Returns the new value, or None.
+    """
+    if not utils.GEMINI_API_KEY: return None
+    transcript = get_transcript(audio_file_path) if audio_file_path else ""
+    text = source_text(transcript, memo)
+    if not text:
+        return None
+    client = utils.get_genai_client()
+    response = utils.generate_content(
+        client, mode,
+        contents=field_prompt(field, text, data),
+        config=utils.generation_config(system_instruction=utils.get_system_instruction(mode)),
+    )
+    parsed = utils.parse_json_response(response.text)
+    return parsed.get(field) if parsed else None
@@ -0,0 +1,170 @@
+import os
+import json
+import threading
+import contextvars
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# =============================================================================
+# CONFIGURATION
+# =============================================================================
+
+USAGE_LOG_PATH = Path(os.getenv("USAGE_LOG_PATH", "./usage_log/gemini_usage.jsonl"))
+
+# USD per 1M tokens. Audio input is billed separately from text input.
+GEMINI_PRICING = {
+    "gemini-3-flash-preview": {"input": 0.50, "audio": 1.00, "cached": 0.05, "output": 3.00},
+}
+DEFAULT_PRICING = {"input": 0.50, "audio": 1.00, "cached": 0.05, "output": 3.00}
+
+_write_lock = threading.Lock()
+
+# Request-scoped labels (staff / mode / report id) set by the caller
+_usage_context = contextvars.ContextVar("usage_context", default={})
+
+# =============================================================================
+# RECORDING
+# =============================================================================
+
+@contextmanager
+def usage_scope(**labels):
+    """
+    Attach labels (staff, mode, report_id) to every Gemini call made inside the block.
+    """
+    current = dict(_usage_context.get())
+    current.update({k: v for k, v in labels.items() if v})
+    token = _usage_context.set(current)
+    try:
+        yield current
+    finally:
+        _usage_context.reset(token)
+
+def _modality_tokens(details, modality: str) -> int:
+    total = 0
+    for d in details or []:
+        name = getattr(getattr(d, "modality", None), "name", str(getattr(d, "modality", "")))
+        if name.upper().endswith(modality):
+            total += getattr(d, "token_count", 0) or 0
+    return total
+
+def extract_usage(response) -> dict:
+    """
+    Read token counts from a generate_content response (google.genai or legacy SDK).
+    """
+    meta = getattr(response, "usage_metadata", None)
+    if meta is None:
+        return {"prompt_tokens": 0, "audio_tokens": 0, "output_tokens": 0, "cached_tokens": 0, "total_tokens": 0}
+    prompt_tokens = getattr(meta, "prompt_token_count", 0) or 0
+    output_tokens = (getattr(meta, "candidates_token_count", 0) or 0) + (getattr(meta, "thoughts_token_count", 0) or 0)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "audio_tokens": _modality_tokens(getattr(meta, "prompt_tokens_details", None), "AUDIO"),
+        "output_tokens": output_tokens,
+        "cached_tokens": getattr(meta, "cached_content_token_count", 0) or 0,
+        "total_tokens": getattr(meta, "total_token_count", 0) or prompt_tokens + output_tokens,
+    }
+
+def estimate_cost(entry: dict) -> float:
+    price = GEMINI_PRICING.get(entry.get("model"), DEFAULT_PRICING)
+    cached = entry.get("cached_tokens", 0)
+    audio = entry.get("audio_tokens", 0)
+    text_input = max(entry.get("prompt_tokens", 0) - audio - cached, 0)
+    cost = (
+        text_input * price["input"]
+        + audio * price["audio"]
+        + cached * price["cached"]
+        + entry.get("output_tokens", 0) * price["output"]
+    )
+    return cost / 1_000_000
+
+def record_usage(response, model: str, latency: float, **labels) -> dict:
+    """
+    Append one Gemini call to the usage log. Never raises.
+    """
+    entry = {"ts": datetime.now().isoformat(timespec="seconds"), "model": model, "latency_ms": int(latency * 1000)}
+    entry.update(_usage_context.get())
+    entry.update({k: v for k, v in labels.items() if v})
+    entry.update(extract_usage(response))
+    entry["cost_usd"] = round(estimate_cost(entry), 6)
+    try:
+        USAGE_LOG_PATH.parent.mkdir(parents=True, exist_ok=True)
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with _write_lock, open(USAGE_LOG_PATH, "a", encoding="utf-8") as f:
+            f.write(line)
+    except Exception as e:
+        print(f"Usage Log Error: {e}")
+    return entry
+
+# =============================================================================
+# AGGREGATION
+# =============================================================================
+
+def load_usage(since: datetime = None) -> list:
+    if not USAGE_LOG_PATH.exists():
+        return []
+    entries = []
+    with open(USAGE_LOG_PATH, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # partially written line
+            if since and datetime.fromisoformat(entry["ts"]) < since:
+                continue
+            entries.append(entry)
+    return entries
+
+def _top(entries: list, key: str, limit: int) -> list:
+    groups = defaultdict(lambda: {"calls": 0, "tokens": 0, "cost_usd": 0.0})
+    for e in entries:
+        g = groups[e.get(key) or "(不明)"]
+        g["calls"] += 1
+        g["tokens"] += e.get("total_tokens", 0)
+        g["cost_usd"] += e.get("cost_usd", 0.0)
+    ranked = sorted(groups.items(), key=lambda kv: kv[1]["tokens"], reverse=True)
+    return [{key: name, **g, "cost_usd": round(g["cost_usd"], 6)} for name, g in ranked[:limit]]
+
+def summarize_usage(hours: float = 24, limit: int = 5) -> dict:
+    """
+    Aggregate the usage log: tokens per minute, cost per report and the heaviest staff/modes.
+    """
+    since = datetime.now() - timedelta(hours=hours)
+    entries = load_usage(since)
+
+    per_minute = defaultdict(int)
+    for e in entries:
+        per_minute[e["ts"][:16]] += e.get("total_tokens", 0)
+
+    reports = defaultdict(float)
+    for e in entries:
+        if e.get("report_id"):
+            reports[e["report_id"]] += e.get("cost_usd", 0.0)
+
+    total_tokens = sum(e.get("total_tokens", 0) for e in entries)
+    total_cost = sum(e.get("cost_usd", 0.0) for e in entries)
+    return {
+        "window_hours": hours,
+        "calls": len(entries),
+        "total_tokens": total_tokens,
+        "total_cost_usd": round(total_cost, 6),
+        "tokens": {
+            "prompt": sum(e.get("prompt_tokens", 0) for e in entries),
+            "audio": sum(e.get("audio_tokens", 0) for e in entries),
+            "output": sum(e.get("output_tokens", 0) for e in entries),
+            "cached": sum(e.get("cached_tokens", 0) for e in entries),
+        },
+        "tokens_per_minute": {
+            "average": round(total_tokens / (hours * 60), 2) if hours else 0,
+            "peak": max(per_minute.values(), default=0),
+            "series": dict(sorted(per_minute.items())),
+        },
+        "cost_per_report": {
+            "reports": len(reports),
+            "average_usd": round(sum(reports.values()) / len(reports), 6) if reports else 0,
+            "max_usd": round(max(reports.values(), default=0), 6),
+        },
+        "top_staff": _top(entries, "staff", limit),
+        "top_modes": _top(entries, "mode", limit),
+    }
@@ -1,12 +1,24 @@
 
 import os
 import json
+import time
+import asyncio
+import hashlib
+import inspect
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, wraps
+from contextlib import contextmanager
 from datetime import datetime, date, timedelta
 from pathlib import Path
 import requests
 from dotenv import load_dotenv
-from google import genai
-from google.genai import types
+from usage import record_usage
+import audio_probe
+import cache
+import resilience
+import startup
 
 
 # ... (rest of imports)
@@ -31,6 +43,9 @@ KINTONE_CLIENT_API_TOKEN = os.getenv("KINTONE_CLIENT_API_TOKEN")
 
 SAVED_AUDIO_DIR = Path("./saved_audio")
 
+# Same recording / memo, mode, prompt and model -> same extraction (e.g. a resubmit after going back)
+EXTRACTION_CACHE_TTL = int(os.getenv("EXTRACTION_CACHE_TTL", "86400"))
+
 # =============================================================================
 # MASTER DATA
 # =============================================================================
@@ -70,6 +85,26 @@ STAFF_CODE_MAP = {
 # FUNCTIONS
 # =============================================================================
 
+# google.genai dominates the import time of this module, so it is loaded on
+# first use (or once before fork, see warm_shared_state / gunicorn.conf.py).
+_genai_client = None
+
+def get_genai_client():
+    global _genai_client
+    if _genai_client is None:
+        from google import genai
+        _genai_client = genai.Client(api_key=GEMINI_API_KEY, http_options=http_options(resilience.GEMINI_TIMEOUT))
+    return _genai_client
+
+def http_options(timeout: float):
+    # Per-call deadline for google.genai (milliseconds)
+    from google.genai import types
+    return types.HttpOptions(timeout=int(timeout * 1000))
+
+def generation_config(**kwargs):
+    from google.genai import types
+    return types.GenerateContentConfig(**kwargs)
+
 def init_directories():
     SAVED_AUDIO_DIR.mkdir(exist_ok=True)
 
@@ -83,13 +118,19 @@ def save_audio_file(uploaded_file) -> str:
     init_directories()
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     # Use .filename for the original filename, .name is the form field name
-    filename_attr = getattr(uploaded_file, 'filename', uploaded_file.name)
+    # (Starlette's UploadFile has no .name at all, so the fallback must be lazy)
+    filename_attr = getattr(uploaded_file, 'filename', None) or getattr(uploaded_file, 'name', '')
     extension = Path(filename_attr).suffix
     if not extension:
         extension = ".mp3"
     # Safe filename (timestamp only) to avoid UnicodeEncodeError during SDK upload
     filename = f"{timestamp}{extension}"
     file_path = SAVED_AUDIO_DIR / filename
+    # Batch uploads save several files within the same second
+    counter = 1
+    while file_path.exists():
+        file_path = SAVED_AUDIO_DIR / f"{timestamp}_{counter}{extension}"
+        counter += 1
     
     # Use .save() for FileStorage objects (Flask/Werkzeug)
     if hasattr(uploaded_file, 'save'):
@@ -97,7 +138,11 @@ def save_audio_file(uploaded_file) -> str:
     else:
         # Fallback for BytesIO or other objects (e.g. testing)
         with open(file_path, "wb") as f:
-            if hasattr(uploaded_file, 'getbuffer'):
+            if hasattr(uploaded_file, 'file'):
+                # Starlette UploadFile (async serving mode): copy the underlying file
+                uploaded_file.file.seek(0)
+                f.write(uploaded_file.file.read())
+            elif hasattr(uploaded_file, 'getbuffer'):
                 f.write(uploaded_file.getbuffer())
             elif hasattr(uploaded_file, 'read'):
                 uploaded_file.seek(0)
@@ -114,22 +159,84 @@ def convert_date_str_safe(date_str: str, default_func=None) -> date:
     except:
         return default_func() if default_func else date.today()
 
+def kintone_url(path: str) -> str:
+    return f"https://{KINTONE_SUBDOMAIN}.cybozu.com/k/v1/{path}"
+
+_http_session = None
+_http_session_pid = None
+
+def http_session() -> requests.Session:
+    """
+    Per-process requests session, so Kintone calls reuse a warm TLS connection.
+    Recreated after fork: pooled sockets must not be shared between workers.
+    Every request gets a deadline and goes through the Kintone circuit breaker.
+    """
+    global _http_session, _http_session_pid
+    if _http_session is None or _http_session_pid != os.getpid():
+        _http_session = resilience.KintoneSession()
+        _http_session_pid = os.getpid()
+    return _http_session
+
+def report_app_token() -> str:
+    # Report app lookups into the client app need both tokens
+    if KINTONE_CLIENT_API_TOKEN: return f"{KINTONE_API_TOKEN},{KINTONE_CLIENT_API_TOKEN}"
+    return KINTONE_API_TOKEN
+
+def kintone_quote(value) -> str:
+    # String literal for a Kintone query: \ and " are backslash-escaped
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+def iter_kintone_records(app_id: str, token: str, query: str = "", fields: list = None, size: int = 500):
+    """
+    Stream every record matching `query` through Kintone's cursor API, one page at a time.
+    The cursor is deleted if the caller stops early or a request fails.
+    """
+    headers = {"X-Cybozu-API-Token": token}
+    body = {"app": app_id, "query": query, "size": size}
+    if fields: body["fields"] = fields
+    resp = http_session().post(kintone_url("records/cursor.json"), headers=headers, json=body)
+    resp.raise_for_status()
+    cursor_id = resp.json()["id"]
+    finished = False
+    try:
+        while True:
+            resp = http_session().get(kintone_url("records/cursor.json"), headers=headers, params={"id": cursor_id})
+            resp.raise_for_status()
+            page = resp.json()
+            yield page.get("records", [])
+            if not page.get("next"):
+                finished = True  # Kintone deletes a cursor once it has been read to the end
+                return
+    finally:
+        if not finished:
+            try:
+                http_session().delete(kintone_url("records/cursor.json"), headers=headers, json={"id": cursor_id})
+            except Exception as e:
+                print(f"Cursor Delete Error: {e}")
+
+def client_search_params(keyword: str) -> dict:
+    return {"app": KINTONE_CLIENT_APP_ID, "query": f'取引先名 like {kintone_quote(keyword)} limit 20'}
+
+def parse_client_records(records: list) -> list:
+    return [{
+        "id": rec.get("取引先ID", {}).get("value", rec["$id"]["value"]),
+        "record_id": rec["$id"]["value"],
+        "name": rec.get("取引先名", {}).get("value", "不明")
+    } for rec in records]
+
 def search_clients(keyword: str) -> list:
     if not KINTONE_CLIENT_APP_ID or not KINTONE_CLIENT_API_TOKEN:
         print("取引先アプリの設定が不足しています。")
         return []
-    url = f"https://{KINTONE_SUBDOMAIN}.cybozu.com/k/v1/records.json"
+    url = kintone_url("records.json")
     headers = {"X-Cybozu-API-Token": KINTONE_CLIENT_API_TOKEN}
-    params = {"app": KINTONE_CLIENT_APP_ID, "query": f'取引先名 like "{keyword}" limit 20'}
-    try:
-        response = requests.get(url, headers=headers, params=params)
+
+    def request():
+        response = http_session().get(url, headers=headers, params=client_search_params(keyword))
         if response.status_code != 200: return []
-        records = response.json().get("records", [])
-        return [{
-            "id": rec.get("取引先ID", {}).get("value", rec["$id"]["value"]),
-            "record_id": rec["$id"]["value"],
-            "name": rec.get("取引先名", {}).get("value", "不明")
-        } for rec in records]
+        return parse_client_records(response.json().get("records", []))
+    try:
+        return resilience.hedged("kintone.search", request)
     except: return []
 
 def get_current_date_str():
@@ -157,6 +264,7 @@ def calculate_smart_next_date(base_date_str: str) -> str:
         
     return target.strftime("%Y-%m-%d")
 
+@lru_cache(maxsize=8)
 def get_extraction_prompt(current_date_str: str):
     # f-stringでのJSON出力には {{ }} でのエスケープが必要です
     return f"""
@@ -183,7 +291,7 @@ def get_extraction_prompt(current_date_str: str):
     - 「お電話にて」「架電」「不在」等の記述 -> **架電、メール**
     - 明確なキーワードがない場合も、商談の深さ（見積提示など）から推測してください。
 
-[選択肢]: "架電、メール", "アポ架電（担当者通電）", "初回訪問", "提案（担当者訪問）", "提案（見積書提出）", "提案（決裁者訪問・プレゼン）", "合意後訪問（商談）", "訪問（公示前）", "公示対応（提案書提出）", "公示対応（プレゼン参加）", "公示対応（入札・開封）", "合意後訪問（公示）"
+[選択肢]: {", ".join(f'"{opt}"' for opt in SALES_ACTIVITY_OPTIONS)}
 
 ### 2. 対応日 (action_date)
 活動日付 (YYYY-MM-DD)。不明時は本日({current_date_str})。
@@ -265,6 +373,7 @@ def get_extraction_prompt(current_date_str: str):
 ```
 """
 
+@lru_cache(maxsize=8)
 def get_qa_extraction_prompt(current_date_str: str):
     return f"""
 あなたは議事録作成のエキスパートAIです。
@@ -321,70 +430,194 @@ def get_mime_type(file_path: str) -> str:
     elif ext == ".ogg": return "audio/ogg"
     else: return "audio/mp3" # Fallback
 
-def process_audio_only(audio_file_path: str, mode: str = "sales") -> dict:
-    if not GEMINI_API_KEY: return {}
-    client = genai.Client(api_key=GEMINI_API_KEY)
-    
+def generate_content(client, mode: str = "", **kwargs):
+    """
+    client.models.generate_content wrapper that records token usage and latency.
+    """
+    def call(model):
+        start = time.perf_counter()
+        response = client.models.generate_content(**{**kwargs, "model": model})
+        record_usage(response, model, time.perf_counter() - start, mode=mode)
+        return response
+    # Falls back to GEMINI_FALLBACK_MODEL while the model's circuit is open
+    return resilience.call_with_fallback(kwargs.get("model", GEMINI_MODEL), call)
+
+def file_digest(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+extraction_cache = cache.get_cache("extraction", ttl=EXTRACTION_CACHE_TTL)
+_fresh_extraction = contextvars.ContextVar("fresh_extraction", default=False)
+
+@contextmanager
+def fresh_extraction():
+    """
+    Extractions in this block skip the cache lookup (their results replace the
+    cached ones): /reprocess and explicit retries must not get the same answer back.
+    """
+    token = _fresh_extraction.set(True)
+    try:
+        yield
+    finally:
+        _fresh_extraction.reset(token)
+
+def extraction_ok(data) -> bool:
+    # Worth caching: a JSON object with at least one field extracted
+    return isinstance(data, dict) and any(value not in ("", None, [], {}) for value in data.values())
+
+def cached_extraction(func):
+    """
+    Serve an extraction function's result from the shared cache. The key covers
+    every argument (audio by content, not path) except uploaded_file, plus the
+    system instruction (which includes today's date) and the model.
+    Works for the coroutine variants in async_utils too; both share entries.
+    """
+    signature = inspect.signature(func)
+    name = func.__name__.removesuffix("_async")
+
+    def cache_key(args, kwargs) -> str:
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        params = dict(bound.arguments)
+        params.pop("uploaded_file", None)
+        if params.get("audio_file_path"):
+            params["audio_file_path"] = file_digest(params["audio_file_path"])
+        return cache.digest(name, GEMINI_MODEL, get_system_instruction(params.get("mode", "sales")), params)
+
+    if inspect.iscoroutinefunction(func):
+        @wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            if not GEMINI_API_KEY: return {}
+            key = await asyncio.to_thread(cache_key, args, kwargs)
+            data = None if _fresh_extraction.get() else await asyncio.to_thread(extraction_cache.get, key)
+            if data is None:
+                data = await func(*args, **kwargs)
+                if extraction_ok(data):
+                    await asyncio.to_thread(extraction_cache.set, key, data)
+            return data
+        return async_wrapper
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not GEMINI_API_KEY: return {}
+        key = cache_key(args, kwargs)
+        data = None if _fresh_extraction.get() else extraction_cache.get(key)
+        if data is None:
+            data = func(*args, **kwargs)
+            if extraction_ok(data):
+                extraction_cache.set(key, data)
+        return data
+    return wrapper
+
+def get_system_instruction(mode: str = "sales") -> str:
     prompt_func = get_qa_extraction_prompt if mode == "qa" else get_extraction_prompt
-    sys_instruct = prompt_func(get_current_date_str())
-    
-    # Upload file
+    return prompt_func(get_current_date_str())
+
+AUDIO_ONLY_PROMPT = "この音声ファイルの内容を聞き取り、データを抽出してください。"
+
+def with_reference(prompt: str, reference: str = "") -> str:
+    # Past reports for the same client (similar_reports.prompt_reference), after the input
+    return f"{prompt}\n\n{reference}" if reference else prompt
+
+def text_only_prompt(text: str, reference: str = "") -> str:
+    return with_reference(f"以下のテキストからデータを抽出してください:\n\n{text}", reference)
+
+def audio_and_text_prompt(text: str, reference: str = "") -> str:
+    return with_reference(f"音声ファイルの内容を分析し、データを抽出してください。テキストメモ優先:\n{text}", reference)
+
+def upload_audio(client, audio_file_path: str):
     # Ensure mime_type is set via config. Filename must be ASCII (handled in save_audio_file).
     mime = get_mime_type(audio_file_path)
     print(f"Uploading file: {audio_file_path} with mime_type: {mime}")
-    
-    uploaded_file = client.files.upload(
+    return client.files.upload(
         file=audio_file_path, 
         config={'mime_type': mime}
     )
+
+def inline_audio_part(audio_file_path: str):
+    """
+    The recording as inline bytes if it is small enough to go in the request
+    itself (see audio_probe.py), else None. Raises AudioLimitError for recordings
+    Gemini won't take.
+    """
+    info = audio_probe.probe(audio_file_path)
+    audio_probe.check_limits(info)
+    if not audio_probe.use_inline(info):
+        print(f"Audio: {audio_file_path} ({audio_probe.describe(info)}) via Files API")
+        return None
+    print(f"Audio: {audio_file_path} ({audio_probe.describe(info)}) inline")
+    from google.genai import types
+    return types.Part.from_bytes(data=Path(audio_file_path).read_bytes(),
+                                 mime_type=info["mime_type"] or get_mime_type(audio_file_path))
+
+def audio_part(client, audio_file_path: str):
+    # Inline: one round trip instead of upload + generate
+    part = inline_audio_part(audio_file_path)
+    return part if part is not None else upload_audio(client, audio_file_path)
+
+@cached_extraction
+def process_audio_only(audio_file_path: str, mode: str = "sales", reference: str = "", uploaded_file=None) -> dict:
+    """
+    uploaded_file: an upload already made for this recording (see staging.py), if any.
+    """
+    if not GEMINI_API_KEY: return {}
+    client = get_genai_client()
+    
+    sys_instruct = get_system_instruction(mode)
     
-    prompt = "この音声ファイルの内容を聞き取り、データを抽出してください。"
+    if uploaded_file is None:
+        uploaded_file = audio_part(client, audio_file_path)
+    
+    prompt = with_reference(AUDIO_ONLY_PROMPT, reference)
     
     # Generate
-    response = client.models.generate_content(
+    response = generate_content(
+        client, mode,
         model=GEMINI_MODEL,
         contents=[uploaded_file, prompt],
-        config=types.GenerateContentConfig(system_instruction=sys_instruct)
+        config=generation_config(system_instruction=sys_instruct)
     )
     return parse_json_response(response.text)
 
-def process_text_only(text: str, mode: str = "sales") -> dict:
+@cached_extraction
+def process_text_only(text: str, mode: str = "sales", reference: str = "") -> dict:
     if not GEMINI_API_KEY: return {}
-    client = genai.Client(api_key=GEMINI_API_KEY)
+    client = get_genai_client()
     
-    prompt_func = get_qa_extraction_prompt if mode == "qa" else get_extraction_prompt
-    sys_instruct = prompt_func(get_current_date_str())
+    sys_instruct = get_system_instruction(mode)
     
-    prompt = f"以下のテキストからデータを抽出してください:\n\n{text}"
+    prompt = text_only_prompt(text, reference)
     
-    response = client.models.generate_content(
+    # Idempotent and short: hedged after the observed p95, with its own deadline
+    response = resilience.hedged(
+        "gemini.text", generate_content,
+        client, mode,
         model=GEMINI_MODEL,
         contents=prompt,
-        config=types.GenerateContentConfig(system_instruction=sys_instruct)
+        config=generation_config(system_instruction=sys_instruct, http_options=http_options(resilience.GEMINI_TEXT_TIMEOUT))
     )
     return parse_json_response(response.text)
 
-def process_audio_and_text(audio_file_path: str, text: str, mode: str = "sales") -> dict:
+@cached_extraction
+def process_audio_and_text(audio_file_path: str, text: str, mode: str = "sales", reference: str = "", uploaded_file=None) -> dict:
     if not GEMINI_API_KEY: return {}
-    client = genai.Client(api_key=GEMINI_API_KEY)
+    client = get_genai_client()
     
-    prompt_func = get_qa_extraction_prompt if mode == "qa" else get_extraction_prompt
-    sys_instruct = prompt_func(get_current_date_str())
+    sys_instruct = get_system_instruction(mode)
     
-    mime = get_mime_type(audio_file_path)
-    print(f"Uploading file: {audio_file_path} with mime_type: {mime}")
+    if uploaded_file is None:
+        uploaded_file = audio_part(client, audio_file_path)
     
-    uploaded_file = client.files.upload(
-        file=audio_file_path, 
-        config={'mime_type': mime}
-    )
+    prompt = audio_and_text_prompt(text, reference)
     
-    prompt = f"音声ファイルの内容を分析し、データを抽出してください。テキストメモ優先:\n{text}"
-    
-    response = client.models.generate_content(
+    response = generate_content(
+        client, mode,
         model=GEMINI_MODEL,
         contents=[uploaded_file, prompt],
-        config=types.GenerateContentConfig(system_instruction=sys_instruct)
+        config=generation_config(system_instruction=sys_instruct)
     )
     return parse_json_response(response.text)
 
@@ -395,31 +628,39 @@ def sanitize_text(text: str) -> str:
 
 def upload_file_to_kintone(file_path: str, file_name: str) -> str:
     if not all([KINTONE_SUBDOMAIN, KINTONE_API_TOKEN]): return ""
-    url = f"https://{KINTONE_SUBDOMAIN}.cybozu.com/k/v1/file.json"
+    url = kintone_url("file.json")
     headers = {"X-Cybozu-API-Token": KINTONE_API_TOKEN}
     try:
         with open(file_path, "rb") as f:
             files = {"file": (file_name, f)}
-            response = requests.post(url, headers=headers, files=files)
+            response = http_session().post(url, headers=headers, files=files)
             response.raise_for_status()
             return response.json().get("fileKey", "")
     except Exception as e:
         print(f"ファイルアップロードエラー: {e}")
         return ""
 
-def upload_to_kintone(data: dict, file_keys: list = None) -> bool:
-    if not all([KINTONE_SUBDOMAIN, KINTONE_APP_ID, KINTONE_API_TOKEN]): return False
-    url = f"https://{KINTONE_SUBDOMAIN}.cybozu.com/k/v1/record.json"
-    combined_token = KINTONE_API_TOKEN
-    if KINTONE_CLIENT_API_TOKEN: combined_token = f"{KINTONE_API_TOKEN},{KINTONE_CLIENT_API_TOKEN}"
-    headers = {"X-Cybozu-API-Token": combined_token, "Content-Type": "application/json; charset=utf-8"}
-    
+def resolve_option(value: str, options: list) -> str:
+    """
+    Map a value onto the current option labels when it differs only in width or
+    spacing. Anything else is sent as-is: Kintone rejects it, and upload_to_kintone
+    saves the report without it and tells the rep (dropped_options_notice).
+    """
+    import unicodedata
+    value = sanitize_text(value)
+    if not value or value in options:
+        return value
+    norm = lambda s: unicodedata.normalize("NFKC", s).replace(" ", "")
+    by_norm = {norm(opt): opt for opt in options}
+    return by_norm.get(norm(value), value)
+
+def build_kintone_record(data: dict, file_keys: list = None) -> dict:
     staff_name = data.get("対応者", "")
     staff_code = STAFF_CODE_MAP.get(staff_name, "")
     
     record = {
         "取引先ID": {"value": str(data.get("取引先ID", ""))},
-        "新規営業件名": {"value": sanitize_text(data.get("新規営業件名", ""))},
+        "新規営業件名": {"value": resolve_option(data.get("新規営業件名", ""), SALES_ACTIVITY_OPTIONS)},
         "対応日": {"value": sanitize_text(data.get("対応日", ""))},
         "対応者": {"value": [{"code": staff_code}] if staff_code else []},
         "商談内容": {"value": sanitize_text(data.get("商談内容", ""))},
@@ -427,13 +668,55 @@ def upload_to_kintone(data: dict, file_keys: list = None) -> bool:
         "競合・マーケット情報": {"value": sanitize_text(data.get("競合・マーケット情報", ""))},
         "次回提案内容": {"value": sanitize_text(data.get("次回提案内容", ""))},
         "次回提案予定日": {"value": sanitize_text(data.get("次回提案予定日", ""))},
-        "次回営業件名": {"value": sanitize_text(data.get("次回営業件名", ""))},
+        "次回営業件名": {"value": resolve_option(data.get("次回営業件名", ""), NEXT_SALES_ACTIVITY_OPTIONS)},
     }
     if file_keys: record["添付ファイル_0"] = {"value": [{"fileKey": fk} for fk in file_keys]}
+    return record
+
+def kintone_record_payload(data: dict, file_keys: list = None) -> bytes:
+    payload = {"app": int(KINTONE_APP_ID), "record": build_kintone_record(data, file_keys)}
+    return json.dumps(payload, ensure_ascii=False).encode('utf-8')
+
+OPTION_FIELD_CODES = ("新規営業件名", "次回営業件名")
+
+def rejected_option_fields(resp) -> list:
+    # 400 with per-field errors, e.g. {"errors": {"record.新規営業件名.value": {...}}}
+    if resp.status_code != 400:
+        return []
+    try:
+        errors = resp.json().get("errors", {})
+    except ValueError:
+        return []
+    return [code for code in OPTION_FIELD_CODES if any(f"record.{code}." in key for key in errors)]
+
+def dropped_options_notice(data: dict, rejected: list) -> str:
+    # Shown with the success message: the report was saved, but without these values
+    values = "、".join(f"{code}「{data.get(code, '')}」" for code in rejected)
+    return f"Kintoneの選択肢にないため、次の項目を空欄で登録しました。Kintoneで選び直してください: {values}"
+
+def upload_to_kintone(data: dict, file_keys: list = None) -> tuple:
+    """
+    (success, message): the error if it failed; on success, a notice naming the
+    option fields that had to be saved blank (see dropped_options_notice), or "".
+    """
+    if not all([KINTONE_SUBDOMAIN, KINTONE_APP_ID, KINTONE_API_TOKEN]): return False, "Kintoneの設定が不足しています。"
+    url = kintone_url("record.json")
+    headers = {"X-Cybozu-API-Token": report_app_token(), "Content-Type": "application/json; charset=utf-8"}
     
-    payload = {"app": int(KINTONE_APP_ID), "record": record}
     try:
-        resp = requests.post(url, headers=headers, data=json.dumps(payload, ensure_ascii=False).encode('utf-8'))
+        resp = http_session().post(url, headers=headers, data=kintone_record_payload(data, file_keys))
+        rejected = rejected_option_fields(resp)
+        if rejected:
+            # Options changed since the last schema check: refresh in the background and
+            # save the report without the stale values rather than losing it
+            import form_schema
+            form_schema.refresh_in_background()
+            print(f"Kintone rejected options {rejected}; retrying without them")
+            notice = dropped_options_notice(data, rejected)
+            data = {**data, **{code: "" for code in rejected}}
+            resp = http_session().post(url, headers=headers, data=kintone_record_payload(data, file_keys))
+            resp.raise_for_status()
+            return True, notice
         resp.raise_for_status()
         return True, ""
     except Exception as e:
@@ -446,42 +729,185 @@ def upload_to_kintone(data: dict, file_keys: list = None) -> bool:
         print(f"Kintone Error: {error_msg}")
         return False, error_msg
 
+def history_params(client_id: str, limit: int = 5) -> dict:
+    # Query: Match ClientID, Order by Date Desc
+    query = f'取引先ID = {kintone_quote(client_id)} order by 対応日 desc limit {int(limit)}'
+    return {"app": KINTONE_APP_ID, "query": query}
+
+def parse_history_records(records: list) -> list:
+    history = []
+    for r in records:
+        history.append({
+            "id": r.get("$id", {}).get("value", ""),
+            "revision": r.get("$revision", {}).get("value", ""),
+            "date": r.get("対応日", {}).get("value", ""),
+            "staff": r.get("対応者", {}).get("value", [{}])[0].get("name", "") if r.get("対応者", {}).get("value") else "",
+            "type": r.get("新規営業件名", {}).get("value", ""),
+            "content": r.get("商談内容", {}).get("value", ""),
+            "next_action": r.get("次回提案内容", {}).get("value", ""),
+            "attachments": [{
+                "file_key": f.get("fileKey", ""),
+                "name": f.get("name", ""),
+                "content_type": f.get("contentType", ""),
+                "size": int(f.get("size") or 0),
+            } for f in r.get("添付ファイル_0", {}).get("value", [])]
+        })
+    return history
+
 def fetch_client_history(client_id: str, limit: int = 5) -> list:
     """
     Fetch recent sales reports for a specific client.
     """
     if not all([KINTONE_SUBDOMAIN, KINTONE_APP_ID, KINTONE_API_TOKEN]): return []
     
-    url = f"https://{KINTONE_SUBDOMAIN}.cybozu.com/k/v1/records.json"
-    combined_token = KINTONE_API_TOKEN
-    if KINTONE_CLIENT_API_TOKEN: combined_token = f"{KINTONE_API_TOKEN},{KINTONE_CLIENT_API_TOKEN}"
-    headers = {"X-Cybozu-API-Token": combined_token}
+    url = kintone_url("records.json")
+    headers = {"X-Cybozu-API-Token": report_app_token()}
     
-    # Query: Match ClientID, Order by Date Desc
-    query = f'取引先ID = "{client_id}" order by 対応日 desc limit {limit}'
-    params = {"app": KINTONE_APP_ID, "query": query}
-    
-    try:
-        resp = requests.get(url, headers=headers, params=params)
+    def request():
+        resp = http_session().get(url, headers=headers, params=history_params(client_id, limit))
         if resp.status_code != 200:
             print(f"History Fetch Error: {resp.text}")
             return []
-            
-        records = resp.json().get("records", [])
-        history = []
-        for r in records:
-            history.append({
-                "date": r.get("対応日", {}).get("value", ""),
-                "staff": r.get("対応者", {}).get("value", [{}])[0].get("name", "") if r.get("対応者", {}).get("value") else "",
-                "type": r.get("新規営業件名", {}).get("value", ""),
-                "content": r.get("商談内容", {}).get("value", ""),
-                "next_action": r.get("次回提案内容", {}).get("value", "")
-            })
-        return history
+        return parse_history_records(resp.json().get("records", []))
+
+    try:
+        return resilience.hedged("kintone.history", request)
     except Exception as e:
         print(f"History Fetch Exception: {e}")
         return []
 
+def iter_client_history(client_id: str, after_id: int = 0, size: int = 500):
+    """
+    Stream a client's full report history (oldest first) in pages via the cursor API.
+    after_id skips records up to and including that $id.
+    """
+    query = f'取引先ID = {kintone_quote(client_id)} and $id > {int(after_id)} order by $id asc'
+    for page in iter_kintone_records(KINTONE_APP_ID, report_app_token(), query, size=size):
+        yield parse_history_records(page)
+
+# Batched history: one `取引先ID in (...)` query per group of clients instead of
+# one request per client. Groups are kept under HISTORY_QUERY_MAX_CHARS (the
+# query travels in the URL) and their 500-record pages are fetched in parallel.
+HISTORY_QUERY_MAX_CHARS = 2000
+HISTORY_PAGE_SIZE = 500        # Kintone's maximum per records.json request
+HISTORY_MAX_OFFSET = 10000     # Kintone's maximum offset; larger groups go through the cursor API
+HISTORY_MAX_WORKERS = 8
+# A group with more reports than this many times what `limit` keeps is mostly old
+# history: its short clients are then asked for with per-client `limit N` queries
+HISTORY_OVERFETCH = 4
+
+_history_executor = None
+_history_executor_pid = None
+_history_executor_lock = threading.Lock()
+
+def history_executor() -> ThreadPoolExecutor:
+    global _history_executor, _history_executor_pid
+    with _history_executor_lock:
+        if _history_executor is None or _history_executor_pid != os.getpid():
+            _history_executor = ThreadPoolExecutor(max_workers=HISTORY_MAX_WORKERS, thread_name_prefix="history")
+            _history_executor_pid = os.getpid()
+        return _history_executor
+
+def history_groups(client_ids: list, since: str = "") -> list:
+    """
+    [(query, client ids)]: `取引先ID in (...)` queries covering client_ids,
+    each under HISTORY_QUERY_MAX_CHARS.
+    """
+    tail = (f" and 対応日 >= {kintone_quote(since)}" if since else "") + " order by 対応日 desc, $id desc"
+    query = lambda ids: f"取引先ID in ({', '.join(kintone_quote(cid) for cid in ids)}){tail}"
+    groups, ids = [], []
+    for cid in client_ids:
+        if ids and len(query(ids + [cid])) > HISTORY_QUERY_MAX_CHARS:
+            groups.append((query(ids), ids))
+            ids = []
+        ids.append(cid)
+    if ids:
+        groups.append((query(ids), ids))
+    return groups
+
+def histories_params(query: str, offset: int = 0, total: bool = False, size: int = HISTORY_PAGE_SIZE) -> dict:
+    params = {"app": KINTONE_APP_ID, "query": f"{query} limit {int(size)} offset {int(offset)}"}
+    if total: params["totalCount"] = "true"
+    return params
+
+def group_history_records(records: list, client_ids: list, limit: int = None) -> dict:
+    """
+    {client_id: parsed records, newest first}, at most `limit` per client.
+    Every requested client is present (an empty list if it has no reports).
+    """
+    grouped = {cid: [] for cid in client_ids}
+    for rec in records:
+        items = grouped.get(rec.get("取引先ID", {}).get("value", ""))
+        if items is not None and (limit is None or len(items) < limit):
+            items.append(rec)
+    return {cid: parse_history_records(items) for cid, items in grouped.items()}
+
+def _history_page(query: str, offset: int = 0, total: bool = False, size: int = HISTORY_PAGE_SIZE) -> dict:
+    headers = {"X-Cybozu-API-Token": report_app_token()}
+    resp = http_session().get(kintone_url("records.json"), headers=headers, params=histories_params(query, offset, total, size))
+    resp.raise_for_status()
+    return resp.json()
+
+def _history_cursor(query: str) -> dict:
+    # More than offset paging reaches: read the group through a cursor instead
+    records = [rec for page in iter_kintone_records(KINTONE_APP_ID, report_app_token(), query) for rec in page]
+    return {"records": records}
+
+def fetch_client_histories(client_ids: list, limit: int = 5, since: str = "") -> dict:
+    """
+    Recent sales reports for many clients at once: {client_id: records, newest first}.
+    limit=None returns every report; since (YYYY-MM-DD) drops older ones.
+    Clients whose query group failed are missing from the result.
+    """
+    client_ids = list(dict.fromkeys(str(cid) for cid in client_ids if cid))
+    if not client_ids or not all([KINTONE_SUBDOMAIN, KINTONE_APP_ID, KINTONE_API_TOKEN]): return {}
+    submit = lambda func, *args: history_executor().submit(contextvars.copy_context().run, func, *args)
+
+    # First pages (with the total count) of every group, then all remaining pages, in parallel
+    groups = [(query, ids, submit(_history_page, query, 0, True)) for query, ids in history_groups(client_ids, since)]
+    pending = []
+    for query, ids, first in groups:
+        try:
+            page = first.result()
+        except Exception as e:
+            print(f"History Batch Fetch Error: {e}")
+            continue
+        count = int(page.get("totalCount") or 0)
+        first_records = page.get("records", [])
+        if limit is not None and count > len(first_records) and count > HISTORY_OVERFETCH * limit * len(ids):
+            # The first page (newest first) already holds the latest `limit` of the busier
+            # clients; read only the others, one small query each, not the whole group
+            seen = {}
+            for rec in first_records:
+                cid = rec.get("取引先ID", {}).get("value", "")
+                seen[cid] = seen.get(cid, 0) + 1
+            short = [cid for cid in ids if seen.get(cid, 0) < limit]
+            pending.append((ids, [first] + [submit(_history_page, history_groups([cid], since)[0][0], 0, False, limit)
+                                             for cid in short]))
+        elif count > HISTORY_MAX_OFFSET + HISTORY_PAGE_SIZE:
+            pending.append((ids, [submit(_history_cursor, query)]))
+        else:
+            rest = [submit(_history_page, query, offset) for offset in range(HISTORY_PAGE_SIZE, count, HISTORY_PAGE_SIZE)]
+            pending.append((ids, [first] + rest))
+
+    result = {}
+    for ids, pages in pending:
+        try:
+            records, seen_ids = [], set()
+            for page in pages:
+                for rec in page.result().get("records", []):
+                    # Per-client pages repeat records of the first page: keep the first copy
+                    if rec["$id"]["value"] not in seen_ids:
+                        seen_ids.add(rec["$id"]["value"])
+                        records.append(rec)
+        except Exception as e:
+            print(f"History Batch Fetch Error: {e}")
+            continue
+        result.update(group_history_records(records, ids, limit))
+    return result
+
+SUMMARY_FAILED = "要約生成に失敗しました。"
+
 def summarize_history(history_data: list) -> dict:
     """
     Use Gemini to summarize the history list.
@@ -489,8 +915,20 @@ def summarize_history(history_data: list) -> dict:
     if not history_data or not GEMINI_API_KEY:
         return {"summary": "履歴がありません。", "latest": ""}
         
-    client = genai.Client(api_key=GEMINI_API_KEY)
-    
+    client = get_genai_client()
+    prompt = history_summary_prompt(history_data)
+    try:
+        resp = generate_content(
+            client, "history",
+            model=GEMINI_MODEL,
+            contents=prompt,
+        )
+        return parse_json_response(resp.text)
+    except Exception as e:
+        print(f"Summarize Error: {e}")
+        return {"flow": SUMMARY_FAILED, "latest_status": ""}
+
+def history_summary_prompt(history_data: list) -> str:
     # Construct context txt
     context_text = ""
     for i, item in enumerate(history_data):
@@ -498,7 +936,7 @@ def summarize_history(history_data: list) -> dict:
         context_text += f"内容: {item['content']}\n"
         context_text += f"次回: {item['next_action']}\n\n"
         
-    prompt = f"""
+    return f"""
 あなたは営業アシスタントです。以下の過去の商談履歴（直近{len(history_data)}件）を読み、次の訪問に向けた要約を作成してください。
 
 ## 履歴データ
@@ -516,12 +954,17 @@ def summarize_history(history_data: list) -> dict:
 }}
 ```
 """
-    try:
-        resp = client.models.generate_content(
-            model=GEMINI_MODEL,
-            contents=prompt,
-        )
-        return parse_json_response(resp.text)
-    except Exception as e:
-        print(f"Summarize Error: {e}")
-        return {"flow": "要約生成に失敗しました。", "latest_status": ""}
+
+# =============================================================================
+# WARM-UP (shared read-only state built before fork in preload mode)
+# =============================================================================
+
+@startup.on_warmup
+def import_genai_sdk():
+    import google.genai.types  # noqa: F401  (import only; clients are created per worker)
+
+@startup.on_warmup
+def build_prompt_templates():
+    today = get_current_date_str()
+    get_extraction_prompt(today)
+    get_qa_extraction_prompt(today)
@@ -1,8 +1,20 @@
 
 import streamlit as st
 import utils
+import st_helpers
 from datetime import date, timedelta
 
+def extract(saved_file_path, text_input, file_content_txt):
+    # Runs on the shared job pool; must not touch st.*
+    if saved_file_path:
+        if text_input:
+            return utils.process_audio_and_text(saved_file_path, text_input)
+        return utils.process_audio_only(saved_file_path)
+    combined_text = (file_content_txt + "\n" + text_input).strip()
+    if combined_text:
+        return utils.process_text_only(combined_text)
+    return {}
+
 def show():
     # SVG Header
     st.markdown("""
@@ -26,6 +38,8 @@ def show():
     # Success Screen
     if st.session_state.get("submission_success"):
         st.success("Kintoneへの登録が完了しました！🎉")
+        if st.session_state.get("submission_warning"):
+            st.warning(st.session_state.submission_warning)
         st.balloons()
         st.info("データは正常に保存されました。続けて新しい記録を作成できます。")
         
@@ -66,7 +80,8 @@ def show():
     if "selected_client" not in st.session_state: st.session_state.selected_client = None
     
     if client_search:
-        st.session_state.client_results = utils.search_clients(client_search)
+        # Cached across reruns: widget interactions don't re-query Kintone
+        st.session_state.client_results = st_helpers.search_clients(client_search)
     
     if st.session_state.client_results:
         client_options = {f"{c['name']}": c for c in st.session_state.client_results}
@@ -79,6 +94,15 @@ def show():
         elif client_search:
              st.caption("見つかりませんでした")
 
+    if st.session_state.selected_client:
+        with st.expander("直近の履歴"):
+            history = st_helpers.fetch_client_history(st.session_state.selected_client["id"])
+            if not history:
+                st.caption("履歴がありません")
+            for item in history:
+                st.markdown(f"**{item['date']}** {item['type']} ({item['staff']})")
+                st.caption(item['content'])
+
     # STEP 2: Report Content
     tab1, tab2 = st.tabs(["音声/ファイル", "テキスト直接入力"])
     
@@ -92,47 +116,54 @@ def show():
             st.warning("取引先を選択してください")
             st.stop()
             
-        with st.spinner("解析中..."):
+        saved_file_path = None
+        file_content_txt = ""
+        if uploaded_file:
+            file_ext = uploaded_file.name.lower().split(".")[-1]
+            if file_ext in ["mp3", "wav", "m4a", "webm"]:
+                saved_file_path = utils.save_audio_file(uploaded_file)
+            elif file_ext == "txt":
+                file_content_txt = uploaded_file.read().decode("utf-8")
+
+        # Everything the result handler needs is captured now; the job itself runs in the background
+        st.session_state.pending_extraction = {
+            "client": st.session_state.selected_client,
+            "staff": staff,
+            "staff_dept": staff_dept,
+            "staff_name": staff_name,
+            "file_path": saved_file_path,
+            "file_name": uploaded_file.name if uploaded_file else None,
+        }
+        st_helpers.start_job("extraction_job", extract, saved_file_path, text_input, file_content_txt)
+        st.rerun()
+
+    finished = st_helpers.poll_job("extraction_job", "解析中...")
+    if finished:
+        pending = st.session_state.pop("pending_extraction")
+        try:
+            extracted_data = finished.result()
+            if not extracted_data:
+                st.error("AIによる抽出に失敗しました")
+        except Exception as e:
+            st.error(f"エラーが発生しました: {e}")
             extracted_data = None
-            saved_file_path = None
-            is_audio = False
-            file_content_txt = ""
-            
-            if uploaded_file:
-                file_ext = uploaded_file.name.lower().split(".")[-1]
-                if file_ext in ["mp3", "wav", "m4a", "webm"]:
-                    is_audio = True
-                    saved_file_path = utils.save_audio_file(uploaded_file)
-                elif file_ext == "txt":
-                    file_content_txt = uploaded_file.read().decode("utf-8")
-            
-            if is_audio and saved_file_path:
-                if text_input:
-                    extracted_data = utils.process_audio_and_text(saved_file_path, text_input)
-                else:
-                    extracted_data = utils.process_audio_only(saved_file_path)
-            else:
-                combined_text = (file_content_txt + "\n" + text_input).strip()
-                if combined_text:
-                    extracted_data = utils.process_text_only(combined_text)
-            
-            if extracted_data:
-                extracted_data["取引先ID"] = st.session_state.selected_client["id"]
-                extracted_data["取引先名"] = st.session_state.selected_client["name"]
-                extracted_data["対応者"] = staff
-                # 担当者詳細があれば商談内容の先頭に追記
-                staff_info_str = ""
-                if staff_dept: staff_info_str += f"{staff_dept} "
-                if staff_name: staff_info_str += f"{staff_name}様"
-                
-                if staff_info_str:
-                    current_content = extracted_data.get("商談内容", "")
-                    extracted_data["商談内容"] = f"{staff_info_str}\n{current_content}"
+        if extracted_data:
+            extracted_data["取引先ID"] = pending["client"]["id"]
+            extracted_data["取引先名"] = pending["client"]["name"]
+            extracted_data["対応者"] = pending["staff"]
+            # 担当者詳細があれば商談内容の先頭に追記
+            staff_info_str = ""
+            if pending["staff_dept"]: staff_info_str += f"{pending['staff_dept']} "
+            if pending["staff_name"]: staff_info_str += f"{pending['staff_name']}様"
 
-                st.session_state.uploaded_file_path = saved_file_path
-                st.session_state.uploaded_file_name = uploaded_file.name if uploaded_file else None
-                st.session_state.extracted_data = extracted_data
-                st.rerun()
+            if staff_info_str:
+                current_content = extracted_data.get("商談内容", "")
+                extracted_data["商談内容"] = f"{staff_info_str}\n{current_content}"
+
+            st.session_state.uploaded_file_path = pending["file_path"]
+            st.session_state.uploaded_file_name = pending["file_name"]
+            st.session_state.extracted_data = extracted_data
+            st.rerun()
 
     # STEP 3: Edit & Submit
     if "extracted_data" in st.session_state and st.session_state.extracted_data:
@@ -152,8 +183,8 @@ def show():
             default_next_date = utils.convert_date_str_safe(data.get("次回提案予定日"), lambda: date.today() + timedelta(days=7))
             data["次回提案予定日"] = st.date_input("次回予定日", value=default_next_date).strftime("%Y-%m-%d")
             ai_next_activity = data.get("次回営業件名", "架電、メール")
-            idx_next = utils.SALES_ACTIVITY_OPTIONS.index(ai_next_activity) if ai_next_activity in utils.SALES_ACTIVITY_OPTIONS else 0
-            data["次回営業件名"] = st.selectbox("次回営業件名", options=utils.SALES_ACTIVITY_OPTIONS, index=idx_next)
+            idx_next = utils.NEXT_SALES_ACTIVITY_OPTIONS.index(ai_next_activity) if ai_next_activity in utils.NEXT_SALES_ACTIVITY_OPTIONS else 0
+            data["次回営業件名"] = st.selectbox("次回営業件名", options=utils.NEXT_SALES_ACTIVITY_OPTIONS, index=idx_next)
 
         data["商談内容"] = st.text_area("商談内容", value=data.get("商談内容", ""), height=150)
         data["現在の課題・問題点"] = st.text_area("現在の課題", value=data.get("現在の課題・問題点", ""), height=80)
@@ -168,8 +199,13 @@ def show():
                 if path and name:
                      fk = utils.upload_file_to_kintone(path, name)
                      if fk: file_keys.append(fk)
-                if utils.upload_to_kintone(data, file_keys):
+                success, error_msg = utils.upload_to_kintone(data, file_keys)
+                if success:
                     st.session_state.submission_success = True
+                    st.session_state.submission_warning = error_msg  # option fields saved blank, if any
+                    st_helpers.fetch_client_history.clear()  # show the new report in the history
                     st.rerun()
+                else:
+                    st.error(f"Kintoneへの登録に失敗しました: {error_msg}")
 
 show()
\ No newline at end of file
@@ -1,7 +1,25 @@
 
 import streamlit as st
 import utils
-import google.generativeai as genai
+import st_helpers
+
+QA_PROMPT = "この音声ファイルから質疑応答を抽出してください。"
+
+def analyze(client, file_path: str = None, text: str = "") -> str:
+    # Same google.genai path as utils.process_audio_only; runs on the shared job pool
+    if file_path:
+        mime = utils.get_mime_type(file_path)
+        print(f"Uploading file: {file_path} with mime_type: {mime}")
+        uploaded_file = client.files.upload(file=file_path, config={'mime_type': mime})
+        contents = [uploaded_file, QA_PROMPT]
+    else:
+        contents = f"以下のテキストから質疑応答を抽出してください:\n\n{text}"
+    response = utils.generate_content(
+        client, "qa_seminar",
+        contents=contents,
+        config=utils.generation_config(system_instruction=get_qa_prompt())
+    )
+    return response.text
 
 def show():
     # SVG Header
@@ -31,24 +49,23 @@ def show():
             st.audio(uploaded_file)
         
         if st.button("AI解析スタート", type="primary"):
-            with st.spinner("音声を解析し、質疑応答を抽出しています..."):
-                try:
-                    file_path = utils.save_audio_file(uploaded_file)
-                    
-                    model = genai.GenerativeModel(
-                        model_name=utils.GEMINI_MODEL,
-                        system_instruction=get_qa_prompt()
-                    )
-                    
-                    myfile = genai.upload_file(file_path, mime_type=utils.get_mime_type(file_path))
-                    prompt = "この音声ファイルから質疑応答を抽出してください。"
-                    response = model.generate_content([myfile, prompt])
-                    
-                    st.markdown("### 📝 抽出結果")
-                    st.markdown(response.text)
-                    
-                except Exception as e:
-                    st.error(f"エラーが発生しました: {e}")
+            client = st_helpers.get_genai_client()
+            if file_ext == "txt":
+                st_helpers.start_job("qa_job", analyze, client, text=uploaded_file.read().decode("utf-8"))
+            else:
+                st_helpers.start_job("qa_job", analyze, client, utils.save_audio_file(uploaded_file))
+            st.rerun()
+
+    finished = st_helpers.poll_job("qa_job", "音声を解析し、質疑応答を抽出しています...", expected_seconds=120)
+    if finished:
+        try:
+            st.session_state.qa_result = finished.result()
+        except Exception as e:
+            st.error(f"エラーが発生しました: {e}")
+
+    if st.session_state.get("qa_result"):
+        st.markdown("### 📝 抽出結果")
+        st.markdown(st.session_state.qa_result)
 
 def get_qa_prompt():
     return """
@@ -0,0 +1,187 @@
+import os
+import hmac
+import time
+import hashlib
+import threading
+
+import cache
+import client_index
+import history_summary
+import report_mirror
+import startup
+import utils
+from response_cache import search_cache, search_key
+
+# =============================================================================
+# CONFIGURATION
+# =============================================================================
+# Kintone webhooks from the client app and the report app, pushed to
+# POST /webhooks/kintone, keep the local copies fresh without polling:
+# - client app: the record goes straight into the client index, and cached
+#   searches that could match its old or new name are dropped
+# - report app: the record goes straight into the report mirror, and the
+#   client's rolling summary is re-checked (or rebuilt if an already folded
+#   report was edited or deleted)
+#
+# Kintone doesn't sign webhooks, so the URL registered in Kintone carries
+# ?token=<WEBHOOK_TOKEN>. Relays (and replay_webhook.py) may instead sign the
+# raw body: X-Webhook-Signature: sha256=<HMAC-SHA256 with WEBHOOK_SECRET>.
+#
+# Missed events (receiver down, Kintone giving up on retries) are caught by a
+# reconciliation sweep every WEBHOOK_RECONCILE_INTERVAL seconds: full passes
+# over both apps, run by one worker at a time.
+
+WEBHOOK_TOKEN = os.getenv("WEBHOOK_TOKEN", "")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+SIGNATURE_HEADER = "X-Webhook-Signature"
+RECONCILE_INTERVAL = int(os.getenv("WEBHOOK_RECONCILE_INTERVAL", "3600"))
+RECONCILE_CHECK = 300        # how often each worker checks whether a sweep is due (s)
+SEEN_TTL = 86400             # notification ids remembered for deduplicating Kintone's retries
+MAX_NAME_CHARS = 64          # search keys dropped per name: every substring up to this length
+
+RECORD_EVENTS = {"ADD_RECORD", "UPDATE_RECORD", "UPDATE_STATUS"}
+DELETE_EVENT = "DELETE_RECORD"
+
+state = cache.get_cache("webhook")
+_reconciler_started = threading.Event()
+
+def enabled() -> bool:
+    return bool(WEBHOOK_TOKEN or WEBHOOK_SECRET)
+
+def verify(body: bytes, token: str = "", signature: str = "") -> bool:
+    if WEBHOOK_SECRET and signature:
+        return hmac.compare_digest(signature, sign(body))
+    return bool(WEBHOOK_TOKEN and token) and hmac.compare_digest(token, WEBHOOK_TOKEN)
+
+def sign(body: bytes, secret: str = None) -> str:
+    secret = WEBHOOK_SECRET if secret is None else secret
+    return "sha256=" + hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+
+# =============================================================================
+# INVALIDATION
+# =============================================================================
+
+def invalidate_search(names) -> int:
+    """
+    Drop cached client searches whose keyword is part of any of the names
+    (Kintone's `like` is a substring match, so those are the ones affected).
+    """
+    keys = set()
+    for name in names:
+        norm = (name or "").lower()[:MAX_NAME_CHARS]
+        for start in range(len(norm)):
+            for end in range(start + 1, len(norm) + 1):
+                key = search_key(norm[start:end])
+                if key:
+                    keys.add(key)
+    for key in keys:
+        search_cache.delete(key)
+    return len(keys)
+
+def refresh_summaries(changed: dict) -> dict:
+    """
+    changed: {client_id: lowest changed report id}, as from report_mirror.apply_changes.
+    """
+    result = {"rebuilt": [], "rechecked": []}
+    for client_id, report_id in changed.items():
+        if not client_id:
+            continue
+        summary = history_summary.load_summary(client_id)
+        if summary and report_id <= summary.get("watermark", 0):
+            # Folding only adds newer records: an edited or deleted one means starting over
+            history_summary.delete_summary(client_id)
+            result["rebuilt"].append(client_id)
+        else:
+            history_summary.invalidate(client_id)
+            result["rechecked"].append(client_id)
+    return result
+
+# =============================================================================
+# EVENTS
+# =============================================================================
+
+def _client_event(event_type: str, record: dict, record_id: str) -> dict:
+    if event_type == DELETE_EVENT:
+        names = client_index.apply_records([], [record_id])
+        if not names:
+            # Name unknown (no index yet): every cached search may list the client
+            return {"search_keys": search_cache.invalidate()}
+    else:
+        names = client_index.apply_records([record]) + [record.get("取引先名", {}).get("value", "")]
+    return {"search_keys": invalidate_search(set(names))}
+
+def _report_event(event_type: str, record: dict, record_id: str) -> dict:
+    conn = report_mirror.connect()
+    if event_type == DELETE_EVENT:
+        changed = report_mirror.apply_changes(conn, [], [int(record_id)])
+    else:
+        changed = report_mirror.apply_changes(conn, [report_mirror.parse_record(record)])
+    return refresh_summaries(changed)
+
+def handle(payload: dict) -> dict:
+    """
+    Apply one Kintone webhook notification. Duplicates (Kintone retries) and
+    events for other apps or without record changes are ignored.
+    """
+    event_type = payload.get("type", "")
+    app_id = str((payload.get("app") or {}).get("id", ""))
+    notification_id = payload.get("id", "")
+    record = payload.get("record") or {}
+    record_id = str(payload.get("recordId") or record.get("$id", {}).get("value", ""))
+
+    if event_type not in RECORD_EVENTS and event_type != DELETE_EVENT:
+        return {"ignored": f"event {event_type}"}
+    if not record_id.isdigit():
+        return {"ignored": "no record id"}
+    if notification_id and state.get(f"seen:{notification_id}"):
+        return {"ignored": "duplicate"}
+
+    if app_id and app_id == (utils.KINTONE_CLIENT_APP_ID or ""):
+        result = _client_event(event_type, record, record_id)
+    elif app_id and app_id == (utils.KINTONE_APP_ID or ""):
+        result = _report_event(event_type, record, record_id)
+    else:
+        return {"ignored": f"app {app_id}"}
+
+    if notification_id:
+        state.set(f"seen:{notification_id}", 1, ttl=SEEN_TTL)
+    print(f"Webhook: {event_type} app={app_id} record={record_id} {result}")
+    return dict(result, type=event_type, app=app_id, record_id=record_id)
+
+# =============================================================================
+# RECONCILIATION
+# =============================================================================
+
+def reconcile() -> dict:
+    """
+    Full pass over both apps for events that never arrived.
+    """
+    state.set("reconciled_at", time.time())  # first, so other workers don't start the same sweep
+    client_index.refresh(full=True)
+    mirror = report_mirror.sync(full=True)
+    return {
+        # Client renames aren't diffed here; search entries only live SEARCH_RESULTS_TTL anyway
+        "search_keys": search_cache.invalidate(),
+        "mirror": {k: v for k, v in mirror.items() if k != "changed"},
+        "summaries": refresh_summaries(mirror.get("changed", {})),
+    }
+
+def reconcile_due() -> bool:
+    return time.time() - float(state.get("reconciled_at") or 0) >= RECONCILE_INTERVAL
+
+def _reconcile_loop():
+    while True:
+        time.sleep(min(RECONCILE_CHECK, RECONCILE_INTERVAL))
+        try:
+            if reconcile_due():
+                print(f"Webhook Reconcile: {reconcile()}")
+        except Exception as e:
+            print(f"Webhook Reconcile Error: {e}")
+
+@startup.on_worker_start
+def start_reconciler():
+    # Without webhooks the regular TTL syncs already do this work
+    if not enabled() or _reconciler_started.is_set():
+        return
+    _reconciler_started.set()
+    threading.Thread(target=_reconcile_loop, daemon=True, name="webhook-reconcile").start()